@@ -1,10 +1,8 @@
 # Initialize the app package
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 import os
 
-from app.config import settings
+from app.config import get_settings
 from app.db import init_db
 from app.routes import register_routes
 from app.middleware import setup_middleware
@@ -14,7 +12,7 @@ def create_app():
     app = FastAPI()
     
     # Ensure uploads directory exists
-    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+    os.makedirs(get_settings().UPLOAD_DIR, exist_ok=True)
     
     # Initialize database
     init_db()
@@ -22,9 +20,6 @@ def create_app():
     # Configure middleware
     setup_middleware(app)
     
-    # Mount static files
-    app.mount("/uploads", StaticFiles(directory=settings.UPLOAD_DIR), name="uploads")
-    
     # Register routes
     register_routes(app)
     
@@ -0,0 +1,33 @@
+"""Maintenance commands for the upload store.
+
+    python -m app migrate-layout   move slug folders into the sharded layout
+    python -m app scan-orphans     remove files and folders the DB doesn't know
+"""
+import argparse
+
+from app.config import get_settings
+from app.services.layout import SHARD_COUNT, migrate_layout, scan_orphans
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app", description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    m = commands.add_parser("migrate-layout", help="move files from UPLOAD_DIR/<slug>/ to UPLOAD_DIR/ab/cd/<slug>/")
+    m.add_argument("--grace", type=float, default=get_settings().LINK_CACHE_TTL + 5,
+                   help="seconds to keep the old paths for running workers (default: LINK_CACHE_TTL + 5)")
+    m.add_argument("--batch", type=int, default=500, help="rows updated per transaction")
+
+    s = commands.add_parser("scan-orphans", help="reconcile shard folders with the DB")
+    s.add_argument("--start", type=int, default=0, help="first shard index (0-65535)")
+    s.add_argument("--shards", type=int, default=SHARD_COUNT, help="shard folders to scan (default: all)")
+
+    args = parser.parse_args(argv)
+    if args.command == "migrate-layout":
+        moved = migrate_layout(args.grace, args.batch)
+        print(f"Moved {moved} files")
+    elif args.command == "scan-orphans":
+        next_start, removed = scan_orphans(args.start, args.shards)
+        print(f"Removed {removed} entries; next shard {next_start}")
+
+if __name__ == "__main__":
+    main()
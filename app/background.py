@@ -1,24 +1,197 @@
+import os
+import socket
 import threading
 import time
-from datetime import datetime
-from app.db import get_all_links, delete_link
-from app.utils.file_utils import cleanup_files
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from app.config import get_settings
+from app.db import (
+    get_expired_links, delete_expired_links, get_next_expiry,
+    get_stale_sessions, delete_upload_sessions, acquire_lease,
+    claim_job, finish_job, retry_job,
+)
+from app.services.link_cache import invalidate_link
+from app.services.metrics import (
+    JOB_SECONDS, JOBS_FINISHED, LINKS_EVICTED, REAPER_LINKS_DELETED, REAPER_SWEEP_SECONDS, timed,
+)
+from app.services.postprocess import JOB_HANDLERS, prune_previews
+from app.services.layout import scan_orphans
+from app.services.download_stats import flush_stats
+from app.storage import get_storage
+from app.utils.file_utils import cleanup_files, session_part_path, remove_files
+
+# Identifies this process when several workers or hosts share the database
+REAPER_HOLDER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Set when this process queues a job, so idle job workers start right away
+_jobs_queued = threading.Event()
+
+def cleanup_stale_sessions():
+    """Drop resumable upload sessions that were never finalized."""
+    before = datetime.utcnow() - timedelta(hours=get_settings().RESUMABLE_SESSION_HOURS)
+    session_ids = get_stale_sessions(before)
+    remove_files([session_part_path(i) for i in session_ids])
+    delete_upload_sessions(session_ids)
+
+def sweep_expired(executor):
+    """Delete every link that has expired so far, one batch at a time.
+
+    Only expired rows are read (via the expiry index), the rows are removed
+    in one transaction per batch and their files are then unlinked in
+    parallel on ``executor``. Returns the number of links deleted.
+    """
+    now = datetime.utcnow()
+    deleted = 0
+    while True:
+        batch = get_expired_links(now, get_settings().REAPER_BATCH_SIZE)
+        if not batch:
+            return deleted
+        count = _delete_links(executor.map, batch, now)
+        REAPER_LINKS_DELETED.inc(count)
+        deleted += count
+        if len(batch) < get_settings().REAPER_BATCH_SIZE:
+            return deleted
+
+def _delete_links(map_func, batch, now):
+    # Rows go first, so only files of links that were really deleted are
+    # unlinked: a slug re-uploaded meanwhile keeps its new files at the same
+    # paths. Files left behind by a crash are found by the orphan scan.
+    deleted = delete_expired_links(batch, now)
+    for slug, _ in deleted:
+        invalidate_link(slug)
+    released = map_func(lambda item: cleanup_files(*item), deleted)
+    released = [sha256 for shas in released for sha256 in shas]
+    # Shared content can only be dropped once no row refers to it
+    get_storage().prune(released)
+    prune_previews(released)
+    return len(deleted)
+
+def evict_links(has_room, batch_size=20):
+    """Delete the links closest to expiry until ``has_room()`` is true.
+
+    Used under disk pressure when EVICT_ON_PRESSURE is on. Returns whether
+    enough room was made.
+    """
+    while not has_room():
+        # With no cutoff, the expiry index yields the soonest-to-expire links
+        batch = get_expired_links(datetime.max, batch_size)
+        if not batch:
+            return False
+        for item in batch:
+            if has_room():
+                return True
+            _delete_links(map, [item], datetime.max)
+            LINKS_EVICTED.inc()
+    return True
+
+def seconds_until_next_sweep():
+    """Sleep until the next link expires, but never longer than REAPER_MAX_SLEEP.
+
+    The lease holder also wakes up in time to renew its lease.
+    """
+    settings = get_settings()
+    max_sleep = min(settings.REAPER_MAX_SLEEP, settings.REAPER_LEASE_SECONDS / 2)
+    next_expiry = get_next_expiry()
+    if next_expiry is None:
+        return max_sleep
+    delay = (next_expiry - datetime.utcnow()).total_seconds()
+    return min(max(delay, 1), max_sleep)
 
 def cleanup_expired():
-    """Background task to clean up expired links and files."""
+    """Background task to clean up expired links and files.
+
+    Every worker runs this loop, but only the one holding the ``reaper``
+    lease sweeps; the others retry when the lease may have lapsed. Each
+    sweep also checks the next ORPHAN_SCAN_SHARDS shard folders for files
+    the DB doesn't know about.
+    """
+    settings = get_settings()
+    orphan_scan_at = 0
+    with ThreadPoolExecutor(max_workers=settings.REAPER_UNLINK_WORKERS) as executor:
+        while True:
+            delay = settings.REAPER_LEASE_SECONDS / 2
+            try:
+                if acquire_lease("reaper", REAPER_HOLDER, settings.REAPER_LEASE_SECONDS):
+                    with timed(REAPER_SWEEP_SECONDS):
+                        sweep_expired(executor)
+                    cleanup_stale_sessions()
+                    if settings.ORPHAN_SCAN_SHARDS:
+                        orphan_scan_at, _ = scan_orphans(orphan_scan_at, settings.ORPHAN_SCAN_SHARDS)
+                    delay = seconds_until_next_sweep()
+            except Exception as e:
+                print(f"Cleanup error: {str(e)}")
+            time.sleep(delay)
+
+def notify_jobs():
+    """Wake this process's job workers; other processes find the job on their next poll."""
+    _jobs_queued.set()
+
+def run_job(holder):
+    """Claim and run one due job. Returns False when none was waiting.
+
+    A failed job is retried with exponential backoff until JOB_MAX_ATTEMPTS,
+    then dropped: post-processing only adds to a link that already works.
+    """
+    job = claim_job(holder, get_settings().JOB_LEASE_SECONDS)
+    if job is None:
+        return False
+    job_id, kind, slug, attempts = job
+    try:
+        with timed(JOB_SECONDS, kind=kind):
+            JOB_HANDLERS[kind](slug)
+    except Exception as e:
+        if attempts >= get_settings().JOB_MAX_ATTEMPTS:
+            print(f"Job {kind} for {slug} failed: {str(e)}")
+            finish_job(job_id, holder)
+            JOBS_FINISHED.inc(kind=kind, outcome="failed")
+        else:
+            delay = 10 * 2 ** (attempts - 1)
+            retry_job(job_id, holder, datetime.utcnow() + timedelta(seconds=delay))
+            JOBS_FINISHED.inc(kind=kind, outcome="retried")
+    else:
+        finish_job(job_id, holder)
+        JOBS_FINISHED.inc(kind=kind, outcome="done")
+    return True
+
+def process_jobs(holder):
+    """Job worker loop: run due jobs until none is left, then wait for more."""
+    while True:
+        try:
+            if run_job(holder):
+                continue
+        except Exception as e:
+            print(f"Job worker error: {str(e)}")
+        _jobs_queued.wait(get_settings().JOB_POLL_SECONDS)
+        _jobs_queued.clear()
+
+def flush_stats_periodically():
+    """Write each worker's buffered download and view counts every STATS_FLUSH_SECONDS."""
     while True:
-        now = datetime.utcnow()
-        rows = get_all_links()
-        for slug, expiry, files_json in rows:
-            if expiry and now > datetime.fromisoformat(expiry):
-                # Delete files
-                cleanup_files(slug, files_json)
-                # Remove DB entry
-                delete_link(slug)
-        time.sleep(24 * 60 * 60)  # Run once a day
+        time.sleep(get_settings().STATS_FLUSH_SECONDS)
+        try:
+            flush_stats()
+        except Exception as e:
+            print(f"Stats flush error: {str(e)}")
 
 def start_background_tasks(app):
     @app.on_event("startup")
     def start_cleanup_thread():
         t = threading.Thread(target=cleanup_expired, daemon=True)
         t.start()
+
+    @app.on_event("startup")
+    def start_job_workers():
+        for n in range(get_settings().JOB_WORKERS):
+            t = threading.Thread(target=process_jobs, args=(f"{REAPER_HOLDER}/{n}",),
+                                 name=f"jobs-{n}", daemon=True)
+            t.start()
+
+    @app.on_event("startup")
+    def start_stats_flusher():
+        t = threading.Thread(target=flush_stats_periodically, name="stats", daemon=True)
+        t.start()
+
+    @app.on_event("shutdown")
+    def flush_stats_on_shutdown():
+        flush_stats()
@@ -1,4 +1,4 @@
-import os
+from functools import lru_cache
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -7,10 +7,54 @@ class Settings(BaseSettings):
     MAX_SIZE: int = 50 * 1024 * 1024  # 50MB
     MAX_FILES: int = 50
     DATABASE_URL: str = "files.db"
+    DB_BUSY_TIMEOUT_MS: int = 5000  # How long a writer waits for SQLite's lock
     UPLOAD_PASSWORD: str = "123"  # Change this to a secure password in production
+    UPLOAD_PASSWORD_HASH: str = ""  # bcrypt hash of the password; used instead of UPLOAD_PASSWORD when set
+    PASSWORD_CACHE_SECONDS: int = 5 * 60  # A password that matched skips bcrypt for this long
+    PASSWORD_CHECK_WORKERS: int = 2  # Threads running bcrypt checks
+    AUTH_FAILURE_BURST: int = 10  # Wrong passwords a client IP may send before it gets 429s
+    AUTH_FAILURES_PER_MINUTE: int = 5  # Rate at which a client IP earns back attempts
     MAX_EXPIRY_DAYS: int = 7
+    REAPER_BATCH_SIZE: int = 500  # Expired links deleted per transaction
+    REAPER_MAX_SLEEP: int = 60 * 60  # Seconds between sweeps when nothing is about to expire
+    REAPER_UNLINK_WORKERS: int = 4  # Threads removing expired files in parallel
+    RESUMABLE_MAX_SIZE: int = 1024 * 1024 * 1024  # 1GB per slug for resumable uploads
+    DISK_IO_WORKERS: int = 4  # Threads doing blocking disk I/O for uploads
+    DEDUP_UPLOADS: bool = True  # Store identical uploads once and hard link them into slugs
+    LINK_CACHE_SIZE: int = 1024  # Slugs whose metadata and page are kept in memory
+    LINK_CACHE_TTL: int = 60  # Seconds; entries also never outlive the link's expiry
+    ACCEL_REDIRECT_PREFIX: str = ""  # e.g. "/protected-uploads/" to let nginx send file bodies
+    RESUMABLE_SESSION_HOURS: int = 24  # Unfinished upload sessions are dropped after this
+    STORAGE_BACKEND: str = "local"  # "local" (UPLOAD_DIR) or "s3" (any S3-compatible store, needs boto3)
+    S3_BUCKET: str = ""
+    S3_ENDPOINT_URL: str = ""  # e.g. http://minio:9000; empty for AWS
+    S3_REGION: str = ""
+    S3_PREFIX: str = ""  # Key prefix inside the bucket, e.g. "fileshare/"
+    S3_URL_EXPIRY: int = 60 * 60  # Seconds presigned download URLs stay valid
+    S3_CLAIM_SECONDS: int = 10 * 60  # Unreferenced objects an upload claimed this recently are not deleted
+    REAPER_LEASE_SECONDS: int = 10 * 60  # Only the worker holding this lease sweeps expired links
+    ORPHAN_SCAN_SHARDS: int = 256  # Shard folders (of 65536) checked for untracked files per sweep; 0 disables
+    ORPHAN_GRACE_SECONDS: int = 24 * 60 * 60  # Untracked files younger than this may be uploads in progress
+    SLUG_QUOTA: int = 1024 * 1024 * 1024  # 1GB stored per slug, merges included; 0 disables
+    DISK_BUDGET: int = 0  # Total bytes of stored files and upload sessions; 0 disables
+    DISK_MIN_FREE: int = 256 * 1024 * 1024  # Uploads are refused (507) below this much free space
+    EVICT_ON_PRESSURE: bool = False  # Delete the links closest to expiry instead of refusing uploads
+    STATIC_CACHE_SECONDS: int = 7 * 24 * 60 * 60  # Cache-Control max-age for the favicon and image previews
+    FORM_CACHE_SECONDS: int = 5 * 60  # Cache-Control max-age for the upload form
+    TIMING_SPANS: bool = False  # Add a Server-Timing header with per-phase upload timings
+    BATCH_MAX_LINKS: int = 1000  # Links per call of the JSON batch API
+    BATCH_MAX_BYTES: int = 64 * 1024 * 1024  # Body limit for batch creates (base64 file content included)
+    JOB_WORKERS: int = 2  # Threads running post-upload jobs (checksums, previews)
+    JOB_POLL_SECONDS: int = 5  # How often idle job workers look for jobs queued by other processes
+    JOB_LEASE_SECONDS: int = 10 * 60  # A claimed job is retried if not finished within this
+    JOB_MAX_ATTEMPTS: int = 5  # Failed jobs are retried with backoff, then dropped
+    PREVIEW_SIZE: int = 320  # Longest side in pixels of image previews (needs Pillow)
+    STATS_FLUSH_SECONDS: int = 30  # How often buffered download and view counts are written to the DB
     
     class Config:
         env_file = ".env"
         
-settings = Settings()
+@lru_cache(maxsize=None)
+def get_settings():
+    """Read the environment and .env on first use instead of at import."""
+    return Settings()
@@ -1,54 +1,761 @@
+import functools
 import sqlite3
+import threading
+import time
 from contextlib import contextmanager
 import json
-from datetime import datetime
-from app.config import settings
+import os
+from datetime import datetime, timedelta
+from starlette.concurrency import run_in_threadpool
+from app.config import get_settings
+from app.services.metrics import DB_QUERY_SECONDS
 
-# Global connection
-conn = None
-cur = None
+# One connection per thread: sqlite3 connections are not safe to share, and
+# in WAL mode readers on separate connections don't block each other or the
+# single writer.
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
 
-def init_db():
-    global conn, cur
-    conn = sqlite3.connect(settings.DATABASE_URL, check_same_thread=False)
-    cur = conn.cursor()
-    
-    # Create tables if they don't exist
-    cur.execute("""CREATE TABLE IF NOT EXISTS links (
+def _connect():
+    settings = get_settings()
+    conn = sqlite3.connect(
+        settings.DATABASE_URL,
+        timeout=settings.DB_BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None,  # Transactions are opened explicitly
+        cached_statements=256,  # Prepared statements reused per connection
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(settings.DB_BUSY_TIMEOUT_MS)}")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.execute("PRAGMA recursive_triggers=ON")  # REPLACE deletions update storage_usage too
+    return conn
+
+def get_connection():
+    """Return this thread's connection, opening it on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        if not _schema_ready:
+            init_db()
+        conn = _local.conn = _connect()
+    return conn
+
+def _version_trigger(name, event, row):
+    return f"""CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} BEGIN
+        UPDATE link_versions SET counter = counter + 1 WHERE id = 1;
+        UPDATE links SET version = (SELECT counter FROM link_versions WHERE id = 1) WHERE slug = {row}.slug;
+    END"""
+
+# Bump when the schema changes and add the upgrade step to _migrate()
+SCHEMA_VERSION = 10
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS links (
         slug TEXT PRIMARY KEY,
-        expiry TIMESTAMP,
-        files TEXT
-    )""")
-    conn.commit()
+        expiry TIMESTAMP NOT NULL,
+        created TIMESTAMP,
+        views INTEGER NOT NULL DEFAULT 0,
+        zip_downloads INTEGER NOT NULL DEFAULT 0,
+        version INTEGER NOT NULL DEFAULT 0
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_links_expiry ON links (expiry)",
+    """CREATE TABLE IF NOT EXISTS files (
+        id INTEGER PRIMARY KEY,
+        slug TEXT NOT NULL REFERENCES links (slug) ON DELETE CASCADE,
+        name TEXT NOT NULL,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime REAL,
+        sha256 TEXT,
+        mime_type TEXT,
+        crc32 INTEGER,
+        preview INTEGER NOT NULL DEFAULT 0,
+        downloads INTEGER NOT NULL DEFAULT 0,
+        UNIQUE (slug, name)
+    )""",
+    # Reference counts of shared content (previews, stored objects)
+    "CREATE INDEX IF NOT EXISTS idx_files_sha256 ON files (sha256)",
+    """CREATE TABLE IF NOT EXISTS upload_sessions (
+        id TEXT PRIMARY KEY,
+        slug TEXT NOT NULL,
+        filename TEXT NOT NULL,
+        length INTEGER NOT NULL,
+        upload_offset INTEGER NOT NULL DEFAULT 0,
+        created TIMESTAMP,
+        writer TEXT,  -- PATCH currently appending, until writer_until
+        writer_until TIMESTAMP,
+        token_hash TEXT,  -- SHA-256 of the secret that PATCH, HEAD and DELETE must send
+        state TEXT NOT NULL DEFAULT 'open',  -- 'finalizing' once a finalize call took it
+        UNIQUE (slug, filename)
+    )""",
+    # Running total of files.size, kept by triggers so quota checks are O(1)
+    """CREATE TABLE IF NOT EXISTS storage_usage (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        bytes INTEGER NOT NULL
+    )""",
+    "INSERT OR IGNORE INTO storage_usage (id, bytes) SELECT 1, COALESCE(SUM(size), 0) FROM files",
+    """CREATE TRIGGER IF NOT EXISTS files_usage_insert AFTER INSERT ON files BEGIN
+        UPDATE storage_usage SET bytes = bytes + NEW.size WHERE id = 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS files_usage_delete AFTER DELETE ON files BEGIN
+        UPDATE storage_usage SET bytes = bytes - OLD.size WHERE id = 1;
+    END""",
+    # links.version is set from a counter on every change to the link or its
+    # files (not its download counts), so any worker can tell whether its
+    # cached copy of a link is current with one primary-key lookup
+    """CREATE TABLE IF NOT EXISTS link_versions (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        counter INTEGER NOT NULL
+    )""",
+    "INSERT OR IGNORE INTO link_versions (id, counter) VALUES (1, 0)",
+    _version_trigger("links_version_insert", "INSERT ON links", "NEW"),
+    _version_trigger("links_version_update", "UPDATE OF expiry ON links", "NEW"),
+    _version_trigger("files_version_insert", "INSERT ON files", "NEW"),
+    _version_trigger("files_version_update",
+                     "UPDATE OF path, size, mtime, sha256, mime_type, crc32, preview ON files", "NEW"),
+    _version_trigger("files_version_delete", "DELETE ON files", "OLD"),
+    """CREATE TABLE IF NOT EXISTS leases (
+        name TEXT PRIMARY KEY,
+        holder TEXT NOT NULL,
+        expires TIMESTAMP NOT NULL
+    )""",
+    # Post-upload work, claimed by job workers until run_after passes again
+    """CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL,
+        slug TEXT NOT NULL REFERENCES links (slug) ON DELETE CASCADE,
+        run_after TIMESTAMP NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        holder TEXT,
+        UNIQUE (kind, slug)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_jobs_run_after ON jobs (run_after)",
+    # Content stored in object storage: "uploading", "stored" or "deleting",
+    # with the time it was last claimed by an upload or marked for deletion
+    """CREATE TABLE IF NOT EXISTS stored_blobs (
+        sha256 TEXT PRIMARY KEY,
+        state TEXT NOT NULL,
+        updated TIMESTAMP NOT NULL
+    )""",
+]
+
+# Columns added to existing tables since they were first created
+_ADDED_COLUMNS = {
+    "links": [
+        ("views", "INTEGER NOT NULL DEFAULT 0"), ("zip_downloads", "INTEGER NOT NULL DEFAULT 0"),
+        ("version", "INTEGER NOT NULL DEFAULT 0"),
+    ],
+    "files": [
+        ("crc32", "INTEGER"), ("preview", "INTEGER NOT NULL DEFAULT 0"),
+        ("downloads", "INTEGER NOT NULL DEFAULT 0"),
+    ],
+    "upload_sessions": [
+        ("writer", "TEXT"), ("writer_until", "TIMESTAMP"), ("token_hash", "TEXT"),
+        ("state", "TEXT NOT NULL DEFAULT 'open'"),
+    ],
+}
+
+def _migrate_legacy_links(conn):
+    """Move the JSON ``links.files`` column of pre-versioned databases into ``files`` rows."""
+    from app.utils.file_utils import describe_file, file_sha256
+
+    conn.execute("ALTER TABLE links RENAME TO links_legacy")
+    for statement in _SCHEMA:
+        conn.execute(statement)
+    rows = conn.execute("SELECT slug, expiry, files FROM links_legacy").fetchall()
+    for slug, expiry, files_json in rows:
+        conn.execute("INSERT INTO links (slug, expiry) VALUES (?, ?)", (slug, expiry))
+        for path in json.loads(files_json) if files_json else []:
+            if not os.path.isfile(path):
+                continue
+            _insert_file(conn, slug, describe_file(path, file_sha256(path)))
+    conn.execute("DROP TABLE links_legacy")
+
+def _migrate(conn):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Re-check under the write lock in case another process got here first
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(links)")]
+            if "files" in columns:
+                _migrate_legacy_links(conn)
+        for table, added in _ADDED_COLUMNS.items():
+            columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+            if columns:
+                for name, definition in added:
+                    if name not in columns:
+                        conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+        for statement in _SCHEMA:
+            conn.execute(statement)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+
+def init_db():
+    global _schema_ready
+    with _schema_lock:
+        conn = _connect()
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                _migrate(conn)
+        finally:
+            conn.close()
+        _schema_ready = True
 
 @contextmanager
 def get_cursor():
-    global conn, cur
-    if not conn:
-        init_db()
+    cursor = get_connection().cursor()
     try:
-        yield cur
+        yield cursor
     finally:
-        pass  # Connection is managed globally
+        cursor.close()
 
-def save_link(slug, files, days):
-    expiry = datetime.utcnow() + datetime.timedelta(days=days)
-    with get_cursor() as cursor:
-        cursor.execute("INSERT OR REPLACE INTO links (slug, expiry, files) VALUES (?, ?, ?)",
-                    (slug, expiry.isoformat(), json.dumps(files)))
+@contextmanager
+def transaction():
+    """Run the enclosed statements in one write transaction.
+
+    ``BEGIN IMMEDIATE`` takes the write lock up front so concurrent writers
+    wait on busy_timeout instead of failing on a lock upgrade.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        yield cursor
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
         conn.commit()
+    finally:
+        cursor.close()
+
+async def run_db(func, *args, **kwargs):
+    """Call a blocking DB helper from async code without stalling the event loop."""
+    return await run_in_threadpool(func, *args, **kwargs)
+
+def _timed(func):
+    """Record the duration of a DB helper under its function name."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - start, query=func.__name__)
+    return wrapper
+
+def _insert_file(cursor, slug, f):
+    cursor.execute("""INSERT OR REPLACE INTO files (slug, name, path, size, mtime, sha256, mime_type, crc32)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                   (slug, f["name"], f["path"], f["size"], f.get("mtime"), f.get("sha256"), f.get("mime_type"),
+                    f.get("crc32")))
+
+@_timed
+def save_link(slug, files, days, jobs=()):
+    """Create or replace a link with the given file records (see ``describe_file``).
+
+    ``jobs`` are the kinds of post-upload job to queue for the slug, in the
+    same transaction. Returns the records (``path`` and ``sha256``) of the
+    files of a replaced link, for the caller to release.
+    """
+    now = datetime.utcnow()
+    expiry = now + timedelta(days=days)
+    with transaction() as cursor:
+        cursor.execute("SELECT path, sha256 FROM files WHERE slug=?", (slug,))
+        dropped = cursor.fetchall()
+        # Replacing the link cascades to its old file rows
+        cursor.execute("DELETE FROM links WHERE slug=?", (slug,))
+        _insert_link(cursor, slug, files, expiry, jobs, now)
+    return [{"path": path, "sha256": sha256} for path, sha256 in dropped]
+
+@_timed
+def merge_link(slug, files, days, jobs=()):
+    """Add files to a live link, or create the link, in one transaction.
 
+    Files with the same name as existing ones replace them and the expiry
+    is reset to ``days`` from now; an expired link with the slug is
+    replaced. Returns ``(stale, sha256s)``: the dropped file records whose
+    paths no row of the slug uses any more, for the caller to release, and
+    the hashes of every dropped row, to prune.
+    """
+    now = datetime.utcnow()
+    expiry = now + timedelta(days=days)
+    with transaction() as cursor:
+        cursor.execute("SELECT expiry FROM links WHERE slug=?", (slug,))
+        row = cursor.fetchone()
+        names = [f["name"] for f in files]
+        if row and row[0] > now.isoformat():
+            cursor.execute(f"""SELECT path, sha256 FROM files
+                               WHERE slug=? AND name IN ({','.join('?' * len(names))})""", [slug, *names])
+            dropped = cursor.fetchall()
+            cursor.execute("UPDATE links SET expiry=? WHERE slug=?", (expiry.isoformat(), slug))
+            for f in files:
+                _insert_file(cursor, slug, f)
+            _enqueue_jobs(cursor, slug, jobs, now)
+        else:
+            cursor.execute("SELECT path, sha256 FROM files WHERE slug=?", (slug,))
+            dropped = cursor.fetchall()
+            # Replacing the link cascades to its old file rows
+            cursor.execute("DELETE FROM links WHERE slug=?", (slug,))
+            _insert_link(cursor, slug, files, expiry, jobs, now)
+        cursor.execute("SELECT path FROM files WHERE slug=?", (slug,))
+        in_use = {path for path, in cursor.fetchall()}
+    stale = [{"path": path, "sha256": sha256} for path, sha256 in dropped if path not in in_use]
+    return stale, [sha256 for _, sha256 in dropped]
+
+def _insert_link(cursor, slug, files, expiry, jobs, now):
+    cursor.execute("INSERT INTO links (slug, expiry, created) VALUES (?, ?, ?)",
+                (slug, expiry.isoformat(), now.isoformat()))
+    for f in files:
+        _insert_file(cursor, slug, f)
+    _enqueue_jobs(cursor, slug, jobs, now)
+
+@_timed
+def save_links(links):
+    """Create many links in one transaction; ``links`` holds ``(slug, files, days, jobs)``.
+
+    Expired links with the same slug are replaced. A slug that is still live
+    raises ``sqlite3.IntegrityError`` and nothing is saved. Returns
+    ``(expiries, replaced)``: the new expiries, in order, and
+    ``{slug: file records}`` of the replaced links, for the caller to
+    release once this has committed.
+    """
+    now = datetime.utcnow()
+    expiries = []
+    replaced = {}
+    with transaction() as cursor:
+        for slug, files, days, jobs in links:
+            cursor.execute("""SELECT f.path, f.sha256 FROM files f JOIN links l ON l.slug = f.slug
+                              WHERE l.slug=? AND l.expiry <= ?""", (slug, now.isoformat()))
+            dropped = cursor.fetchall()
+            cursor.execute("DELETE FROM links WHERE slug=? AND expiry <= ?", (slug, now.isoformat()))
+            if cursor.rowcount:
+                replaced[slug] = [{"path": path, "sha256": sha256} for path, sha256 in dropped]
+            expiry = now + timedelta(days=days)
+            _insert_link(cursor, slug, files, expiry, jobs, now)
+            expiries.append(expiry.isoformat())
+    return expiries, replaced
+
+@_timed
+def extend_links(slugs, expiry):
+    """Move the expiry of the given live links to ``expiry`` unless they already last longer.
+
+    Runs in one transaction and returns the slugs that exist and have not expired.
+    """
+    now = datetime.utcnow().isoformat()
+    found = []
+    with transaction() as cursor:
+        for slug in slugs:
+            cursor.execute("UPDATE links SET expiry=MAX(expiry, ?) WHERE slug=? AND expiry > ?",
+                           (expiry.isoformat(), slug, now))
+            if cursor.rowcount:
+                found.append(slug)
+    return found
+
+@_timed
+def list_links(after, limit):
+    """Live links ordered by slug, starting after ``after`` (keyset pagination).
+
+    Returns ``[(slug, expiry, created, file_count, total_size, views, zip_downloads,
+    file_downloads)]``.
+    """
+    with get_cursor() as cursor:
+        cursor.execute("""SELECT l.slug, l.expiry, l.created, COUNT(f.id), COALESCE(SUM(f.size), 0),
+                                 l.views, l.zip_downloads, COALESCE(SUM(f.downloads), 0)
+                          FROM links l LEFT JOIN files f ON f.slug = l.slug
+                          WHERE l.slug > ? AND l.expiry > ?
+                          GROUP BY l.slug ORDER BY l.slug LIMIT ?""",
+                       (after, datetime.utcnow().isoformat(), limit))
+        return cursor.fetchall()
+
+@_timed
+def get_link_expiries(slugs):
+    """Return ``{slug: expiry}`` for those of ``slugs`` that exist."""
+    expiries = {}
+    with get_cursor() as cursor:
+        # Stay well under SQLite's limit on bound parameters
+        for i in range(0, len(slugs), 500):
+            chunk = slugs[i:i + 500]
+            cursor.execute(f"SELECT slug, expiry FROM links WHERE slug IN ({','.join('?' * len(chunk))})", chunk)
+            expiries.update(cursor.fetchall())
+    return expiries
+
+_FILE_COLUMNS = ("name", "path", "size", "mtime", "sha256", "mime_type", "crc32", "preview")
+
+def _file_dict(row):
+    return dict(zip(_FILE_COLUMNS, row))
+
+@_timed
 def get_link(slug):
+    """Return ``(expiry, files)`` for a slug, or None. ``files`` is a list of dicts."""
     with get_cursor() as cursor:
-        cursor.execute("SELECT expiry, files FROM links WHERE slug=?", (slug,))
-        return cursor.fetchone()
+        cursor.execute("""SELECT l.expiry, f.name, f.path, f.size, f.mtime, f.sha256, f.mime_type, f.crc32, f.preview
+                          FROM links l LEFT JOIN files f ON f.slug = l.slug
+                          WHERE l.slug=? ORDER BY f.id""", (slug,))
+        rows = cursor.fetchall()
+    if not rows:
+        return None
+    files = [_file_dict(row[1:]) for row in rows if row[1] is not None]
+    return rows[0][0], files
 
-def delete_link(slug):
+@_timed
+def get_link_version(slug):
+    """Return the version stamp of a slug's link, or None if there is none."""
     with get_cursor() as cursor:
+        cursor.execute("SELECT version FROM links WHERE slug=?", (slug,))
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+@_timed
+def delete_link(slug):
+    with transaction() as cursor:
         cursor.execute("DELETE FROM links WHERE slug=?", (slug,))
-        conn.commit()
 
-def get_all_links():
+@_timed
+def get_expired_links(now, limit=None):
+    """Return the slugs of up to ``limit`` links whose expiry has passed, soonest first."""
     with get_cursor() as cursor:
-        cursor.execute("SELECT slug, expiry, files FROM links")
+        cursor.execute("SELECT slug FROM links WHERE expiry <= ? ORDER BY expiry, slug LIMIT ?",
+                       (now.isoformat(), -1 if limit is None else limit))
+        return [slug for slug, in cursor.fetchall()]
+
+@_timed
+def delete_expired_links(slugs, now):
+    """Delete the given links in one transaction, skipping any renewed since ``now``.
+
+    Returns ``[(slug, files)]`` for the links actually deleted, each file a
+    dict with its ``path`` and ``sha256``. Their files are read in the same
+    transaction, so a link replaced by a new upload meanwhile never has the
+    new files listed.
+    """
+    deleted = []
+    with transaction() as cursor:
+        for slug in slugs:
+            cursor.execute("""SELECT f.path, f.sha256 FROM links l LEFT JOIN files f ON f.slug = l.slug
+                              WHERE l.slug=? AND l.expiry <= ?""", (slug, now.isoformat()))
+            rows = cursor.fetchall()
+            if not rows:
+                continue
+            cursor.execute("DELETE FROM links WHERE slug=?", (slug,))
+            deleted.append((slug, [{"path": path, "sha256": sha256} for path, sha256 in rows if path is not None]))
+    return deleted
+
+@_timed
+def get_next_expiry():
+    """Earliest expiry among stored links, or None."""
+    with get_cursor() as cursor:
+        cursor.execute("SELECT MIN(expiry) FROM links")
+        value = cursor.fetchone()[0]
+    return datetime.fromisoformat(value) if value else None
+
+def _count_references(cursor, sha256s):
+    counts = {}
+    # Stay well under SQLite's limit on bound parameters
+    for i in range(0, len(sha256s), 500):
+        chunk = sha256s[i:i + 500]
+        cursor.execute(f"""SELECT sha256, COUNT(*) FROM files
+                           WHERE sha256 IN ({','.join('?' * len(chunk))}) GROUP BY sha256""", chunk)
+        counts.update(cursor.fetchall())
+    return counts
+
+@_timed
+def count_file_references(sha256s):
+    """Return ``{sha256: number of stored files with that content}`` for the referenced ones of ``sha256s``."""
+    with get_cursor() as cursor:
+        return _count_references(cursor, list(sha256s))
+
+@_timed
+def acquire_lease(name, holder, seconds):
+    """Take or renew the named lease for ``holder``; False while someone else holds it."""
+    now = datetime.utcnow()
+    with transaction() as cursor:
+        cursor.execute("""INSERT INTO leases (name, holder, expires) VALUES (?, ?, ?)
+                          ON CONFLICT (name) DO UPDATE SET holder=excluded.holder, expires=excluded.expires
+                          WHERE leases.expires <= ? OR leases.holder = excluded.holder""",
+                       (name, holder, (now + timedelta(seconds=seconds)).isoformat(), now.isoformat()))
+        return cursor.rowcount > 0
+
+@_timed
+def release_lease(name, holder):
+    with transaction() as cursor:
+        cursor.execute("DELETE FROM leases WHERE name=? AND holder=?", (name, holder))
+
+@_timed
+def get_stored_bytes():
+    """Bytes of all stored files, each counted once per link that has it (kept up to date by triggers)."""
+    with get_cursor() as cursor:
+        cursor.execute("SELECT bytes FROM storage_usage WHERE id = 1")
+        return cursor.fetchone()[0]
+
+@_timed
+def get_total_usage():
+    """Bytes of all stored files plus the declared size of open upload sessions."""
+    with get_cursor() as cursor:
+        cursor.execute("""SELECT (SELECT bytes FROM storage_usage WHERE id = 1)
+                               + (SELECT COALESCE(SUM(length), 0) FROM upload_sessions)""")
+        return cursor.fetchone()[0]
+
+@_timed
+def create_upload_session(session_id, slug, filename, length, token_hash):
+    with transaction() as cursor:
+        cursor.execute("""INSERT INTO upload_sessions (id, slug, filename, length, upload_offset, created, token_hash)
+                          VALUES (?, ?, ?, ?, 0, ?, ?)""",
+                       (session_id, slug, filename, length, datetime.utcnow().isoformat(), token_hash))
+
+@_timed
+def get_upload_session(session_id):
+    """Return ``(slug, filename, length, upload_offset, token_hash, state)``, or None."""
+    with get_cursor() as cursor:
+        cursor.execute("""SELECT slug, filename, length, upload_offset, token_hash, state
+                          FROM upload_sessions WHERE id=?""", (session_id,))
+        return cursor.fetchone()
+
+@_timed
+def get_slug_sessions(slug):
+    with get_cursor() as cursor:
+        cursor.execute("SELECT id, filename, length, upload_offset FROM upload_sessions WHERE slug=?", (slug,))
         return cursor.fetchall()
+
+@_timed
+def claim_upload_session(session_id, offset, writer, seconds):
+    """Let ``writer`` append to a session at ``offset``; False if the offset moved or another PATCH holds it.
+
+    The claim lapses after ``seconds`` unless renewed, in case its worker died.
+    """
+    now = datetime.utcnow()
+    with transaction() as cursor:
+        cursor.execute("""UPDATE upload_sessions SET writer=?, writer_until=?
+                          WHERE id=? AND upload_offset=? AND state='open' AND (writer IS NULL OR writer_until < ?)""",
+                       (writer, (now + timedelta(seconds=seconds)).isoformat(), session_id, offset, now.isoformat()))
+        return cursor.rowcount == 1
+
+@_timed
+def renew_upload_session(session_id, writer, seconds):
+    """Extend ``writer``'s claim; False if it lapsed and was taken over."""
+    until = datetime.utcnow() + timedelta(seconds=seconds)
+    with transaction() as cursor:
+        cursor.execute("UPDATE upload_sessions SET writer_until=? WHERE id=? AND writer=?",
+                       (until.isoformat(), session_id, writer))
+        return cursor.rowcount == 1
+
+@_timed
+def release_upload_session(session_id, writer, offset):
+    """Record the offset ``writer`` reached and drop its claim."""
+    with transaction() as cursor:
+        cursor.execute("UPDATE upload_sessions SET upload_offset=?, writer=NULL, writer_until=NULL WHERE id=? AND writer=?",
+                       (offset, session_id, writer))
+
+class _SessionsTaken(Exception):
+    pass
+
+@_timed
+def claim_sessions_for_finalize(session_ids):
+    """Move complete, idle sessions to 'finalizing', all or none; False if one was not.
+
+    Only one finalize call can claim a session, and PATCH and DELETE leave
+    claimed sessions alone.
+    """
+    now = datetime.utcnow().isoformat()
+    try:
+        with transaction() as cursor:
+            for session_id in session_ids:
+                cursor.execute("""UPDATE upload_sessions SET state='finalizing'
+                                  WHERE id=? AND state='open' AND upload_offset=length
+                                  AND (writer IS NULL OR writer_until < ?)""", (session_id, now))
+                if cursor.rowcount != 1:
+                    raise _SessionsTaken
+    except _SessionsTaken:
+        return False
+    return True
+
+@_timed
+def reopen_upload_sessions(session_ids):
+    """Hand sessions of a finalize call that failed back to PATCH and DELETE."""
+    with transaction() as cursor:
+        cursor.executemany("UPDATE upload_sessions SET state='open' WHERE id=?", [(i,) for i in session_ids])
+
+@_timed
+def delete_open_upload_session(session_id):
+    """Delete a session unless a finalize call claimed it; returns whether it did."""
+    with transaction() as cursor:
+        cursor.execute("DELETE FROM upload_sessions WHERE id=? AND state='open'", (session_id,))
+        return cursor.rowcount == 1
+
+@_timed
+def delete_upload_sessions(session_ids):
+    with transaction() as cursor:
+        cursor.executemany("DELETE FROM upload_sessions WHERE id=?", [(i,) for i in session_ids])
+
+@_timed
+def get_stale_sessions(before):
+    with get_cursor() as cursor:
+        cursor.execute("SELECT id FROM upload_sessions WHERE created < ?", (before.isoformat(),))
+        return [row[0] for row in cursor.fetchall()]
+
+def _enqueue_jobs(cursor, slug, kinds, now):
+    cursor.executemany("INSERT OR REPLACE INTO jobs (kind, slug, run_after) VALUES (?, ?, ?)",
+                       [(kind, slug, now.isoformat()) for kind in kinds])
+
+@_timed
+def claim_job(holder, seconds):
+    """Claim the oldest due job for ``holder``; returns ``(id, kind, slug, attempts)`` or None.
+
+    The job stays hidden from other workers for ``seconds``, after which it
+    is handed out again in case its worker died.
+    """
+    now = datetime.utcnow()
+    with transaction() as cursor:
+        cursor.execute("""SELECT id, kind, slug, attempts FROM jobs WHERE run_after <= ?
+                          ORDER BY run_after, id LIMIT 1""", (now.isoformat(),))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        cursor.execute("UPDATE jobs SET holder=?, run_after=?, attempts=attempts + 1 WHERE id=?",
+                       (holder, (now + timedelta(seconds=seconds)).isoformat(), row[0]))
+    job_id, kind, slug, attempts = row
+    return job_id, kind, slug, attempts + 1
+
+@_timed
+def finish_job(job_id, holder):
+    with transaction() as cursor:
+        cursor.execute("DELETE FROM jobs WHERE id=? AND holder=?", (job_id, holder))
+
+@_timed
+def retry_job(job_id, holder, run_after):
+    with transaction() as cursor:
+        cursor.execute("UPDATE jobs SET holder=NULL, run_after=? WHERE id=? AND holder=?",
+                       (run_after.isoformat(), job_id, holder))
+
+@_timed
+def set_file_checksums(slug, f, sha256, crc32):
+    """Record checksums computed after upload, unless the file was replaced meanwhile."""
+    with transaction() as cursor:
+        cursor.execute("""UPDATE files SET sha256=?, crc32=?
+                          WHERE slug=? AND name=? AND path=? AND size=? AND mtime IS ?""",
+                       (sha256, crc32, slug, f["name"], f["path"], f["size"], f["mtime"]))
+
+@_timed
+def set_file_preview(slug, name, sha256):
+    with transaction() as cursor:
+        cursor.execute("UPDATE files SET preview=1 WHERE slug=? AND name=? AND sha256=?", (slug, name, sha256))
+
+@_timed
+def get_file_paths(after_id, limit):
+    """Page through all file rows by id: ``[(id, slug, name, path)]``."""
+    with get_cursor() as cursor:
+        cursor.execute("SELECT id, slug, name, path FROM files WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit))
+        return cursor.fetchall()
+
+@_timed
+def set_file_paths(updates):
+    """Apply ``[(new_path, id, old_path)]`` in one transaction, skipping rows changed since."""
+    with transaction() as cursor:
+        cursor.executemany("UPDATE files SET path=? WHERE id=? AND path=?", updates)
+
+@_timed
+def get_slug_file_paths(slugs):
+    """Return ``{slug: {paths}}`` for those of ``slugs`` that have a link or an upload session."""
+    known = {}
+    with get_cursor() as cursor:
+        for i in range(0, len(slugs), 500):
+            chunk = slugs[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            cursor.execute(f"""SELECT l.slug, f.path FROM links l LEFT JOIN files f ON f.slug = l.slug
+                               WHERE l.slug IN ({marks})
+                               UNION ALL SELECT slug, NULL FROM upload_sessions WHERE slug IN ({marks})""",
+                           chunk + chunk)
+            for slug, path in cursor.fetchall():
+                paths = known.setdefault(slug, set())
+                if path is not None:
+                    paths.add(os.path.normpath(path))
+    return known
+
+@_timed
+def get_link_stats(slug):
+    """Return ``(views, zip_downloads, {file name: downloads})`` for a slug, or None."""
+    with get_cursor() as cursor:
+        cursor.execute("""SELECT l.views, l.zip_downloads, f.name, f.downloads
+                          FROM links l LEFT JOIN files f ON f.slug = l.slug WHERE l.slug=?""", (slug,))
+        rows = cursor.fetchall()
+    if not rows:
+        return None
+    return rows[0][0], rows[0][1], {name: downloads for _, _, name, downloads in rows if name is not None}
+
+@_timed
+def add_link_stats(views, zip_downloads, file_downloads):
+    """Add buffered counts in one transaction.
+
+    ``views`` and ``zip_downloads`` map slugs to counts, ``file_downloads``
+    maps ``(slug, name)``. Counts for links deleted meanwhile are dropped.
+    """
+    with transaction() as cursor:
+        cursor.executemany("UPDATE links SET views = views + ? WHERE slug=?",
+                           [(n, slug) for slug, n in views.items()])
+        cursor.executemany("UPDATE links SET zip_downloads = zip_downloads + ? WHERE slug=?",
+                           [(n, slug) for slug, n in zip_downloads.items()])
+        cursor.executemany("UPDATE files SET downloads = downloads + ? WHERE slug=? AND name=?",
+                           [(n, slug, name) for (slug, name), n in file_downloads.items()])
+
+@_timed
+def claim_blob(sha256, deleting_timeout):
+    """Claim stored content for an upload about to reference it.
+
+    Returns ``"stored"`` when the content is known to be stored (its claim
+    is renewed, so ``mark_blobs_deleting`` leaves it alone for a while),
+    ``"deleting"`` while a deletion marked less than ``deleting_timeout``
+    seconds ago may still be in flight, or ``"upload"`` after recording that
+    the caller is uploading it.
+    """
+    now = datetime.utcnow()
+    with transaction() as cursor:
+        cursor.execute("SELECT state, updated FROM stored_blobs WHERE sha256=?", (sha256,))
+        row = cursor.fetchone()
+        if row and row[0] == "deleting" and row[1] > (now - timedelta(seconds=deleting_timeout)).isoformat():
+            return "deleting"
+        state = "stored" if row and row[0] == "stored" else "uploading"
+        cursor.execute("INSERT OR REPLACE INTO stored_blobs (sha256, state, updated) VALUES (?, ?, ?)",
+                       (sha256, state, now.isoformat()))
+    return "stored" if state == "stored" else "upload"
+
+@_timed
+def set_blob_stored(sha256):
+    with transaction() as cursor:
+        cursor.execute("UPDATE stored_blobs SET state='stored', updated=? WHERE sha256=?",
+                       (datetime.utcnow().isoformat(), sha256))
+
+@_timed
+def mark_blobs_deleting(sha256s, claimed_before):
+    """Mark stored content that nothing references any more for deletion; returns the hashes marked.
+
+    Content claimed by an upload since ``claimed_before`` is kept: the
+    upload's rows may not be committed yet. The reference count and the
+    claim are checked in the same transaction as the mark.
+    """
+    now = datetime.utcnow().isoformat()
+    marked = []
+    with transaction() as cursor:
+        referenced = _count_references(cursor, list(sha256s))
+        for sha256 in sha256s:
+            if sha256 in referenced:
+                continue
+            cursor.execute("SELECT updated FROM stored_blobs WHERE sha256=?", (sha256,))
+            row = cursor.fetchone()
+            if row and row[0] > claimed_before.isoformat():
+                continue
+            cursor.execute("INSERT OR REPLACE INTO stored_blobs (sha256, state, updated) VALUES (?, 'deleting', ?)",
+                           (sha256, now))
+            marked.append(sha256)
+    return marked
+
+@_timed
+def forget_blobs(sha256s):
+    """Drop the records of content whose deletion finished."""
+    with transaction() as cursor:
+        cursor.executemany("DELETE FROM stored_blobs WHERE sha256=? AND state='deleting'",
+                           [(sha256,) for sha256 in sha256s])
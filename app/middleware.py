@@ -1,17 +1,243 @@
-from fastapi import Request, Response
+import time
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+from app.config import get_settings
+from app.services.metrics import (
+    REQUEST_SECONDS, REQUEST_BODY_BYTES, RESPONSE_BODY_BYTES, UPLOADS_IN_PROGRESS,
+    start_spans, server_timing,
+)
+from app.services.quota import admit, reserve
+from app.utils.compression import StreamCompressor, choose_encoding, is_compressible
+
+UPLOAD_METHODS = {"POST", "PUT", "PATCH"}
+# Requests whose body is stored, checked by AdmissionMiddleware. Resumable
+# chunks (PATCH /api/uploads/{id}) are not: their length was admitted when
+# the session was created and is counted through upload_sessions.
+ADMITTED_ROUTES = {("POST", "/"), ("POST", "/api/uploads"), ("POST", "/api/links")}
+
+# Encoded once at import; appended to every response as-is
+SECURITY_HEADERS = [
+    (b"x-frame-options", b"DENY"),
+    (b"x-content-type-options", b"nosniff"),
+    (b"referrer-policy", b"no-referrer"),
+    (b"content-security-policy", (
+        "default-src 'self'; "
+        "style-src 'self' 'unsafe-inline' https://cdn.tailwindcss.com https://unpkg.com; "
+        "script-src 'self' 'unsafe-inline' https://cdn.tailwindcss.com https://unpkg.com; "
+        "font-src 'self' https://cdn.tailwindcss.com https://unpkg.com; "
+        "img-src 'self' data: blob:;"
+    ).encode()),
+]
+_SECURITY_HEADER_NAMES = {name for name, _ in SECURITY_HEADERS}
+
+class SecurityHeadersMiddleware:
+    """Add the security headers to the ``http.response.start`` message.
+
+    Unlike ``@app.middleware("http")`` (BaseHTTPMiddleware) nothing is
+    wrapped in an extra task or stream, so response bodies, including large
+    file downloads, pass straight through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                headers = [h for h in message.get("headers", []) if h[0] not in _SECURITY_HEADER_NAMES]
+                message = {**message, "headers": headers + SECURITY_HEADERS}
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+class MetricsMiddleware:
+    """Record latency, status and body sizes of every HTTP request.
+
+    A plain ASGI middleware, so it sees the body messages themselves and
+    doesn't buffer streamed uploads or downloads.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+        received = sent = 0
+        spans = start_spans() if get_settings().TIMING_SPANS else None
+
+        async def receive_counted():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+            return message
+
+        async def send_counted(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if spans:
+                    message = {**message, "headers": list(message.get("headers", []))
+                               + [(b"server-timing", server_timing(spans).encode())]}
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            elif message["type"] == "http.response.zerocopysend":
+                sent += message.get("count") or 0
+            await send(message)
+
+        is_upload = scope["method"] in UPLOAD_METHODS
+        if is_upload:
+            UPLOADS_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive_counted, send_counted)
+        finally:
+            if is_upload:
+                UPLOADS_IN_PROGRESS.dec()
+            # The router stores the matched route in the scope; label by its
+            # template so per-slug paths don't each become a series
+            route = getattr(scope.get("route"), "path", "other")
+            REQUEST_SECONDS.observe(time.perf_counter() - start,
+                                    method=scope["method"], route=route, status=str(status))
+            REQUEST_BODY_BYTES.inc(received, route=route)
+            RESPONSE_BODY_BYTES.inc(sent, route=route)
+
+def _content_length(scope):
+    for name, value in scope["headers"]:
+        if name == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+class AdmissionMiddleware:
+    """Refuse uploads with 507 before their body is read when storage is short.
+
+    The declared ``Content-Length`` of an upload route is checked against
+    the disk budget and free-space floor (see ``app.services.quota.admit``)
+    and stays reserved until the request finishes. Nothing is evicted here:
+    with EVICT_ON_PRESSURE the check is left to the handlers, which call
+    ``make_room()`` after the password check.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        length = None
+        if scope["type"] == "http" and (scope["method"], scope["path"]) in ADMITTED_ROUTES:
+            length = _content_length(scope)
+        if not length:
+            await self.app(scope, receive, send)
+            return
+        try:
+            if not get_settings().EVICT_ON_PRESSURE:
+                await run_in_threadpool(admit, length)
+        except HTTPException as e:
+            response = JSONResponse({"detail": e.detail}, status_code=e.status_code,
+                                    headers={"Connection": "close"})
+            await response(scope, receive, send)
+            return
+        with reserve(length):
+            await self.app(scope, receive, send)
+
+class CompressionMiddleware:
+    """Compress text responses (HTML pages, JSON, ...) with brotli or gzip.
+
+    File downloads (attachments or range-capable responses), partial
+    content and bodies that already carry a Content-Encoding
+    (precompressed static assets) are passed through.
+    """
+
+    def __init__(self, app, minimum_size=500):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, compressor, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if (message["status"] != 200 or "content-encoding" in headers
+                        or "content-disposition" in headers or "accept-ranges" in headers
+                        or not is_compressible(headers.get("content-type", ""))):
+                    passthrough = True
+                    await send(message)
+                else:
+                    # Held back until the first body message shows whether it's worth it
+                    start = message
+                return
+            if message["type"] != "http.response.body":
+                # Extensions such as zerocopysend carry no body to compress
+                if start is not None and compressor is None:
+                    passthrough = True
+                    await send(start)
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                compressor = StreamCompressor(encoding)
+                headers = MutableHeaders(raw=list(start["headers"]))
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = "W/" + etag
+                del headers["Content-Length"]
+                if not more_body:
+                    body = compressor.compress(body) + compressor.flush()
+                    headers["Content-Length"] = str(len(body))
+                    await send({**start, "headers": headers.raw})
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                await send({**start, "headers": headers.raw})
+            data = compressor.compress(body)
+            if not more_body:
+                data += compressor.flush()
+            if data or not more_body:
+                await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
 
 def setup_middleware(app):
-    @app.middleware("http")
-    async def secure_headers(request: Request, call_next):
-        response: Response = await call_next(request)
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["Referrer-Policy"] = "no-referrer"
-        response.headers["Content-Security-Policy"] = (
-            "default-src 'self'; "
-            "style-src 'self' 'unsafe-inline' https://cdn.tailwindcss.com https://unpkg.com; "
-            "script-src 'self' 'unsafe-inline' https://cdn.tailwindcss.com https://unpkg.com; "
-            "font-src 'self' https://cdn.tailwindcss.com https://unpkg.com; "
-            "img-src 'self' data: blob:;"
-        )
-        return response
+    # Each one added wraps the ones before it
+    app.add_middleware(AdmissionMiddleware)
+    app.add_middleware(CompressionMiddleware)
+    app.add_middleware(MetricsMiddleware)
+    # Outermost, so responses sent by the others (507s) get the headers too
+    app.add_middleware(SecurityHeadersMiddleware)
@@ -1,7 +1,13 @@
 from fastapi import FastAPI
 from app.routes.upload import router as upload_router
 from app.routes.download import router as download_router
+from app.routes.resumable import router as resumable_router
+from app.routes.metrics import router as metrics_router
+from app.routes.links import router as links_router
 
 def register_routes(app: FastAPI):
     app.include_router(upload_router)
+    app.include_router(resumable_router)
+    app.include_router(metrics_router)
+    app.include_router(links_router)
     app.include_router(download_router)
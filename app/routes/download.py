@@ -1,46 +1,136 @@
 from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import FileResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import FileResponse, HTMLResponse, RedirectResponse, Response, StreamingResponse
 import os
 from datetime import datetime
-import json
 
-from app.config import settings
-from app.db import get_link
+from app.config import get_settings
+from app.templating import get_templates
+from app.services.link_cache import get_cached_link
+from app.storage import get_storage
+from app.services.zip_stream import ZipStream
+from app.services.download_engine import serve_file, is_not_modified
+from app.services.postprocess import preview_path
+from app.services.download_stats import count_file_download, count_view, count_zip_download, is_new_download
+from app.db import get_link_stats
+from app.utils.http_ranges import parse_range_header
 
 router = APIRouter()
-templates = Jinja2Templates(directory=settings.TEMPLATES_DIR)
 
-@router.get("/{slug}", response_class=None)
-def get_files(request: Request, slug: str):
-    row = get_link(slug)
-    if not row:
+def get_active_link(slug):
+    """Return the cached link entry for a live slug, raising 404/410 otherwise."""
+    entry = get_cached_link(slug)
+    if not entry:
         raise HTTPException(404, "Link not found")
 
-    expiry, files_json = row
-    if datetime.utcnow() > datetime.fromisoformat(expiry):
+    if datetime.utcnow() > datetime.fromisoformat(entry["expiry"]):
         raise HTTPException(410, "Link expired")
 
-    files = json.loads(files_json)
-    file_links = [
-        {"name": os.path.basename(f), "url": f"/download/{slug}/{os.path.basename(f)}"}
-        for f in files
-    ]
-    return templates.TemplateResponse(
-        "download.html",
-        {
-            "request": request,
-            "slug": slug,
-            "expiry": expiry,
-            "files": file_links,
-        },
-    )
+    return entry
+
+def get_active_files(slug):
+    """Return ``(expiry, files)`` for a live slug, raising 404/410 otherwise."""
+    entry = get_active_link(slug)
+    return entry["expiry"], entry["files"]
+
+@router.get("/{slug}", response_class=None)
+def get_files(request: Request, slug: str):
+    entry = get_active_link(slug)
+    count_view(slug)
+    html = entry.get("html")
+    if html is None:
+        views, zip_downloads, downloads = get_link_stats(slug) or (0, 0, {})
+        file_links = [
+            {
+                "name": f["name"],
+                "url": f"/download/{slug}/{f['name']}",
+                "preview_url": f"/preview/{slug}/{f['name']}" if f["preview"] else None,
+                "downloads": downloads.get(f["name"], 0),
+            }
+            for f in entry["files"]
+        ]
+        # The page is rendered once per cache entry, so its counts lag by up
+        # to LINK_CACHE_TTL plus STATS_FLUSH_SECONDS
+        html = entry["html"] = get_templates().get_template("download.html").render(
+            slug=slug,
+            expiry=entry["expiry"],
+            files=file_links,
+            zip_url=f"/download/{slug}.zip" if len(file_links) > 1 else None,
+            views=views,
+            zip_downloads=zip_downloads,
+        )
+    return HTMLResponse(html)
 
-@router.get("/download/{slug}/{filename}")
-def download_file(slug: str, filename: str):
+@router.api_route("/download/{slug}/{filename}", methods=["GET", "HEAD"])
+def download_file(request: Request, slug: str, filename: str):
     # Prevent directory traversal
     safe_filename = os.path.basename(filename)
-    path = f"{settings.UPLOAD_DIR}/{slug}/{safe_filename}"
-    if not os.path.exists(path):
+    _, files = get_active_files(slug)
+    f = next((f for f in files if f["name"] == safe_filename), None)
+    if f is None:
         raise HTTPException(404, "File not found")
-    return FileResponse(path, filename=safe_filename)
+    url = get_storage().download_url(f["path"], f["sha256"], safe_filename)
+    if url:
+        response = RedirectResponse(url, status_code=302)
+    else:
+        path = f["path"]
+        if not os.path.isfile(path):
+            raise HTTPException(404, "File not found")
+        accel_path = os.path.relpath(path, get_settings().UPLOAD_DIR)
+        response = serve_file(request, path, safe_filename, accel_path=accel_path, sha256=f["sha256"])
+    if is_new_download(request, response):
+        count_file_download(slug, safe_filename)
+    return response
+
+@router.get("/preview/{slug}/{filename}")
+def preview(slug: str, filename: str):
+    _, files = get_active_files(slug)
+    f = next((f for f in files if f["name"] == filename and f["preview"]), None)
+    path = preview_path(f["sha256"]) if f else None
+    if path is None or not os.path.isfile(path):
+        raise HTTPException(404, "Preview not found")
+    # Previews are named by content hash, so they never change
+    return FileResponse(path, media_type="image/jpeg",
+                        headers={"Cache-Control": f"public, max-age={get_settings().STATIC_CACHE_SECONDS}"})
+
+@router.api_route("/download/{slug}.zip", methods=["GET", "HEAD"])
+def download_all(request: Request, slug: str):
+    _, files = get_active_files(slug)
+    if not files:
+        raise HTTPException(404, "File not found")
+    # Laid out from the sizes in the DB rows; storage is only read for the body
+    archive = ZipStream(files)
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": archive.etag,
+        "Content-Disposition": f'attachment; filename="{slug}.zip"',
+    }
+    if is_not_modified(request, archive.etag):
+        return Response(status_code=304, headers=headers)
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and if_range != archive.etag:
+        range_header = None
+    ranges = parse_range_header(range_header, archive.size)
+
+    if ranges is None or len(ranges) > 1:
+        # Multi-range requests on a generated archive get the whole body
+        start, end, status_code = 0, archive.size - 1, 200
+        headers["Content-Length"] = str(archive.size)
+    elif not ranges:
+        headers["Content-Range"] = f"bytes */{archive.size}"
+        return Response(status_code=416, headers=headers)
+    else:
+        (start, end), = ranges
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{archive.size}"
+        headers["Content-Length"] = str(end - start + 1)
+
+    if request.method == "HEAD":
+        # Headers only; the archive is not read
+        return Response(status_code=status_code, media_type="application/zip", headers=headers)
+    if start == 0:
+        count_zip_download(slug)
+    return StreamingResponse(
+        archive.iter_bytes(start, end), status_code=status_code, media_type="application/zip", headers=headers,
+    )
@@ -0,0 +1,198 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, ValidationError
+import base64
+import binascii
+import sqlite3
+from datetime import datetime, timedelta
+
+from app.config import get_settings
+from app.utils.security import is_safe_slug, check_api_password
+from app.utils.file_utils import cleanup_files, run_io, upload_path
+from app.services.upload_utils import is_safe_filename, store_bytes
+from app.services.content_check import ContentValidator
+from app.services.link_cache import invalidate_link
+from app.services.metrics import UPLOADED_BYTES, span
+from app.services.postprocess import post_upload_jobs, prune_previews
+from app.services.quota import MB, check_slug_quota, make_room, upload_limit
+from app.storage import get_storage
+from app.background import notify_jobs
+from app.db import (
+    get_link_expiries, save_links, extend_links, list_links, run_db,
+)
+
+# JSON API for automation. Every call sends "Authorization: Bearer <password>".
+#   POST  /api/links  create many links, file content base64-encoded
+#   PATCH /api/links  extend the expiry of many links
+#   GET   /api/links  list live links by slug with their size and download counts,
+#                     ?after=<last slug>&limit=<n>
+router = APIRouter(prefix="/api/links")
+
+class NewFile(BaseModel):
+    name: str
+    content: str  # base64
+
+class NewLink(BaseModel):
+    slug: str
+    days: int
+    files: list[NewFile]
+
+class CreateLinks(BaseModel):
+    links: list[NewLink]
+
+class ExtendLinks(BaseModel):
+    slugs: list[str]
+    days: int
+
+def _parse_json(model, body):
+    try:
+        return model.model_validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+
+async def _read_json(request, model, limit):
+    """Read a JSON body of at most ``limit`` bytes and validate it against ``model``.
+
+    Parsing runs on the I/O pool: a batch body can be tens of megabytes.
+    """
+    content_length = request.headers.get("Content-Length")
+    if content_length and content_length.isdigit() and int(content_length) > limit:
+        raise HTTPException(413, f"Request exceeds {limit // MB}MB limit")
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            raise HTTPException(413, f"Request exceeds {limit // MB}MB limit")
+    return await run_io(_parse_json, model, bytes(body))
+
+def _check_batch(items):
+    if not items:
+        raise HTTPException(400, "Nothing to do")
+    if len(items) > get_settings().BATCH_MAX_LINKS:
+        raise HTTPException(400, f"Max {get_settings().BATCH_MAX_LINKS} links per call")
+
+def _check_days(days):
+    if not 1 <= days <= get_settings().MAX_EXPIRY_DAYS:
+        raise HTTPException(400, f"Expiry must be 1 to {get_settings().MAX_EXPIRY_DAYS} days")
+
+def _decode_files(i, link):
+    """Validate one link of a create call and return ``[(name, data, sha256)]``.
+
+    Blocking (base64 decoding and hashing): call it from a worker thread.
+    """
+    where = f"links[{i}] ({link.slug})"
+    if not is_safe_slug(link.slug):
+        raise HTTPException(400, f"{where}: Slug must be alphanumeric")
+    _check_days(link.days)
+    if not link.files:
+        raise HTTPException(400, f"{where}: At least one file required")
+    if len(link.files) > get_settings().MAX_FILES:
+        raise HTTPException(400, f"{where}: Max {get_settings().MAX_FILES} files per upload")
+    if len({f.name for f in link.files}) != len(link.files):
+        raise HTTPException(400, f"{where}: Duplicate file names")
+    files = []
+    total = 0
+    for f in link.files:
+        if not is_safe_filename(f.name):
+            raise HTTPException(400, f"{where}: Unsafe or disallowed file type: {f.name}")
+        try:
+            data = base64.b64decode(f.content, validate=True)
+        except binascii.Error:
+            raise HTTPException(400, f"{where}: {f.name} is not valid base64")
+        check = ContentValidator(f.name, len(data))
+        check.update(data)
+        total += len(data)
+        files.append((f.name, data, check.hexdigest()))
+    if total > upload_limit():
+        raise HTTPException(413, f"{where}: Upload exceeds {upload_limit() // MB}MB limit")
+    check_slug_quota(0, total)
+    return files
+
+def _release_replaced(replaced):
+    """Release the files of the expired links a batch replaced; returns the hashes released."""
+    released = []
+    for slug, files in replaced.items():
+        released += cleanup_files(slug, files)
+    return released
+
+@router.post("")
+async def create_links(request: Request):
+    await check_api_password(request)
+    await run_io(make_room)
+    batch = await _read_json(request, CreateLinks, get_settings().BATCH_MAX_BYTES)
+    _check_batch(batch.links)
+    slugs = [link.slug for link in batch.links]
+    if len(set(slugs)) != len(slugs):
+        raise HTTPException(400, "Duplicate slugs")
+    decoded = await run_io(lambda: [_decode_files(i, link) for i, link in enumerate(batch.links)])
+
+    now = datetime.utcnow()
+    expiries = await run_db(get_link_expiries, slugs)
+    live = [slug for slug, expiry in expiries.items() if now <= datetime.fromisoformat(expiry)]
+    if live:
+        raise HTTPException(409, f"Slugs already in use and not expired: {', '.join(sorted(live))}")
+
+    storage = get_storage()
+    links = []
+    try:
+        with span("disk_write"):
+            for link, files in zip(batch.links, decoded):
+                saved = []
+                links.append((link.slug, saved, link.days, ()))
+                for name, data, sha256 in files:
+                    saved.append(await run_io(store_bytes, upload_path(link.slug, name), data, sha256, name))
+        links = [(slug, saved, days, post_upload_jobs(saved)) for slug, saved, days, _ in links]
+        with span("db_commit"):
+            new_expiries, replaced = await run_db(save_links, links)
+    except BaseException as e:
+        written = [f for _, saved, _, _ in links for f in saved]
+        for f in written:
+            await run_io(storage.release, f["path"], f["sha256"])
+        await run_io(storage.prune, [f["sha256"] for f in written])
+        if isinstance(e, sqlite3.IntegrityError):
+            raise HTTPException(409, "A slug was taken while this batch was being stored")
+        raise
+    notify_jobs()
+    UPLOADED_BYTES.inc(sum(len(data) for files in decoded for _, data, _ in files))
+    for slug in slugs:
+        invalidate_link(slug)
+    # Only now that the new rows are committed: files of the expired links replaced
+    released = await run_io(_release_replaced, replaced)
+    await run_io(storage.prune, released)
+    await run_db(prune_previews, released)
+
+    return JSONResponse({"links": [
+        {"slug": slug, "url": f"/{slug}", "expiry": expiry, "files": [f["name"] for f in saved]}
+        for (slug, saved, _, _), expiry in zip(links, new_expiries)
+    ]}, status_code=201)
+
+@router.patch("")
+async def extend(request: Request):
+    await check_api_password(request)
+    batch = await _read_json(request, ExtendLinks, MB)
+    _check_batch(batch.slugs)
+    _check_days(batch.days)
+    extended = await run_db(extend_links, batch.slugs, datetime.utcnow() + timedelta(days=batch.days))
+    for slug in extended:
+        invalidate_link(slug)
+    found = set(extended)
+    return {"extended": extended, "missing": [slug for slug in batch.slugs if slug not in found]}
+
+@router.get("")
+async def list_active(request: Request, after: str = "", limit: int = 100):
+    await check_api_password(request)
+    if not 1 <= limit <= get_settings().BATCH_MAX_LINKS:
+        raise HTTPException(400, f"limit must be 1 to {get_settings().BATCH_MAX_LINKS}")
+    rows = await run_db(list_links, after, limit)
+    return {
+        "links": [
+            {
+                "slug": slug, "url": f"/{slug}", "expiry": expiry, "created": created, "files": count, "size": size,
+                "views": views, "zip_downloads": zip_downloads, "file_downloads": file_downloads,
+            }
+            for slug, expiry, created, count, size, views, zip_downloads, file_downloads in rows
+        ],
+        # Pass as ?after= for the next page
+        "next": rows[-1][0] if len(rows) == limit else None,
+    }
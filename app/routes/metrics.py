@@ -0,0 +1,23 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+import shutil
+
+from app.config import get_settings
+from app.db import get_stored_bytes
+from app.services.link_cache import get_link_cache
+from app.services.metrics import LINK_CACHE_ENTRIES, LINK_CACHE_LOOKUPS, STORED_BYTES, UPLOAD_FILESYSTEM_BYTES, render
+
+router = APIRouter()
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus scrape endpoint; keep it off the public internet."""
+    usage = shutil.disk_usage(get_settings().UPLOAD_DIR)
+    UPLOAD_FILESYSTEM_BYTES.set(usage.used, state="used")
+    UPLOAD_FILESYSTEM_BYTES.set(usage.free, state="free")
+    STORED_BYTES.set(get_stored_bytes())
+    cache = get_link_cache().stats()
+    LINK_CACHE_ENTRIES.set(cache["size"])
+    LINK_CACHE_LOOKUPS.set(cache["hits"], result="hit")
+    LINK_CACHE_LOOKUPS.set(cache["misses"], result="miss")
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,253 @@
+from fastapi import APIRouter, Form, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+import hashlib
+import hmac
+import os
+import secrets
+import sqlite3
+import time
+from datetime import datetime
+
+from app.config import get_settings
+from app.utils.security import is_safe_slug, check_password
+from app.utils.file_utils import (
+    session_dir, session_part_path, remove_files, describe_file, file_sha256, run_io, cleanup_files, upload_path,
+)
+from app.storage import get_storage
+from app.services.upload_utils import is_safe_filename
+from app.services.link_cache import invalidate_link
+from app.services.metrics import UPLOADED_BYTES, span
+from app.services.quota import admit, check_slug_quota
+from app.services.content_check import SNIFF_BYTES, ContentValidator
+from app.services.postprocess import post_upload_jobs, prune_previews
+from app.background import notify_jobs
+from app.db import (
+    get_link, save_link, create_upload_session, get_upload_session,
+    get_slug_sessions, claim_upload_session, renew_upload_session, release_upload_session,
+    claim_sessions_for_finalize, reopen_upload_sessions, delete_open_upload_session,
+    delete_upload_sessions, run_db,
+)
+
+# Resumable uploads, loosely following the tus protocol:
+#   POST   /api/uploads                  create a session for one file
+#   HEAD   /api/uploads/{id}             current Upload-Offset
+#   PATCH  /api/uploads/{id}             append bytes at Upload-Offset
+#   DELETE /api/uploads/{id}             abandon a session
+#   POST   /api/uploads/{slug}/finalize  turn the finished sessions into a link
+# Creating and finalizing take the password; HEAD, PATCH and DELETE take the
+# session's own secret, returned on creation, as "Upload-Token: <token>".
+router = APIRouter(prefix="/api/uploads")
+
+# A PATCH claims its session for this long, renewing halfway through, so a
+# second PATCH at the same offset is refused rather than interleaved.
+WRITE_LEASE_SECONDS = 60
+
+def _offset_headers(length, offset):
+    return {
+        "Upload-Offset": str(offset),
+        "Upload-Length": str(length),
+        "Cache-Control": "no-store",
+    }
+
+def _ensure_slug_available(slug):
+    row = get_link(slug)
+    if row:
+        expiry, _ = row
+        if datetime.utcnow() <= datetime.fromisoformat(expiry):
+            raise HTTPException(409, "Slug is already in use and not expired")
+
+def _create_part_file(session_id):
+    os.makedirs(session_dir(), exist_ok=True)
+    open(session_part_path(session_id), "wb").close()
+
+def _read_part_head(session_id, size):
+    with open(session_part_path(session_id), "rb") as f:
+        return f.read(size)
+
+def _open_part_at(session_id, offset):
+    """Open a session's part file for writing at ``offset``, dropping anything past it."""
+    f = open(session_part_path(session_id), "r+b")
+    f.seek(offset)
+    f.truncate()
+    return f
+
+def _token_hash(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def _get_session_or_404(session_id, token):
+    """Return ``(slug, filename, length, offset)`` of a session ``token`` opens."""
+    session = get_upload_session(session_id)
+    if not session:
+        raise HTTPException(404, "Upload session not found")
+    token_hash = session[4]
+    # Sessions created before tokens existed can't be opened at all
+    if token_hash is None or not hmac.compare_digest(_token_hash(token), token_hash):
+        raise HTTPException(403, "Upload-Token does not match this session")
+    return session[:4]
+
+@router.post("")
+async def create_session(
+    request: Request,
+    slug: str = Form(...),
+    filename: str = Form(...),
+    length: int = Form(...),
+):
+    settings = get_settings()
+    await check_password(request)
+
+    if not is_safe_slug(slug):
+        raise HTTPException(400, "Slug must be alphanumeric")
+    if not is_safe_filename(filename):
+        raise HTTPException(400, f"Unsafe or disallowed file type: {filename}")
+    if length <= 0:
+        raise HTTPException(400, "Upload length must be positive")
+    await run_db(_ensure_slug_available, slug)
+
+    sessions = await run_db(get_slug_sessions, slug)
+    if len(sessions) >= settings.MAX_FILES:
+        raise HTTPException(400, f"Max {settings.MAX_FILES} files per upload")
+    if sum(s[2] for s in sessions) + length > settings.RESUMABLE_MAX_SIZE:
+        raise HTTPException(413, f"Upload exceeds {settings.RESUMABLE_MAX_SIZE // (1024 * 1024)}MB limit")
+    check_slug_quota(sum(s[2] for s in sessions), length)
+    # The declared length is reserved from here on through upload_sessions
+    await run_db(admit, length, evict=True)
+
+    session_id = secrets.token_urlsafe(16)
+    token = secrets.token_urlsafe(32)
+    try:
+        await run_db(create_upload_session, session_id, slug, filename, length, _token_hash(token))
+    except sqlite3.IntegrityError:
+        raise HTTPException(409, f"An upload for {filename} already exists in this slug")
+    await run_io(_create_part_file, session_id)
+
+    url = f"/api/uploads/{session_id}"
+    headers = _offset_headers(length, 0)
+    headers["Location"] = url
+    return JSONResponse({"id": session_id, "url": url, "token": token}, status_code=201, headers=headers)
+
+def _request_token(request):
+    return request.headers.get("Upload-Token", "")
+
+@router.head("/{session_id}")
+def session_offset(request: Request, session_id: str):
+    _, _, length, offset = _get_session_or_404(session_id, _request_token(request))
+    return Response(status_code=200, headers=_offset_headers(length, offset))
+
+@router.patch("/{session_id}")
+async def append_chunk(request: Request, session_id: str):
+    _, filename, length, offset = await run_db(_get_session_or_404, session_id, _request_token(request))
+    try:
+        client_offset = int(request.headers["Upload-Offset"])
+    except (KeyError, ValueError):
+        raise HTTPException(400, "Upload-Offset header required")
+    if client_offset != offset:
+        raise HTTPException(409, "Upload-Offset does not match the current offset",
+                            headers=_offset_headers(length, offset))
+    writer = secrets.token_hex(8)
+    if not await run_db(claim_upload_session, session_id, offset, writer, WRITE_LEASE_SECONDS):
+        raise HTTPException(409, "Another request is appending to or finalizing this upload",
+                            headers=_offset_headers(length, offset))
+
+    check = None
+    written = offset
+    try:
+        if offset < SNIFF_BYTES:
+            # The start of the file is sniffed before it is written, as for form uploads
+            check = ContentValidator(filename, length)
+            if offset:
+                check.update(await run_io(_read_part_head, session_id, offset))
+
+        f = await run_io(_open_part_at, session_id, offset)
+        try:
+            renew_at = time.monotonic() + WRITE_LEASE_SECONDS / 2
+            with span("disk_write"):
+                async for chunk in request.stream():
+                    if written + len(chunk) > length:
+                        raise HTTPException(413, "Chunk exceeds the declared upload length")
+                    if check is not None and not check.checked:
+                        try:
+                            check.update(chunk)
+                        except HTTPException:
+                            await run_io(remove_files, [session_part_path(session_id)])
+                            await run_db(delete_upload_sessions, [session_id])
+                            raise
+                    if time.monotonic() >= renew_at:
+                        if not await run_db(renew_upload_session, session_id, writer, WRITE_LEASE_SECONDS):
+                            raise HTTPException(409, "Another request took over this upload")
+                        renew_at = time.monotonic() + WRITE_LEASE_SECONDS / 2
+                    await run_io(f.write, chunk)
+                    written += len(chunk)
+        finally:
+            await run_io(f.close)
+    finally:
+        # Record whatever made it to disk so an interrupted PATCH can resume
+        if written != offset:
+            UPLOADED_BYTES.inc(written - offset)
+        await run_db(release_upload_session, session_id, writer, written)
+
+    return Response(status_code=204, headers=_offset_headers(length, written))
+
+@router.delete("/{session_id}")
+def delete_session(request: Request, session_id: str):
+    _get_session_or_404(session_id, _request_token(request))
+    if not delete_open_upload_session(session_id):
+        raise HTTPException(409, "The upload is being finalized")
+    remove_files([session_part_path(session_id)])
+    return Response(status_code=204)
+
+def _abort_finalize(session_ids, saved_files):
+    """Undo a failed finalize: sessions whose part file is intact can be finalized again.
+
+    The files already published are released, and with them the sessions
+    whose part they consumed, which have to be uploaded again.
+    """
+    storage = get_storage()
+    for f in saved_files:
+        storage.release(f["path"], f["sha256"])
+    storage.prune([f["sha256"] for f in saved_files])
+    intact = [i for i in session_ids if os.path.exists(session_part_path(i))]
+    reopen_upload_sessions(intact)
+    delete_upload_sessions([i for i in session_ids if i not in intact])
+
+@router.post("/{slug}/finalize")
+async def finalize(request: Request, slug: str, days: int = Form(...)):
+    await check_password(request)
+
+    if days > get_settings().MAX_EXPIRY_DAYS:
+        raise HTTPException(400, f"Max expiry is {get_settings().MAX_EXPIRY_DAYS} days")
+    sessions = await run_db(get_slug_sessions, slug)
+    if not sessions:
+        raise HTTPException(404, "No upload sessions for this slug")
+    pending = [filename for _, filename, length, offset in sessions if offset != length]
+    if pending:
+        raise HTTPException(409, f"Uploads not complete: {', '.join(pending)}")
+    await run_db(_ensure_slug_available, slug)
+    session_ids = [s[0] for s in sessions]
+    # From here the part files are this call's alone
+    if not await run_db(claim_sessions_for_finalize, session_ids):
+        raise HTTPException(409, "Uploads are being appended to or already being finalized")
+
+    saved_files = []
+    try:
+        for session_id, filename, _, _ in sessions:
+            path = upload_path(slug, filename)
+            await run_io(os.makedirs, os.path.dirname(path), exist_ok=True)
+            part_path = session_part_path(session_id)
+            # Backends that can hash later leave it to the checksums job
+            sha256 = await run_io(file_sha256, part_path) if get_storage().needs_hash else None
+            await run_io(get_storage().publish, part_path, path, sha256)
+            saved_files.append(await run_io(describe_file, path, sha256, filename))
+
+        with span("db_commit"):
+            replaced = await run_db(save_link, slug, saved_files, days, post_upload_jobs(saved_files))
+    except BaseException:
+        await run_io(_abort_finalize, session_ids, saved_files)
+        raise
+    notify_jobs()
+    invalidate_link(slug)
+    # Files of the expired link the slug was taken over from
+    released = await run_io(cleanup_files, slug, replaced)
+    await run_io(get_storage().prune, released)
+    await run_db(prune_previews, released)
+    await run_db(delete_upload_sessions, session_ids)
+    return {"slug": slug, "url": f"/{slug}", "files": [f["name"] for f in saved_files]}
@@ -1,58 +1,97 @@
-from fastapi import APIRouter, Form, HTTPException, Request, Depends
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import RedirectResponse
-from fastapi.templating import Jinja2Templates
+from starlette.datastructures import UploadFile
 import os
 from datetime import datetime
-import json
+from functools import partial
 
-from app.config import settings
-from app.utils.security import is_safe_slug, check_password
-from app.utils.file_utils import process_uploads
-from app.db import get_link, save_link
+from app.config import get_settings
+from app.utils.security import is_safe_slug, verify_password, check_auth_rate, client_ip
+from app.utils.file_utils import cleanup_files, run_io
+from app.services.upload_utils import process_uploads
+from app.db import get_link, merge_link, run_db
+from app.services.link_cache import invalidate_link
+from app.storage import get_storage
+from app.services.multipart import parse_upload_form
+from app.services.metrics import UPLOADED_BYTES, span
+from app.services.quota import check_request_size, check_slug_quota, make_room, upload_limit
+from app.services.static_assets import favicon_asset, upload_form_asset
+from app.services.postprocess import post_upload_jobs, prune_previews
+from app.background import notify_jobs
 
 router = APIRouter()
-templates = Jinja2Templates(directory=settings.TEMPLATES_DIR)
 
 @router.get("/", response_class=None)
 def upload_form(request: Request):
-    return templates.TemplateResponse("upload.html", {"request": request})
+    return upload_form_asset().response(request)
+
+@router.get("/favicon.ico", response_class=None)
+def favicon(request: Request):
+    return favicon_asset().response(request)
+
+async def validate_upload_fields(form, client):
+    """Check the text fields of an upload; runs before any file part is read."""
+    await verify_password(form, client)
+    await run_io(make_room)
+    try:
+        days = int(form.get("days", ""))
+    except ValueError:
+        raise HTTPException(400, "Expiry days must be a number")
+    if days > get_settings().MAX_EXPIRY_DAYS:
+        raise HTTPException(400, f"Max expiry is {get_settings().MAX_EXPIRY_DAYS} days")
+    slug = form.get("slug", "")
+    if not is_safe_slug(slug):
+        raise HTTPException(400, "Slug must be alphanumeric")
 
 @router.post("/")
-async def upload(
-    request: Request,
-    slug: str = Form(...),
-    days: int = Form(...),
-):
+async def upload(request: Request):
     try:
-        # Check password first
-        pw = await check_password(request)
-        
-        form = await request.form()
-        files = form.getlist("files")
-        
-        if days > settings.MAX_EXPIRY_DAYS:
-            raise HTTPException(400, f"Max expiry is {settings.MAX_EXPIRY_DAYS} days")
-        if not is_safe_slug(slug):
-            raise HTTPException(400, "Slug must be alphanumeric")
+        # Clients guessing passwords and oversized bodies are refused unread
+        client = client_ip(request)
+        check_auth_rate(client)
+        content_length = request.headers.get("Content-Length")
+        check_request_size(int(content_length) if content_length and content_length.isdigit() else None,
+                           upload_limit())
+        # The body is parsed once, and pw/slug/days are checked before any
+        # file data is read (the upload form sends them ahead of the files)
+        with span("multipart"):
+            form, content_checks = await parse_upload_form(
+                request, partial(validate_upload_fields, client=client),
+                get_settings().MAX_FILES, upload_limit(),
+            )
+        slug = form["slug"]
+        days = int(form["days"])
+        # An empty file input still sends a part, with no filename
+        files = [f for f in form.getlist("files") if isinstance(f, UploadFile) and f.filename]
+
         if len(files) == 0:
             raise HTTPException(400, "At least one file required")
-        if len(files) > settings.MAX_FILES:
-            raise HTTPException(400, f"Max {settings.MAX_FILES} files per upload")
 
-        # Retrieve existing files and expiry for this slug if any
-        row = get_link(slug)
-        if row:
-            expiry, _ = row
-            if datetime.utcnow() <= datetime.fromisoformat(expiry):
-                raise HTTPException(409, "Slug is already in use and not expired")
-            # Cleanup old files is handled by file_utils
+        # Uploads to a live slug add to it (the upload form sends one
+        # request per file); merged bytes count against the slug's quota too
+        row = await run_db(get_link, slug)
+        existing_files = []
+        if row and datetime.utcnow() <= datetime.fromisoformat(row[0]):
+            existing_files = row[1]
+        incoming = {os.path.basename(f.filename): f.size or 0 for f in files}
+        kept = sum(f["size"] for f in existing_files if f["name"] not in incoming)
+        check_slug_quota(kept, sum(incoming.values()))
 
         # Modular upload handling
-        saved_files, total_size = await process_uploads(files, slug)
-        if total_size > settings.MAX_SIZE:
-            raise HTTPException(400, f"Upload exceeds {settings.MAX_SIZE // (1024 * 1024)}MB limit")
+        saved_files, total_size = await process_uploads(
+            files, content_checks, slug, upload_limit(),
+        )
 
-        save_link(slug, saved_files, days)
+        # Checksums and previews are left to the job workers
+        with span("db_commit"):
+            stale, released = await run_db(merge_link, slug, saved_files, days, post_upload_jobs(saved_files))
+        notify_jobs()
+        UPLOADED_BYTES.inc(total_size)
+        invalidate_link(slug)
+        # Files of an expired link, or replaced ones stored elsewhere
+        await run_io(cleanup_files, slug, stale)
+        await run_io(get_storage().prune, released)
+        await run_db(prune_previews, released)
         return RedirectResponse(f"/{slug}", status_code=303)
     except HTTPException as e:
         # Re-raise HTTP exceptions
@@ -0,0 +1,181 @@
+import os
+import secrets
+from email.utils import formatdate, parsedate_to_datetime
+from mimetypes import guess_type
+from urllib.parse import quote
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+from starlette.concurrency import run_in_threadpool
+
+from app.config import get_settings
+from app.utils.file_utils import CHUNK_SIZE
+from app.utils.http_ranges import parse_range_header
+
+# Beyond this many ranges a request is answered with the whole file
+MAX_RANGES = 16
+
+def content_disposition(filename):
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+def file_etag(stat_result, sha256=None):
+    """Strong ETag: the content's SHA-256 when recorded, else its size and modification time."""
+    if sha256:
+        return f'"{sha256}"'
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+def _etag_matches(header, etag):
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison
+    candidates = [t.strip() for t in header.split(",")]
+    return any(c.removeprefix("W/") == etag for c in candidates)
+
+def is_not_modified(request, etag, mtime=None):
+    """Evaluate If-None-Match / If-Modified-Since for a GET or HEAD request."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and mtime is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(mtime) <= since
+    return False
+
+def requested_ranges(request, size, etag, last_modified=None):
+    """Return the byte ranges to serve, ``None`` for the full body, ``[]`` for a 416."""
+    if_range = request.headers.get("if-range")
+    if if_range and if_range not in (etag, last_modified):
+        return None
+    ranges = parse_range_header(request.headers.get("range"), size)
+    if ranges and len(ranges) > MAX_RANGES:
+        return None
+    return ranges
+
+class RangeFileResponse(FileResponse):
+    """FileResponse that can send one or several byte ranges of the file.
+
+    If the server offers the ASGI ``http.response.zerocopysend`` extension the
+    file descriptor is handed to it (sendfile); otherwise chunks are read in
+    the threadpool.
+    """
+
+    def __init__(self, path, stat_result, ranges=None, method=None, **kwargs):
+        super().__init__(path, stat_result=stat_result, method=method, **kwargs)
+        self.ranges = ranges or []
+        self.size = stat_result.st_size
+        self.parts = []
+        if len(self.ranges) == 1:
+            start, end = self.ranges[0]
+            self.status_code = 206
+            self.headers["content-range"] = f"bytes {start}-{end}/{self.size}"
+            self.headers["content-length"] = str(end - start + 1)
+        elif self.ranges:
+            # multipart/byteranges: each part carries its own headers
+            boundary = secrets.token_hex(12)
+            content_type = self.media_type
+            length = 0
+            for start, end in self.ranges:
+                head = (
+                    f"--{boundary}\r\nContent-Type: {content_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{self.size}\r\n\r\n"
+                ).encode("latin-1")
+                self.parts.append((head, start, end))
+                length += len(head) + (end - start + 1) + 2
+            self.trailer = f"--{boundary}--\r\n".encode("latin-1")
+            length += len(self.trailer)
+            self.status_code = 206
+            self.headers["content-type"] = f"multipart/byteranges; boundary={boundary}"
+            self.headers["content-length"] = str(length)
+
+    async def _send_range(self, send, scope, fd, start, count, more_body):
+        extensions = scope.get("extensions") or {}
+        if "http.response.zerocopysend" in extensions:
+            await send({
+                "type": "http.response.zerocopysend",
+                "file": fd,
+                "offset": start,
+                "count": count,
+                "more_body": more_body,
+            })
+            return
+        remaining = count
+        while remaining > 0:
+            chunk = await run_in_threadpool(os.pread, fd, min(CHUNK_SIZE, remaining), start)
+            if not chunk:
+                break
+            start += len(chunk)
+            remaining -= len(chunk)
+            await send({
+                "type": "http.response.body",
+                "body": chunk,
+                "more_body": more_body or remaining > 0,
+            })
+
+    async def __call__(self, scope, receive, send):
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if self.send_header_only or self.size == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        else:
+            fd = await run_in_threadpool(os.open, self.path, os.O_RDONLY)
+            try:
+                if self.parts:
+                    for head, start, end in self.parts:
+                        await send({"type": "http.response.body", "body": head, "more_body": True})
+                        await self._send_range(send, scope, fd, start, end - start + 1, True)
+                        await send({"type": "http.response.body", "body": b"\r\n", "more_body": True})
+                    await send({"type": "http.response.body", "body": self.trailer, "more_body": False})
+                elif self.ranges:
+                    start, end = self.ranges[0]
+                    await self._send_range(send, scope, fd, start, end - start + 1, False)
+                else:
+                    await self._send_range(send, scope, fd, 0, self.size, False)
+            finally:
+                os.close(fd)
+        if self.background is not None:
+            await self.background()
+
+def serve_file(request: Request, path, filename, accel_path=None, sha256=None):
+    """Build the response for a stored file, honouring conditional and Range headers.
+
+    With ``ACCEL_REDIRECT_PREFIX`` set, only the headers are produced
+    and nginx is told to send the bytes itself via ``X-Accel-Redirect``.
+    """
+    settings = get_settings()
+    stat_result = os.stat(path)
+    etag = file_etag(stat_result, sha256)
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, no-cache",
+    }
+
+    if is_not_modified(request, etag, stat_result.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    if settings.ACCEL_REDIRECT_PREFIX and accel_path:
+        # nginx serves the bytes (and any Range) from its internal location
+        headers["Content-Disposition"] = content_disposition(filename)
+        headers["X-Accel-Redirect"] = settings.ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + quote(accel_path)
+        media_type = guess_type(filename)[0] or "application/octet-stream"
+        return Response(status_code=200, headers=headers, media_type=media_type)
+
+    ranges = requested_ranges(request, stat_result.st_size, etag, last_modified)
+    if ranges == []:
+        headers["Content-Range"] = f"bytes */{stat_result.st_size}"
+        return Response(status_code=416, headers=headers)
+    return RangeFileResponse(
+        path, stat_result, ranges, method=request.method, filename=filename, headers=headers,
+    )
@@ -0,0 +1,64 @@
+"""Download and view counts, buffered in memory and written in batches.
+
+Requests only bump a counter under a lock; the background task adds the
+buffered counts to the DB every STATS_FLUSH_SECONDS in one transaction,
+so serving a file never waits on an SQLite write.
+"""
+import threading
+from collections import Counter
+
+from app.db import add_link_stats
+
+_lock = threading.Lock()
+_views = Counter()  # slug -> download page views
+_zip_downloads = Counter()  # slug -> /download/{slug}.zip requests
+_file_downloads = Counter()  # (slug, name) -> file downloads
+
+def count_view(slug):
+    with _lock:
+        _views[slug] += 1
+
+def count_zip_download(slug):
+    with _lock:
+        _zip_downloads[slug] += 1
+
+def count_file_download(slug, name):
+    with _lock:
+        _file_downloads[slug, name] += 1
+
+def is_new_download(request, response):
+    """Whether ``response`` starts a download, rather than resuming one or revalidating a cached copy.
+
+    HEAD requests, 304s and ranges past the first byte don't count, so one
+    download resumed in pieces counts once. Redirects to object storage do.
+    """
+    if request.method != "GET":
+        return False
+    if response.status_code == 206:
+        return response.headers.get("content-range", "").startswith("bytes 0-")
+    if response.status_code == 200 and "x-accel-redirect" in response.headers:
+        # nginx applies the Range header itself
+        range_header = request.headers.get("range", "").replace(" ", "")
+        return not range_header or range_header.startswith("bytes=0-")
+    return response.status_code in (200, 302)
+
+def flush_stats():
+    """Write the buffered counts to the DB; returns the number of counters written.
+
+    On failure the counts are put back to be retried on the next flush.
+    """
+    global _views, _zip_downloads, _file_downloads
+    with _lock:
+        views, zip_downloads, file_downloads = _views, _zip_downloads, _file_downloads
+        _views, _zip_downloads, _file_downloads = Counter(), Counter(), Counter()
+    if not (views or zip_downloads or file_downloads):
+        return 0
+    try:
+        add_link_stats(views, zip_downloads, file_downloads)
+    except BaseException:
+        with _lock:
+            _views.update(views)
+            _zip_downloads.update(zip_downloads)
+            _file_downloads.update(file_downloads)
+        raise
+    return len(views) + len(zip_downloads) + len(file_downloads)
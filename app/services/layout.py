@@ -0,0 +1,145 @@
+"""On-disk layout of UPLOAD_DIR: migration to shard folders and orphan scanning.
+
+Slug folders live at ``UPLOAD_DIR/ab/cd/<slug>`` (see ``slug_dir``). The
+orphan scan reconciles one shard folder at a time with the DB, so no run
+ever walks the whole tree.
+"""
+import os
+import shutil
+import time
+
+from app.config import get_settings
+from app.db import count_file_references, get_file_paths, get_slug_file_paths, set_file_paths
+from app.services.metrics import ORPHANS_REMOVED
+from app.utils.file_utils import slug_dir
+
+SHARD_COUNT = 256 * 256
+
+def migrate_layout(grace, batch_size=500, log=print):
+    """Move files stored outside their slug's shard folder (the old flat layout) into it.
+
+    Files already in the shard folder are left where they are, whatever
+    their name (see ``upload_path``).
+
+    Safe while the app runs: each file is hard linked at its new path and
+    its row updated first; the old paths are only removed ``grace`` seconds
+    later, once workers have dropped cached links. Returns the number of
+    files moved.
+    """
+    old_paths = []
+    after = 0
+    while True:
+        rows = get_file_paths(after, batch_size)
+        if not rows:
+            break
+        after = rows[-1][0]
+        updates = []
+        for file_id, slug, name, path in rows:
+            if os.path.dirname(os.path.normpath(path)) == os.path.normpath(slug_dir(slug)):
+                continue
+            new_path = os.path.join(slug_dir(slug), name)
+            os.makedirs(os.path.dirname(new_path), exist_ok=True)
+            try:
+                os.link(path, new_path)
+                old_paths.append(path)
+            except FileExistsError:
+                old_paths.append(path)  # Linked by an interrupted earlier run
+            except FileNotFoundError:
+                pass  # Kept by the storage backend, or already moved
+            except OSError:
+                os.replace(path, new_path)  # No hard link support here
+            updates.append((new_path, file_id, path))
+        set_file_paths(updates)
+        log(f"Updated {len(updates)} rows (through id {after})")
+
+    if old_paths:
+        log(f"Waiting {grace}s before removing {len(old_paths)} old paths")
+        time.sleep(grace)
+    for path in old_paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    for folder in {os.path.dirname(path) for path in old_paths}:
+        try:
+            os.rmdir(folder)
+        except OSError:
+            pass
+    return len(old_paths)
+
+def shard_path(index):
+    return f"{index >> 8:02x}/{index & 0xff:02x}"
+
+def _remove(entry):
+    if entry.is_dir(follow_symlinks=False):
+        shutil.rmtree(entry.path, ignore_errors=True)
+    else:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+    ORPHANS_REMOVED.inc()
+
+def _scandir(path):
+    try:
+        with os.scandir(path) as it:
+            return list(it)
+    except FileNotFoundError:
+        return []
+
+def _scan_content(prefix, cutoff):
+    """Drop blobs and previews under one hash prefix that nothing refers to any more."""
+    removed = 0
+    for entry in _scandir(os.path.join(get_settings().UPLOAD_DIR, ".blobs", prefix)):
+        st = entry.stat(follow_symlinks=False)
+        # A blob's only link left is its own: no slug file uses it
+        if st.st_nlink <= 1 and st.st_ctime < cutoff:
+            _remove(entry)
+            removed += 1
+    previews = [e for e in _scandir(os.path.join(get_settings().UPLOAD_DIR, ".previews", prefix))
+                if e.stat(follow_symlinks=False).st_ctime < cutoff]
+    referenced = count_file_references({e.name.split(".")[0] for e in previews}) if previews else {}
+    for entry in previews:
+        if entry.name.split(".")[0] not in referenced:
+            _remove(entry)
+            removed += 1
+    return removed
+
+def scan_shard(index, cutoff):
+    """Remove what the DB doesn't know about from one shard folder.
+
+    Only entries whose inode last changed before ``cutoff`` are touched, so
+    uploads that are still being written are left alone. The ctime is used
+    rather than the mtime: a file hard linked from the blob store keeps the
+    blob's old mtime, but linking it updates the ctime. Once every 256
+    shards the matching blob and preview folders are checked too. Returns
+    the number of entries removed.
+    """
+    shard = os.path.join(get_settings().UPLOAD_DIR, shard_path(index))
+    slug_dirs = [e for e in _scandir(shard) if e.is_dir(follow_symlinks=False)]
+    removed = 0
+    known = get_slug_file_paths([e.name for e in slug_dirs]) if slug_dirs else {}
+    for slug_entry in slug_dirs:
+        paths = known.get(slug_entry.name)
+        if paths is None:
+            if slug_entry.stat(follow_symlinks=False).st_ctime < cutoff:
+                _remove(slug_entry)
+                removed += 1
+            continue
+        for entry in _scandir(slug_entry.path):
+            if os.path.normpath(entry.path) not in paths and entry.stat(follow_symlinks=False).st_ctime < cutoff:
+                _remove(entry)
+                removed += 1
+    if index & 0xff == 0:
+        removed += _scan_content(f"{index >> 8:02x}", cutoff)
+    return removed
+
+def scan_orphans(start, count):
+    """Scan ``count`` shard folders from index ``start``; returns ``(next_start, removed)``."""
+    cutoff = time.time() - get_settings().ORPHAN_GRACE_SECONDS
+    removed = 0
+    index = start
+    for _ in range(min(count, SHARD_COUNT)):
+        removed += scan_shard(index, cutoff)
+        index = (index + 1) % SHARD_COUNT
+    return index, removed
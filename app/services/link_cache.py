@@ -0,0 +1,52 @@
+import threading
+from datetime import datetime
+
+from app.config import get_settings
+from app.db import get_link, get_link_version
+from app.utils.cache import TTLCache
+
+# slug -> {"version": int, "expiry": str, "files": [records], "html": rendered download page}
+_link_cache = None
+_link_cache_lock = threading.Lock()
+
+def get_link_cache():
+    global _link_cache
+    if _link_cache is None:
+        with _link_cache_lock:
+            if _link_cache is None:
+                settings = get_settings()
+                _link_cache = TTLCache(settings.LINK_CACHE_SIZE, settings.LINK_CACHE_TTL)
+    return _link_cache
+
+def get_cached_link(slug):
+    """Return the cache entry for ``slug``, loading it from the DB on a miss.
+
+    Returns None for unknown slugs. An entry is cached for at most the time
+    left until the link expires, so an expired link is never served from
+    the cache; expired rows are returned uncached for the caller to reject.
+
+    A hit is only used while the link's version stamp in the DB is the one
+    it was loaded with, so changes made by other workers (or that raced
+    with filling the entry) are seen at once; invalidate_link() just frees
+    the entry early.
+    """
+    link_cache = get_link_cache()
+    version = get_link_version(slug)
+    if version is None:
+        return None
+    entry = link_cache.get(slug)
+    if entry is not None and entry["version"] == version:
+        return entry
+    # Read after the version: a change in between leaves the entry stale
+    # rather than wrongly current
+    row = get_link(slug)
+    if row is None:
+        return None
+    expiry, files = row
+    entry = {"version": version, "expiry": expiry, "files": files}
+    remaining = (datetime.fromisoformat(expiry) - datetime.utcnow()).total_seconds()
+    link_cache.set(slug, entry, remaining)
+    return entry
+
+def invalidate_link(slug):
+    get_link_cache().invalidate(slug)
@@ -0,0 +1,160 @@
+"""Process-local metrics rendered in the Prometheus text exposition format.
+
+Each worker process keeps its own values; scrape every worker (or run a
+single one) to see the whole service.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = []
+_lock = threading.Lock()
+# Span durations of the current request, when TIMING_SPANS is on
+_request_spans = ContextVar("request_spans", default=None)
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """A value that only goes up, one series per label combination."""
+
+    type = "counter"
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        """Set the series to ``value``, e.g. a total counted elsewhere."""
+        with _lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def samples(self):
+        with _lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in values]
+
+class Gauge(Counter):
+    """A value that can go up and down."""
+
+    type = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram:
+    """Observations counted into cumulative ``le`` buckets."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._values = {}
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * len(self.buckets), 0.0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+
+    def samples(self):
+        with _lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        lines = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+def render():
+    """All registered metrics as Prometheus text."""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+@contextmanager
+def timed(histogram, **labels):
+    """Observe the duration of the enclosed block."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "HTTP request latency by route.")
+REQUEST_BODY_BYTES = Counter("http_request_body_bytes_total", "Request body bytes received by route.")
+RESPONSE_BODY_BYTES = Counter("http_response_body_bytes_total", "Response body bytes sent by route.")
+UPLOADS_IN_PROGRESS = Gauge("uploads_in_progress", "Requests currently sending a body (POST/PUT/PATCH).")
+UPLOADED_BYTES = Counter("uploaded_file_bytes_total", "Bytes of files stored by uploads.")
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "Time spent in app.db functions, lock waits included.")
+REAPER_SWEEP_SECONDS = Histogram("reaper_sweep_duration_seconds", "Duration of expired-link sweeps.")
+REAPER_LINKS_DELETED = Counter("reaper_links_deleted_total", "Expired links deleted by the reaper.")
+ORPHANS_REMOVED = Counter("orphans_removed_total", "Files and folders under UPLOAD_DIR removed because the DB doesn't know them.")
+LINKS_EVICTED = Counter("links_evicted_total", "Live links deleted early to relieve disk pressure.")
+UPLOADS_REJECTED = Counter("uploads_rejected_total", "Uploads turned away by quota or disk admission checks.")
+SPAN_SECONDS = Histogram("request_span_duration_seconds", "Time spent in each phase of a request.")
+UPLOAD_FILESYSTEM_BYTES = Gauge("upload_filesystem_bytes", "Used and free bytes of the whole filesystem holding UPLOAD_DIR.")
+STORED_BYTES = Gauge("stored_file_bytes", "Bytes of files referenced by links; deduplicated content counts once per link.")
+JOB_SECONDS = Histogram("job_duration_seconds", "Run time of post-upload jobs by kind.")
+AUTH_FAILURES = Counter("auth_failures_total", "Requests refused for a missing or wrong password, or throttled after too many.")
+LINK_CACHE_ENTRIES = Gauge("link_cache_entries", "Slugs held in the link cache.")
+LINK_CACHE_LOOKUPS = Counter("link_cache_lookups_total", "Link cache lookups by result (hit, miss).")
+JOBS_FINISHED = Counter("jobs_finished_total", "Post-upload job runs by kind and outcome (done, retried, failed).")
+
+def start_spans():
+    """Collect this request's spans for a Server-Timing header."""
+    spans = {}
+    _request_spans.set(spans)
+    return spans
+
+@contextmanager
+def span(name):
+    """Time one phase of a request (multipart parsing, disk write, ...)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        SPAN_SECONDS.observe(elapsed, span=name)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans[name] = spans.get(name, 0.0) + elapsed
+
+def server_timing(spans):
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in spans.items())
@@ -0,0 +1,169 @@
+from tempfile import SpooledTemporaryFile
+
+from fastapi import HTTPException, Request
+from starlette.datastructures import FormData, Headers, UploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
+from multipart.multipart import parse_options_header
+
+from app.services.content_check import ContentValidator
+from app.utils.file_utils import run_io
+
+def _spool(upload, digest, data):
+    """Hash and spool one chunk of a file part. Blocking: runs on the disk I/O pool."""
+    digest.update(data)
+    upload.file.write(data)
+
+class EarlyValidatingMultiPartParser(MultiPartParser):
+    """Starlette's multipart parser, checking the text fields before any file data.
+
+    ``on_fields`` is awaited with the fields received so far as soon as the
+    first file part starts (or at the end of a body without files). If it
+    raises, parsing stops there, so a bad password or slug is rejected
+    before the file parts are read and spooled. File data is also counted
+    as it arrives and the parse is aborted once it exceeds ``max_size``.
+    Each file part is sniffed by a ``ContentValidator``, kept in
+    ``content_checks`` by UploadFile, on its way to the spool; its SHA-256
+    is updated on the disk I/O pool together with the spool write, so
+    hashing doesn't hold up the event loop.
+
+    Only the parser's callbacks and ``parse()`` are extended: text fields
+    are left to Starlette, file parts are handled here, and their data is
+    written between two chunks of the body, from the stream Starlette reads.
+    """
+
+    def __init__(self, headers, stream, on_fields, max_size, **kwargs):
+        super().__init__(headers, self._feed(stream), **kwargs)
+        self.on_fields = on_fields
+        self.max_size = max_size
+        self.content_checks = {}
+        _, params = parse_options_header(headers["Content-Type"])
+        self._form_charset = params.get(b"charset", b"utf-8").decode("latin-1")
+        self._fields_checked = False
+        self._file_bytes = 0
+        self._uploads = []
+        self._part_upload = None
+        self._part_headers = []
+        self._header_name = b""
+        self._header_value = b""
+        self._pending_writes = []
+        self._finished_uploads = []
+
+    def _decode(self, value):
+        try:
+            return value.decode(self._form_charset)
+        except (UnicodeDecodeError, LookupError):
+            return value.decode("latin-1")
+
+    def on_part_begin(self):
+        super().on_part_begin()
+        self._part_upload = None
+        self._part_headers = []
+
+    def on_header_field(self, data, start, end):
+        super().on_header_field(data, start, end)
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        super().on_header_value(data, start, end)
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        super().on_header_end()
+        self._part_headers.append((self._header_name.lower(), self._header_value))
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        disposition = dict(self._part_headers).get(b"content-disposition", b"")
+        _, options = parse_options_header(disposition)
+        if b"filename" not in options:
+            super().on_headers_finished()
+            return
+        if b"name" not in options:
+            raise MultiPartException('The Content-Disposition header field "name" must be provided.')
+        if len(self._uploads) >= self.max_files:
+            raise MultiPartException(f"Too many files. Maximum number of files is {self.max_files}.")
+        upload = UploadFile(
+            file=SpooledTemporaryFile(max_size=self.max_file_size),
+            size=0,
+            filename=self._decode(options[b"filename"]),
+            headers=Headers(raw=self._part_headers),
+        )
+        self._uploads.append((self._decode(options[b"name"]), upload))
+        self._part_upload = upload
+        self.content_checks[upload] = ContentValidator(upload.filename)
+
+    def on_part_data(self, data, start, end):
+        if self._part_upload is None:
+            super().on_part_data(data, start, end)
+        else:
+            self._pending_writes.append((self._part_upload, data[start:end]))
+
+    def on_part_end(self):
+        if self._part_upload is None:
+            super().on_part_end()
+        else:
+            self.items.append(self._uploads[-1])
+            self._finished_uploads.append(self._part_upload)
+
+    async def _check_fields(self):
+        if not self._fields_checked:
+            self._fields_checked = True
+            await self.on_fields(FormData(self.items))
+
+    async def _write_parts(self):
+        """Spool the file data parsed from the last chunk."""
+        if self._uploads and not self._fields_checked:
+            await self._check_fields()
+        for upload, data in self._pending_writes:
+            self._file_bytes += len(data)
+            if self._file_bytes > self.max_size:
+                raise HTTPException(400, f"Upload exceeds {self.max_size // (1024 * 1024)}MB limit")
+            check = self.content_checks[upload]
+            check.sniff(data)
+            await run_io(_spool, upload, check.digest, data)
+            upload.size += len(data)
+        for upload in self._finished_uploads:
+            self.content_checks[upload].finish()
+            await upload.seek(0)
+        self._pending_writes.clear()
+        self._finished_uploads.clear()
+
+    async def _feed(self, stream):
+        # Starlette parses each chunk before asking for the next one
+        async for chunk in stream:
+            yield chunk
+            await self._write_parts()
+        await self._check_fields()
+
+    async def parse(self):
+        try:
+            return await super().parse()
+        except MultiPartException as exc:
+            self._close_uploads()
+            raise HTTPException(400, exc.message)
+        except BaseException:
+            self._close_uploads()
+            raise
+
+    def _close_uploads(self):
+        for _, upload in self._uploads:
+            upload.file.close()
+
+async def parse_upload_form(request: Request, on_fields, max_files, max_size):
+    """Parse a multipart upload exactly once, validating fields before files.
+
+    The parsed form is cached on the request, so any later
+    ``request.form()`` call returns it instead of reading the body again.
+    Returns the form and the ``ContentValidator`` of each UploadFile in it,
+    which holds the file's SHA-256.
+    """
+    content_type, _ = parse_options_header(request.headers.get("Content-Type"))
+    if content_type != b"multipart/form-data":
+        raise HTTPException(400, "Expected multipart/form-data")
+    parser = EarlyValidatingMultiPartParser(
+        request.headers, request.stream(), on_fields, max_size, max_files=max_files,
+    )
+    form = await parser.parse()
+    request._form = form
+    return form, parser.content_checks
@@ -0,0 +1,133 @@
+"""Work done after an upload is saved, run by the job workers in app.background.
+
+Uploads return once their files are stored; checksums and image previews
+are filled in afterwards through the ``jobs`` table.
+"""
+import importlib.util
+import os
+import tempfile
+
+from app.config import get_settings
+from app.db import count_file_references, get_link, set_file_checksums, set_file_preview
+from app.services.link_cache import invalidate_link
+from app.storage import get_storage
+from app.utils.file_utils import file_checksums, remove_files
+
+PREVIEW_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+class RetryLater(Exception):
+    """A job that cannot run yet; the worker retries it with backoff."""
+
+def _needs_checksums(f, files):
+    # CRC-32s only serve the zip archive, which is offered for several files
+    return f["sha256"] is None or (len(files) > 1 and f.get("crc32") is None)
+
+def _wants_preview(f):
+    return os.path.splitext(f["name"])[1].lower() in PREVIEW_EXTENSIONS and not f.get("preview")
+
+def previews_supported():
+    # Optional: pip install Pillow. Only imported by the job that uses it,
+    # so the web process doesn't load it.
+    return importlib.util.find_spec("PIL") is not None
+
+def post_upload_jobs(files):
+    """Kinds of job to queue for a newly saved link with these file records."""
+    jobs = []
+    if any(_needs_checksums(f, files) for f in files):
+        jobs.append("checksums")
+    if previews_supported() and any(_wants_preview(f) for f in files):
+        jobs.append("previews")
+    return jobs
+
+def compute_checksums(slug):
+    """Record the SHA-256 and CRC-32 of the slug's files in one read of each.
+
+    Files stored before their hash was known are deduplicated once it is.
+    With every CRC-32 in the DB, the zip archive of the slug is fully
+    described without reading file data, so ranged requests into its
+    central directory are served straight away.
+    """
+    row = get_link(slug)
+    if row is None:
+        return
+    files = row[1]
+    storage = get_storage()
+    for f in files:
+        if not _needs_checksums(f, files):
+            continue
+        with storage.open(f["path"], f["sha256"]) as fh:
+            sha256, crc32 = file_checksums(fh)
+            if f["sha256"] is None:
+                storage.adopt(f["path"], sha256, fh)
+        set_file_checksums(slug, f, f["sha256"] or sha256, crc32)
+    invalidate_link(slug)
+
+def preview_dir():
+    """Previews are named by the content hash, so identical images share one."""
+    return os.path.join(get_settings().UPLOAD_DIR, ".previews")
+
+def preview_path(sha256):
+    return os.path.join(preview_dir(), sha256[:2], f"{sha256}.jpg")
+
+def write_preview(f, path):
+    """Scale an image down to PREVIEW_SIZE and save it as a JPEG at ``path``."""
+    from PIL import Image, ImageOps
+
+    size = get_settings().PREVIEW_SIZE
+    with get_storage().open(f["path"], f["sha256"]) as fh, Image.open(fh) as image:
+        # JPEGs are decoded at a reduced scale directly
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode not in ("RGB", "L"):
+            # Flatten transparency onto white rather than black
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, "white")
+            image.paste(rgba, mask=rgba.getchannel("A"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                image.save(out, "JPEG", quality=80, optimize=True)
+            os.replace(tmp_path, path)
+        except BaseException:
+            remove_files([tmp_path])
+            raise
+
+def make_previews(slug):
+    """Create the previews shown on the download page for the slug's images."""
+    if not previews_supported():
+        return
+    from PIL import Image
+
+    row = get_link(slug)
+    if row is None:
+        return
+    for f in row[1]:
+        if not _wants_preview(f):
+            continue
+        if f["sha256"] is None:
+            raise RetryLater("waiting for checksums")
+        path = preview_path(f["sha256"])
+        if not os.path.isfile(path):
+            try:
+                write_preview(f, path)
+            except (OSError, Image.DecompressionBombError) as e:
+                # Not a readable image; the page just lists it without a preview
+                print(f"No preview for {slug}/{f['name']}: {str(e)}")
+                continue
+        set_file_preview(slug, f["name"], f["sha256"])
+    invalidate_link(slug)
+
+def prune_previews(sha256s):
+    """Delete the previews of content that no file refers to any more."""
+    sha256s = set(filter(None, sha256s))
+    if not sha256s:
+        return
+    referenced = count_file_references(sha256s)
+    remove_files([preview_path(sha256) for sha256 in sha256s if sha256 not in referenced])
+
+JOB_HANDLERS = {
+    "checksums": compute_checksums,
+    "previews": make_previews,
+}
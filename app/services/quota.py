@@ -0,0 +1,82 @@
+"""Per-slug quotas and disk-pressure admission for uploads."""
+import shutil
+import threading
+from contextlib import contextmanager
+from fastapi import HTTPException
+
+from app.config import get_settings
+from app.db import get_total_usage
+from app.background import evict_links
+from app.services.metrics import UPLOADS_REJECTED
+
+MB = 1024 * 1024
+# Multipart boundaries, part headers and text fields on top of the file bytes
+FORM_OVERHEAD = MB
+
+# Bytes declared by uploads this process has admitted but not finished yet
+_reserved = 0
+_reserved_lock = threading.Lock()
+
+def upload_limit():
+    """Most file bytes a single upload request may carry."""
+    settings = get_settings()
+    if settings.SLUG_QUOTA:
+        return min(settings.MAX_SIZE, settings.SLUG_QUOTA)
+    return settings.MAX_SIZE
+
+def check_request_size(content_length, limit):
+    """Reject with 413 a declared body that can't fit ``limit`` bytes of files."""
+    if content_length is not None and content_length > limit + FORM_OVERHEAD:
+        UPLOADS_REJECTED.inc(reason="request_size")
+        raise HTTPException(413, f"Upload exceeds {limit // MB}MB limit")
+
+def check_slug_quota(used, incoming):
+    """Reject with 413 when ``incoming`` bytes would take a slug past SLUG_QUOTA."""
+    settings = get_settings()
+    if settings.SLUG_QUOTA and used + incoming > settings.SLUG_QUOTA:
+        UPLOADS_REJECTED.inc(reason="slug_quota")
+        raise HTTPException(413, f"Slug quota of {settings.SLUG_QUOTA // MB}MB exceeded")
+
+def _has_room(incoming):
+    settings = get_settings()
+    if settings.DISK_BUDGET and get_total_usage() + incoming > settings.DISK_BUDGET:
+        return False
+    return shutil.disk_usage(settings.UPLOAD_DIR).free - incoming >= settings.DISK_MIN_FREE
+
+def admit(incoming, evict=False):
+    """Reject with 507 unless ``incoming`` more bytes fit the disk budget and free-space floor.
+
+    Uploads already admitted by this process count against the room left.
+    With ``evict`` and EVICT_ON_PRESSURE the links closest to expiry are
+    deleted to make room instead; only pass it once the request has been
+    authenticated. Blocking: call it from a worker thread.
+    """
+    with _reserved_lock:
+        needed = incoming + _reserved
+    if _has_room(needed):
+        return
+    if evict and get_settings().EVICT_ON_PRESSURE and evict_links(lambda: _has_room(needed)):
+        return
+    UPLOADS_REJECTED.inc(reason="disk_pressure")
+    raise HTTPException(507, "Not enough storage space for this upload")
+
+def make_room():
+    """Make room for the uploads admitted so far, evicting links if EVICT_ON_PRESSURE allows.
+
+    Called by upload handlers once the password has been checked; the
+    request's own body is already reserved by AdmissionMiddleware. Blocking.
+    """
+    if get_settings().EVICT_ON_PRESSURE:
+        admit(0, evict=True)
+
+@contextmanager
+def reserve(incoming):
+    """Count ``incoming`` bytes against the room left while an upload runs."""
+    global _reserved
+    with _reserved_lock:
+        _reserved += incoming
+    try:
+        yield
+    finally:
+        with _reserved_lock:
+            _reserved -= incoming
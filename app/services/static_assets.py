@@ -0,0 +1,65 @@
+import hashlib
+import os
+import threading
+
+from fastapi.responses import Response
+
+from app.config import get_settings
+from app.services.download_engine import is_not_modified
+from app.templating import get_templates
+from app.utils.compression import ENCODINGS, choose_encoding, compress
+
+class StaticAsset:
+    """An in-memory response body with its compressed variants computed once.
+
+    Each representation gets its own strong ETag, so caches never mix a
+    gzip body up with the identity one.
+    """
+
+    def __init__(self, body, media_type, cache_seconds):
+        self.media_type = media_type
+        self.cache_control = f"public, max-age={cache_seconds}"
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.variants = {None: (body, f'"{digest}"')}
+        for encoding in ENCODINGS:
+            compressed = compress(body, encoding)
+            # Only keep encodings that actually make the body smaller
+            if len(compressed) < len(body):
+                self.variants[encoding] = (compressed, f'"{digest}-{encoding}"')
+
+    def response(self, request):
+        available = [e for e in ENCODINGS if e in self.variants]
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""), available)
+        body, etag = self.variants[encoding]
+        headers = {"ETag": etag, "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        if is_not_modified(request, etag):
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(body, media_type=self.media_type, headers=headers)
+
+_assets = {}
+_assets_lock = threading.Lock()
+
+def cached_asset(key, build):
+    """Return the asset stored under ``key``, building it on first use."""
+    asset = _assets.get(key)
+    if asset is None:
+        with _assets_lock:
+            asset = _assets.get(key)
+            if asset is None:
+                asset = _assets[key] = build()
+    return asset
+
+def upload_form_asset():
+    """The upload form; its template has no per-request content, so it is rendered once."""
+    return cached_asset("upload.html", lambda: StaticAsset(
+        get_templates().get_template("upload.html").render().encode(),
+        "text/html", get_settings().FORM_CACHE_SECONDS,
+    ))
+
+def favicon_asset():
+    def build():
+        with open(os.path.join(get_settings().TEMPLATES_DIR, "favicon.ico"), "rb") as f:
+            return StaticAsset(f.read(), "image/x-icon", get_settings().STATIC_CACHE_SECONDS)
+    return cached_asset("favicon.ico", build)
@@ -1,10 +1,18 @@
 import os
 import zipfile
-import io
 import re
+import tempfile
+import time
 from fastapi import HTTPException, UploadFile
+from app.utils.file_utils import (
+    CHUNK_SIZE, save_upload_file, remove_files, describe_file, file_sha256, run_io, upload_path,
+)
+from app.storage import get_storage
+from app.services.metrics import span
 
 ALLOWED_EXTENSIONS = {'.pdf', '.jpg', '.jpeg', '.png', '.txt', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.md'}
+# Formats that are already compressed; deflating them again only burns CPU
+COMPRESSED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.docx', '.xlsx', '.pptx'}
 
 def is_safe_slug(slug):
     """Validate that slug is safe to use as a folder name."""
@@ -16,8 +24,65 @@ def is_safe_filename(filename):
     ext = os.path.splitext(filename)[1].lower()
     return ext in ALLOWED_EXTENSIONS
 
-async def process_uploads(files, upload_dir, slug):
-    """Process uploaded files and save them to the specified directory."""
+def write_folder_zip(zip_path, folder_files, total_size, max_size):
+    """Zip folder uploads into a temp file and publish it as ``zip_path``.
+
+    Each part is copied in chunks from its spooled upload file, so neither the
+    raw content nor the archive is held in memory. Returns the new running
+    total and the archive's SHA-256, or None when the storage backend lets
+    the checksums job hash it later. Blocking: call it from a worker thread.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(zip_path), prefix=".", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out, zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zipf:
+            for file in folder_files:
+                info = zipfile.ZipInfo(file.filename, date_time=time.localtime()[:6])
+                ext = os.path.splitext(file.filename)[1].lower()
+                info.compress_type = zipfile.ZIP_STORED if ext in COMPRESSED_EXTENSIONS else zipfile.ZIP_DEFLATED
+                with zipf.open(info, "w", force_zip64=max_size > zipfile.ZIP64_LIMIT) as entry:
+                    while True:
+                        chunk = file.file.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        total_size += len(chunk)
+                        if total_size > max_size:
+                            raise HTTPException(400, f"Upload exceeds {max_size // (1024 * 1024)}MB limit")
+                        entry.write(chunk)
+        storage = get_storage()
+        sha256 = file_sha256(tmp_path) if storage.needs_hash else None
+        storage.publish(tmp_path, zip_path, sha256)
+    except BaseException:
+        remove_files([tmp_path])
+        raise
+    return total_size, sha256
+
+def store_bytes(path, data, sha256, name):
+    """Store ``data``, whose SHA-256 is ``sha256``, as the file ``path`` and return the record of file ``name``.
+
+    Used for file content that arrives inline (the JSON batch API). Blocking:
+    call it from a worker thread.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        get_storage().publish(tmp_path, path, sha256)
+    except BaseException:
+        remove_files([tmp_path])
+        raise
+    return describe_file(path, sha256, name)
+
+async def process_uploads(files, content_checks, slug, max_size=50 * 1024 * 1024):
+    """Process uploaded files and save them in the slug's folder.
+
+    Regular files are streamed to disk in chunks; the whole request is
+    rejected as soon as more than ``max_size`` bytes have been received.
+    ``content_checks`` maps each file to the ``ContentValidator`` that
+    sniffed and hashed it as it arrived (see ``parse_upload_form``), so the
+    copy doesn't read the data a second time.
+    Returns ``(files, total_size)`` with a metadata record per stored file.
+    """
     folder_files = []
     regular_files = []
     total_size = 0
@@ -33,44 +98,30 @@ async def process_uploads(files, upload_dir, slug):
             regular_files.append(file)
 
     saved_files = []
-    # Save regular files
-    for file in regular_files:
-        filename = os.path.basename(file.filename)
-        content = await file.read()
-        total_size += len(content)
-        path = os.path.join(upload_dir, slug, filename)
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, "wb") as f:
-            f.write(content)
-        saved_files.append(path)
+    try:
+        # Save regular files
+        with span("disk_write"):
+            for file in regular_files:
+                filename = os.path.basename(file.filename)
+                path = upload_path(slug, filename)
+                await run_io(os.makedirs, os.path.dirname(path), exist_ok=True)
+                sha256 = content_checks[file].hexdigest()
+                total_size = await save_upload_file(file, path, total_size, max_size, sha256)
+                saved_files.append(await run_io(describe_file, path, sha256, filename))
 
-    # If folder files exist, zip them together
-    if folder_files:
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zipf:
-            for file in folder_files:
-                arcname = file.filename
-                content = await file.read()
-                total_size += len(content)
-                zipf.writestr(arcname, content)
-        zip_name = f"{slug}_folders_{len(folder_files)}.zip"
-        zip_path = os.path.join(upload_dir, slug, zip_name)
-        with open(zip_path, "wb") as f:
-            f.write(zip_buffer.getvalue())
-        saved_files.append(zip_path)
+        # If folder files exist, zip them together off the event loop
+        if folder_files:
+            zip_name = f"{slug}_folders_{len(folder_files)}.zip"
+            zip_path = upload_path(slug, zip_name)
+            await run_io(os.makedirs, os.path.dirname(zip_path), exist_ok=True)
+            with span("zip"):
+                total_size, sha256 = await run_io(write_folder_zip, zip_path, folder_files, total_size, max_size)
+            saved_files.append(await run_io(describe_file, zip_path, sha256, zip_name))
+    except BaseException:
+        storage = get_storage()
+        for f in saved_files:
+            await run_io(storage.release, f["path"], f["sha256"])
+        await run_io(storage.prune, [f["sha256"] for f in saved_files])
+        raise
 
     return saved_files, total_size
-
-async def check_password(request):
-    """Extract and validate password from request form."""
-    form = await request.form()
-    if "pw" not in form:
-        raise HTTPException(401, "Password required")
-    pw = form["pw"]
-
-    # Get password from environment variable or use default
-    expected_password = os.environ.get("UPLOAD_PASSWORD", "123")
-    if pw != expected_password:
-        raise HTTPException(401, "Invalid password")
-    
-    return pw
@@ -0,0 +1,214 @@
+import hashlib
+import struct
+import threading
+import time
+import zlib
+
+from app.storage import get_storage
+from app.utils.file_utils import CHUNK_SIZE
+
+# ZIP flags: sizes/CRC follow the data (bit 3), names are UTF-8 (bit 11)
+_FLAGS = 0x0008 | 0x0800
+_VERSION = 20
+_ZIP64_VERSION = 45
+# Past these, sizes, offsets and the member count go in ZIP64 records
+_ZIP32_LIMIT = 0xFFFFFFFF
+_ZIP32_MAX_MEMBERS = 0xFFFF
+# What the 32-bit fields hold when the value is in a ZIP64 record
+_ZIP64_MARK = 0xFFFFFFFF
+_ZIP64_MARK_16 = 0xFFFF
+
+# CRC-32 of files keyed by (path, size, mtime_ns), filled in as archives are
+# streamed so ranged requests into the descriptor or central directory don't
+# have to re-read every file.
+_crc_cache = {}
+_crc_lock = threading.Lock()
+_CRC_CACHE_MAX = 10000
+
+def _remember_crc(key, crc):
+    with _crc_lock:
+        if len(_crc_cache) >= _CRC_CACHE_MAX:
+            _crc_cache.clear()
+        _crc_cache[key] = crc
+
+def _dos_datetime(mtime):
+    t = time.localtime(mtime)
+    year = max(t.tm_year, 1980)
+    dos_date = ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    return dos_time, dos_date
+
+def _file_crc(member):
+    crc = 0
+    with get_storage().open(member["path"], member["sha256"]) as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+class ZipStream:
+    """A stored (uncompressed) zip archive of stored files, generated on the fly.
+
+    The archive layout depends only on the member names, sizes and mtimes
+    recorded in the DB, so its total size and ETag are known before any data
+    is read and arbitrary byte ranges can be served without building the
+    archive first.
+
+    Archives past 4 GiB or 65535 members are written in ZIP64: every member
+    then gets 64-bit sizes in its descriptor and a ZIP64 extra field, and
+    the end of the archive a ZIP64 end record and locator.
+    """
+
+    def __init__(self, files):
+        self.members = []
+        for f in files:
+            dos_time, dos_date = _dos_datetime(f["mtime"] or 0)
+            self.members.append({
+                "name": f["name"].encode("utf-8"),
+                "path": f["path"],
+                "sha256": f["sha256"],
+                "size": f["size"],
+                "key": (f["sha256"] or f["path"], f["size"], f["mtime"]),
+                "crc": f.get("crc32"),
+                "time": dos_time,
+                "date": dos_date,
+            })
+
+        self.zip64 = False
+        self._lay_out()
+        if self.size > _ZIP32_LIMIT or len(self.members) > _ZIP32_MAX_MEMBERS:
+            self.zip64 = True
+            self._lay_out()
+
+        digest = hashlib.sha1()
+        for m in self.members:
+            digest.update(repr((m["name"], m["size"], m["key"][2])).encode())
+        self.etag = f'"{digest.hexdigest()}"'
+
+    def _lay_out(self):
+        offset = 0
+        for m in self.members:
+            m["offset"] = offset
+            offset += self._local_header_size(m) + m["size"] + self._descriptor_size()
+        self.cd_offset = offset
+        self.cd_size = sum(self._central_header_size(m) for m in self.members)
+        self.size = self.cd_offset + self.cd_size + self._end_size()
+
+    def _local_header_size(self, m):
+        return 30 + len(m["name"]) + (20 if self.zip64 else 0)
+
+    def _descriptor_size(self):
+        return 24 if self.zip64 else 16
+
+    def _central_header_size(self, m):
+        return 46 + len(m["name"]) + (28 if self.zip64 else 0)
+
+    def _end_size(self):
+        return 56 + 20 + 22 if self.zip64 else 22
+
+    def _crc(self, member):
+        if member["crc"] is not None:
+            return member["crc"]  # Recorded by the checksums job
+        with _crc_lock:
+            crc = _crc_cache.get(member["key"])
+        if crc is None:
+            crc = _file_crc(member)
+            _remember_crc(member["key"], crc)
+        return crc
+
+    def _local_header(self, m):
+        if not self.zip64:
+            return struct.pack(
+                "<IHHHHHIIIHH", 0x04034B50, _VERSION, _FLAGS, 0, m["time"], m["date"],
+                0, 0, 0, len(m["name"]), 0,
+            ) + m["name"]
+        # The sizes follow in the descriptor; the extra field marks them as 64-bit
+        return struct.pack(
+            "<IHHHHHIIIHH", 0x04034B50, _ZIP64_VERSION, _FLAGS, 0, m["time"], m["date"],
+            0, _ZIP64_MARK, _ZIP64_MARK, len(m["name"]), 20,
+        ) + m["name"] + struct.pack("<HHQQ", 0x0001, 16, 0, 0)
+
+    def _descriptor(self, m):
+        if self.zip64:
+            return struct.pack("<IIQQ", 0x08074B50, self._crc(m), m["size"], m["size"])
+        return struct.pack("<IIII", 0x08074B50, self._crc(m), m["size"], m["size"])
+
+    def _central_header(self, m):
+        if not self.zip64:
+            return struct.pack(
+                "<IHHHHHHIIIHHHHHII", 0x02014B50, _VERSION, _VERSION, _FLAGS, 0,
+                m["time"], m["date"], self._crc(m), m["size"], m["size"],
+                len(m["name"]), 0, 0, 0, 0, 0, m["offset"],
+            ) + m["name"]
+        return struct.pack(
+            "<IHHHHHHIIIHHHHHII", 0x02014B50, _ZIP64_VERSION, _ZIP64_VERSION, _FLAGS, 0,
+            m["time"], m["date"], self._crc(m), _ZIP64_MARK, _ZIP64_MARK,
+            len(m["name"]), 28, 0, 0, 0, 0, _ZIP64_MARK,
+        ) + m["name"] + struct.pack("<HHQQQ", 0x0001, 24, m["size"], m["size"], m["offset"])
+
+    def _end_record(self):
+        count = len(self.members)
+        if not self.zip64:
+            return struct.pack(
+                "<IHHHHIIH", 0x06054B50, 0, 0, count, count, self.cd_size, self.cd_offset, 0,
+            )
+        end64_offset = self.cd_offset + self.cd_size
+        return struct.pack(
+            "<IQHHIIQQQQ", 0x06064B50, 44, _ZIP64_VERSION, _ZIP64_VERSION, 0, 0,
+            count, count, self.cd_size, self.cd_offset,
+        ) + struct.pack(
+            "<IIQI", 0x07064B50, 0, end64_offset, 1,
+        ) + struct.pack(
+            "<IHHHHIIH", 0x06054B50, 0, 0, _ZIP64_MARK_16, _ZIP64_MARK_16,
+            _ZIP64_MARK, _ZIP64_MARK, 0,
+        )
+
+    def _segments(self):
+        """Yield ``(length, producer)`` for each contiguous piece of the archive.
+
+        ``producer(skip, length)`` yields the bytes of the piece starting at
+        ``skip``; it is only called for pieces that overlap the requested range.
+        """
+        for m in self.members:
+            yield self._local_header_size(m), lambda skip, n, m=m: iter([self._local_header(m)[skip:skip + n]])
+            yield m["size"], lambda skip, n, m=m: self._file_bytes(m, skip, n)
+            yield self._descriptor_size(), lambda skip, n, m=m: iter([self._descriptor(m)[skip:skip + n]])
+        for m in self.members:
+            yield self._central_header_size(m), lambda skip, n, m=m: iter([self._central_header(m)[skip:skip + n]])
+        yield self._end_size(), lambda skip, n: iter([self._end_record()[skip:skip + n]])
+
+    def _file_bytes(self, m, skip, n):
+        # When the whole member is sent, compute its CRC on the way through
+        whole = skip == 0 and n == m["size"]
+        crc = 0
+        with get_storage().open(m["path"], m["sha256"]) as f:
+            f.seek(skip)
+            remaining = n
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise IOError(f"{m['path']} changed while streaming")
+                if whole:
+                    crc = zlib.crc32(chunk, crc)
+                remaining -= len(chunk)
+                yield chunk
+        if whole:
+            _remember_crc(m["key"], crc)
+
+    def iter_bytes(self, start=0, end=None):
+        """Yield the archive bytes from ``start`` to ``end`` inclusive."""
+        if end is None:
+            end = self.size - 1
+        pos = 0
+        for length, producer in self._segments():
+            seg_start, seg_end = pos, pos + length - 1
+            pos += length
+            if length == 0 or seg_end < start:
+                continue
+            if seg_start > end:
+                break
+            skip = max(start - seg_start, 0)
+            n = min(end, seg_end) - seg_start - skip + 1
+            yield from producer(skip, n)
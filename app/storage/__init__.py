@@ -0,0 +1,24 @@
+import threading
+
+from app.config import get_settings
+from app.storage.base import StorageBackend
+
+_storage = None
+_storage_lock = threading.Lock()
+
+def get_storage() -> StorageBackend:
+    """Return the process-wide storage backend selected by ``STORAGE_BACKEND``."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                settings = get_settings()
+                if settings.STORAGE_BACKEND == "s3":
+                    from app.storage.s3 import S3Storage
+                    _storage = S3Storage()
+                elif settings.STORAGE_BACKEND == "local":
+                    from app.storage.local import LocalStorage
+                    _storage = LocalStorage()
+                else:
+                    raise RuntimeError(f"Unknown STORAGE_BACKEND: {settings.STORAGE_BACKEND}")
+    return _storage
@@ -0,0 +1,51 @@
+from abc import ABC, abstractmethod
+
+class StorageBackend(ABC):
+    """Where finished uploads are kept.
+
+    Files are addressed by their logical ``path`` (``UPLOAD_DIR/<slug>/<name>``)
+    together with the SHA-256 of their content, which backends use to store
+    each distinct content once.
+    """
+
+    @abstractmethod
+    def publish(self, tmp_path, path, sha256):
+        """Take ownership of the completely written local file ``tmp_path``."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def release(self, path, sha256):
+        """Drop the slug's reference to a file (its DB row may still exist)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def prune(self, sha256s):
+        """Delete stored content that no DB row references any more."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def stat(self, path, sha256):
+        """Return ``(size, mtime)`` of a stored file."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def open(self, path, sha256):
+        """Open a stored file for reading; the object supports ``seek`` and ``read``."""
+        raise NotImplementedError
+
+    # Whether publish() needs the content hash; backends that can take it
+    # later via adopt() let uploads skip re-reading files to hash them
+    needs_hash = True
+
+    @abstractmethod
+    def adopt(self, path, sha256, f):
+        """Deduplicate a file published without its hash, now that it is known.
+
+        ``f`` is the open file that was hashed; nothing happens if ``path``
+        has been replaced since.
+        """
+        raise NotImplementedError
+
+    def download_url(self, path, sha256, filename):
+        """URL clients can fetch the file from directly, or None to serve it from here."""
+        return None
@@ -0,0 +1,120 @@
+import os
+
+from app.config import get_settings
+from app.storage.base import StorageBackend
+
+def blob_dir():
+    """Content-addressed store: one copy of each distinct upload, named by its SHA-256."""
+    return os.path.join(get_settings().UPLOAD_DIR, ".blobs")
+
+def blob_path(sha256):
+    return os.path.join(blob_dir(), sha256[:2], sha256)
+
+def commit_blob(tmp_path, path, sha256):
+    """Move a completely written temp file to ``path``, deduplicating its content.
+
+    The slug's file is a hard link to the blob for ``sha256``, so each
+    distinct content is stored once and the blob's link count is its
+    reference count. If the content is already stored the temp file is
+    dropped. Falls back to a plain rename when deduplication is disabled or
+    the filesystem has no hard links.
+    """
+    if not get_settings().DEDUP_UPLOADS or not sha256:
+        os.replace(tmp_path, path)
+        return
+    blob = blob_path(sha256)
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    link_tmp = tmp_path + ".link"
+    for _ in range(3):
+        try:
+            # Atomically adds the blob unless the same content is already stored
+            os.link(tmp_path, blob)
+        except FileExistsError:
+            try:
+                os.link(blob, link_tmp)
+            except FileNotFoundError:
+                continue  # Released by the reaper in between; store it again
+            os.replace(link_tmp, path)
+            os.remove(tmp_path)
+            return
+        except OSError:
+            break  # No hard link support here
+        else:
+            os.replace(tmp_path, path)
+            return
+    os.replace(tmp_path, path)
+
+def release_file(path, sha256=None):
+    """Remove a slug's file and drop its blob once nothing links to it."""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    if sha256:
+        blob = blob_path(sha256)
+        try:
+            if os.stat(blob).st_nlink <= 1:
+                os.remove(blob)
+        except OSError:
+            pass
+
+def _same_file(a, b):
+    return (a.st_dev, a.st_ino) == (b.st_dev, b.st_ino)
+
+def adopt_file(path, sha256, f):
+    """Link a file stored without deduplication into the blob store.
+
+    If the content is already stored, ``path`` is swapped for a link to the
+    existing blob. ``f`` is the open file that was hashed, used to make sure
+    ``path`` still is that file.
+    """
+    if not get_settings().DEDUP_UPLOADS:
+        return
+    hashed = os.fstat(f.fileno())
+    if not _same_file(os.stat(path), hashed):
+        return
+    blob = blob_path(sha256)
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    try:
+        os.link(path, blob)
+    except FileExistsError:
+        link_tmp = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.link")
+        try:
+            os.link(blob, link_tmp)
+        except FileNotFoundError:
+            return  # Released in between; the file keeps its own copy
+        if _same_file(os.stat(path), hashed):
+            os.replace(link_tmp, path)
+        else:
+            os.remove(link_tmp)
+        return
+    except OSError:
+        return  # No hard link support here
+    if not _same_file(os.stat(blob), hashed):
+        # path was replaced between the check and the link
+        os.remove(blob)
+
+class LocalStorage(StorageBackend):
+    """Files under UPLOAD_DIR, deduplicated through hard links into ``.blobs``."""
+
+    needs_hash = False
+
+    def publish(self, tmp_path, path, sha256):
+        commit_blob(tmp_path, path, sha256)
+
+    def release(self, path, sha256):
+        release_file(path, sha256)
+
+    def adopt(self, path, sha256, f):
+        adopt_file(path, sha256, f)
+
+    def prune(self, sha256s):
+        # Hard link counts already drop blobs in release()
+        pass
+
+    def stat(self, path, sha256):
+        st = os.stat(path)
+        return st.st_size, st.st_mtime
+
+    def open(self, path, sha256):
+        return open(path, "rb")
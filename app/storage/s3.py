@@ -0,0 +1,143 @@
+import io
+import os
+import time
+from datetime import datetime, timedelta
+
+from app.config import get_settings
+from app.storage.base import StorageBackend
+
+# A deletion marked longer ago than this is assumed to have died
+DELETE_TIMEOUT = 60
+
+class S3Reader(io.RawIOBase):
+    """Seekable read-only view of an S3 object; each read is a ranged GET."""
+
+    def __init__(self, client, bucket, key, size):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.pos = max(offset, 0)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        if self.pos >= self.size:
+            return b""
+        end = self.size - 1 if size is None or size < 0 else min(self.pos + size, self.size) - 1
+        response = self.client.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={self.pos}-{end}")
+        data = response["Body"].read()
+        self.pos += len(data)
+        return data
+
+class S3Storage(StorageBackend):
+    """Files in an S3-compatible bucket (AWS, MinIO, ...), one object per distinct content.
+
+    Slugs only hold DB rows pointing at ``blobs/<sha256>`` objects, so the
+    reference count of an object is the number of ``files`` rows with its
+    hash. Downloads are redirected to presigned URLs.
+
+    Whether an object is stored is decided by its ``stored_blobs`` row, not
+    by asking the bucket: an upload claims the hash before skipping the
+    copy, and ``prune`` only deletes objects that no row references and no
+    upload claimed within S3_CLAIM_SECONDS, so it can't delete content an
+    upload is about to reference.
+    """
+
+    def __init__(self):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires boto3 (pip install boto3)")
+        settings = get_settings()
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=settings.S3_ENDPOINT_URL or None,
+            region_name=settings.S3_REGION or None,
+        )
+        self.bucket = settings.S3_BUCKET
+
+    def key(self, sha256):
+        return f"{get_settings().S3_PREFIX}blobs/{sha256[:2]}/{sha256}"
+
+    def _head(self, sha256):
+        from botocore.exceptions import ClientError
+
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key(sha256))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def publish(self, tmp_path, path, sha256):
+        from app.db import claim_blob, set_blob_stored
+
+        if not sha256:
+            raise ValueError("S3 storage needs the content hash of every file")
+        try:
+            state = claim_blob(sha256, DELETE_TIMEOUT)
+            while state == "deleting":
+                # Uploaded again once the delete in flight is done
+                time.sleep(0.2)
+                state = claim_blob(sha256, DELETE_TIMEOUT)
+            if state == "upload":
+                self.client.upload_file(tmp_path, self.bucket, self.key(sha256))
+                set_blob_stored(sha256)
+        finally:
+            os.remove(tmp_path)
+
+    def release(self, path, sha256):
+        # Objects are shared; they are deleted by prune() once no row uses them
+        pass
+
+    def adopt(self, path, sha256, f):
+        # publish() always gets the hash (needs_hash), so nothing is left to adopt
+        pass
+
+    def prune(self, sha256s):
+        from app.db import forget_blobs, mark_blobs_deleting
+
+        claimed_before = datetime.utcnow() - timedelta(seconds=get_settings().S3_CLAIM_SECONDS)
+        marked = mark_blobs_deleting(sorted(set(filter(None, sha256s))), claimed_before)
+        for sha256 in marked:
+            self.client.delete_object(Bucket=self.bucket, Key=self.key(sha256))
+        forget_blobs(marked)
+
+    def stat(self, path, sha256):
+        head = self._head(sha256)
+        if head is None:
+            raise FileNotFoundError(path)
+        return head["ContentLength"], head["LastModified"].timestamp()
+
+    def open(self, path, sha256):
+        size, _ = self.stat(path, sha256)
+        return S3Reader(self.client, self.bucket, self.key(sha256), size)
+
+    def download_url(self, path, sha256, filename):
+        from app.services.download_engine import content_disposition
+
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": self.key(sha256),
+                "ResponseContentDisposition": content_disposition(filename),
+            },
+            ExpiresIn=get_settings().S3_URL_EXPIRY,
+        )
@@ -0,0 +1,16 @@
+import threading
+
+from app.config import get_settings
+
+_templates = None
+_templates_lock = threading.Lock()
+
+def get_templates():
+    """Return the shared Jinja2 environment, creating it (and importing jinja2) on first use."""
+    global _templates
+    if _templates is None:
+        with _templates_lock:
+            if _templates is None:
+                from fastapi.templating import Jinja2Templates
+                _templates = Jinja2Templates(directory=get_settings().TEMPLATES_DIR)
+    return _templates
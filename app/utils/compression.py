@@ -0,0 +1,53 @@
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:  # In requirements.txt; gzip only without it
+    brotli = None
+
+# Preferred first; brotli is only offered when the module is installed
+ENCODINGS = ("br", "gzip") if brotli else ("gzip",)
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/xml", "image/svg+xml")
+
+def is_compressible(content_type):
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+def choose_encoding(accept_encoding, available=ENCODINGS):
+    """Pick the preferred content coding the client accepts, or None."""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    for encoding in available:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+def compress(data, encoding):
+    """One-shot compression at the highest level, for bodies computed once."""
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+class StreamCompressor:
+    """Incremental compressor for response bodies sent in several messages."""
+
+    def __init__(self, encoding):
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=4)
+            self.compress = compressor.process
+            self.flush = compressor.finish
+        else:
+            # wbits=31 writes a gzip header and trailer
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            self.compress = compressor.compress
+            self.flush = compressor.flush
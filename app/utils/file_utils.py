@@ -1,46 +1,169 @@
 import os
-import json
-from fastapi import UploadFile, HTTPException
-from app.config import settings
-
-async def process_uploads(files, slug):
-    """Process uploaded files and save them to the specified directory."""
-    total_size = 0
-    saved_files = []
-    folder = os.path.join(settings.UPLOAD_DIR, slug)
-    os.makedirs(folder, exist_ok=True)
-    
-    for file in files:
-        if isinstance(file, UploadFile) and file.filename:
-            safe_filename = os.path.basename(file.filename)
-            file_path = os.path.join(folder, safe_filename)
-            
-            # Read the file content
-            content = await file.read()
-            total_size += len(content)
-            
-            # Write the content to disk
-            with open(file_path, "wb") as f:
-                f.write(content)
-            
-            saved_files.append(os.path.join(settings.UPLOAD_DIR, slug, safe_filename))
-    
-    return saved_files, total_size
-
-def cleanup_files(slug, files_json):
-    """Delete files associated with a slug."""
-    files = json.loads(files_json) if files_json else []
-    for f in files:
+import asyncio
+import hashlib
+import secrets
+import tempfile
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from mimetypes import guess_type
+from fastapi import HTTPException
+from app.config import get_settings
+from app.storage import get_storage
+
+CHUNK_SIZE = 1024 * 1024  # 1MB
+
+# Blocking disk work from the async upload path runs here; the pool size caps
+# how many threads can be busy writing so disk I/O can't starve requests.
+_io_executor = None
+_io_executor_lock = threading.Lock()
+
+def _get_io_executor():
+    global _io_executor
+    if _io_executor is None:
+        with _io_executor_lock:
+            if _io_executor is None:
+                _io_executor = ThreadPoolExecutor(
+                    max_workers=get_settings().DISK_IO_WORKERS, thread_name_prefix="disk-io",
+                )
+    return _io_executor
+
+async def run_io(func, *args, **kwargs):
+    """Run a blocking filesystem call on the bounded disk I/O pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_io_executor(), partial(func, *args, **kwargs))
+
+def _discard(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+async def save_upload_file(file, path, total_size=0, max_size=None, sha256=None):
+    """Stream an uploaded file to disk in chunks and return the new running total.
+
+    The data is copied to a temporary file next to ``path`` and renamed into
+    place once complete, so an aborted upload never leaves a partial file.
+    ``total_size`` is the number of bytes already accepted for this request;
+    the copy stops as soon as it would push the total past ``max_size``.
+    With the content's ``sha256`` (computed as the upload arrived) the
+    finished file is handed to the storage backend, which deduplicates by
+    content.
+    """
+    if max_size is None:
+        max_size = get_settings().MAX_SIZE
+    fd, tmp_path = await run_io(tempfile.mkstemp, dir=os.path.dirname(path), prefix=".", suffix=".part")
+    try:
+        f = os.fdopen(fd, "wb")
         try:
-            if os.path.exists(f):
-                os.remove(f)
-        except Exception:
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                total_size += len(chunk)
+                if total_size > max_size:
+                    raise HTTPException(400, f"Upload exceeds {max_size // (1024 * 1024)}MB limit")
+                await run_io(f.write, chunk)
+        finally:
+            await run_io(f.close)
+        if sha256 is not None:
+            await run_io(get_storage().publish, tmp_path, path, sha256)
+        else:
+            await run_io(os.replace, tmp_path, path)
+    except BaseException:
+        await run_io(_discard, tmp_path)
+        raise
+    return total_size
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def file_checksums(f):
+    """SHA-256 hex digest and CRC-32 of an open file, computed in one pass."""
+    digest = hashlib.sha256()
+    crc = 0
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        crc = zlib.crc32(chunk, crc)
+    return digest.hexdigest(), crc
+
+def describe_file(path, sha256=None, name=None):
+    """Build the metadata record stored in the ``files`` table for ``path``.
+
+    ``name`` is the file name shown to downloaders; it defaults to the
+    last part of ``path``.
+    """
+    size, mtime = get_storage().stat(path, sha256)
+    return {
+        "name": name or os.path.basename(path),
+        "path": path,
+        "size": size,
+        "mtime": mtime,
+        "sha256": sha256,
+        "mime_type": guess_type(path)[0] or "application/octet-stream",
+    }
+
+def shard_of(slug):
+    """Two-level folder, ``ab/cd``, spreading slugs over 65536 directories."""
+    h = hashlib.sha256(slug.encode()).hexdigest()
+    return os.path.join(h[:2], h[2:4])
+
+def slug_dir(slug):
+    """Folder holding a slug's files: ``UPLOAD_DIR/ab/cd/<slug>``."""
+    return os.path.join(get_settings().UPLOAD_DIR, shard_of(slug), slug)
+
+def upload_path(slug, name):
+    """Where a newly uploaded file ``name`` of a slug is stored: ``UPLOAD_DIR/ab/cd/<slug>/<token>-<name>``.
+
+    Each upload gets a path no earlier file row used, so the reaper
+    removing the files of an expired link never unlinks those of an upload
+    to the same slug that is being stored meanwhile.
+    """
+    return os.path.join(slug_dir(slug), f"{secrets.token_hex(8)}-{name}")
+
+def remove_files(paths):
+    """Best-effort removal of a list of file paths."""
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
             pass
-            
-    # Delete folder if empty
-    folder = os.path.join(settings.UPLOAD_DIR, slug)
-    if os.path.isdir(folder) and not os.listdir(folder):
+
+def cleanup_files(slug, files):
+    """Delete files associated with a slug.
+
+    ``files`` are records with at least ``path`` and ``sha256``. Returns the
+    hashes released, to be passed to the storage backend's ``prune()`` once
+    the slug's rows are gone from the DB.
+    """
+    storage = get_storage()
+    for f in files:
+        storage.release(f["path"], f.get("sha256"))
+
+    # The folders are known from the records; rmdir() refuses non-empty
+    # ones, so nothing has to be listed
+    for folder in {os.path.dirname(f["path"]) for f in files} | {slug_dir(slug)}:
         try:
             os.rmdir(folder)
-        except Exception:
+        except OSError:
             pass
+
+    return [f.get("sha256") for f in files]
+
+def session_dir():
+    """Directory holding the partial data of resumable upload sessions."""
+    return os.path.join(get_settings().UPLOAD_DIR, ".sessions")
+
+def session_part_path(session_id):
+    return os.path.join(session_dir(), f"{session_id}.part")
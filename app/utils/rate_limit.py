@@ -0,0 +1,43 @@
+import threading
+import time
+from collections import OrderedDict
+
+class TokenBucket:
+    """Thread-safe per-key token buckets.
+
+    Each key holds up to ``burst`` tokens and earns ``rate`` tokens per
+    second. Only the ``maxsize`` most recently used keys are tracked; a key
+    that was dropped starts again with a full bucket.
+    """
+
+    def __init__(self, burst, rate, maxsize=10000):
+        self.burst = burst
+        self.rate = rate
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()  # key -> (tokens, monotonic time of that count)
+        self._lock = threading.Lock()
+
+    def _tokens(self, key, now):
+        item = self._buckets.get(key)
+        if item is None:
+            return self.burst
+        tokens, updated = item
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def wait_time(self, key):
+        """Seconds until ``key`` has a token; 0 when it has one now."""
+        with self._lock:
+            tokens = self._tokens(key, time.monotonic())
+        if tokens >= 1:
+            return 0
+        return (1 - tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def consume(self, key):
+        """Take one token from ``key``'s bucket, if it has any left."""
+        now = time.monotonic()
+        with self._lock:
+            tokens = max(self._tokens(key, now) - 1, 0)
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
@@ -1,19 +1,110 @@
+import asyncio
+import hashlib
+import hmac
+import math
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from fastapi import HTTPException, Request
-from app.config import settings
+from app.config import get_settings
+from app.services.metrics import AUTH_FAILURES
+from app.utils.cache import TTLCache
+from app.utils.rate_limit import TokenBucket
+
+# Created on first use, like the other settings-sized singletons:
+# _verified holds passwords that recently matched, keyed by a digest so the
+# plain text is not kept around; repeat uploads skip bcrypt until the entry
+# expires. _failures holds the wrong passwords each client IP may still send.
+_verified = None
+_failures = None
+# bcrypt is deliberately slow; it runs on its own small pool so a burst of
+# checks can't occupy every thread the app uses for I/O
+_hash_executor = None
+_singletons_lock = threading.Lock()
+
+def _get_verified():
+    global _verified
+    if _verified is None:
+        with _singletons_lock:
+            if _verified is None:
+                _verified = TTLCache(256, get_settings().PASSWORD_CACHE_SECONDS)
+    return _verified
+
+def _get_failures():
+    global _failures
+    if _failures is None:
+        with _singletons_lock:
+            if _failures is None:
+                settings = get_settings()
+                _failures = TokenBucket(settings.AUTH_FAILURE_BURST, settings.AUTH_FAILURES_PER_MINUTE / 60)
+    return _failures
+
+def _get_hash_executor():
+    global _hash_executor
+    if _hash_executor is None:
+        with _singletons_lock:
+            if _hash_executor is None:
+                _hash_executor = ThreadPoolExecutor(
+                    max_workers=get_settings().PASSWORD_CHECK_WORKERS, thread_name_prefix="bcrypt",
+                )
+    return _hash_executor
 
 def is_safe_slug(slug):
     """Validate that slug is safe to use as a folder name."""
     return bool(re.match(r'^[a-zA-Z0-9-_]+$', slug))
 
-async def check_password(request: Request):
-    """Extract and validate password from request form."""
-    form = await request.form()
-    if "pw" not in form:
+def client_ip(request: Request):
+    return request.client.host if request.client else ""
+
+def check_auth_rate(client):
+    """Turn away (429) a client that used up its password attempts, before its body is read."""
+    wait = _get_failures().wait_time(client)
+    if wait:
+        AUTH_FAILURES.inc(reason="throttled")
+        # With AUTH_FAILURES_PER_MINUTE=0 attempts never come back
+        headers = {"Retry-After": str(math.ceil(wait))} if math.isfinite(wait) else None
+        raise HTTPException(429, "Too many failed password attempts", headers=headers)
+
+def password_matches(pw):
+    """Compare ``pw`` with the configured credential. Blocking when it is a bcrypt hash."""
+    settings = get_settings()
+    if settings.UPLOAD_PASSWORD_HASH:
+        import bcrypt
+
+        return bcrypt.checkpw(pw.encode(), settings.UPLOAD_PASSWORD_HASH.encode())
+    return hmac.compare_digest(pw.encode(), settings.UPLOAD_PASSWORD.encode())
+
+async def verify_password(form, client):
+    """Validate the ``pw`` field of an already parsed form sent by ``client`` (an IP)."""
+    pw = form.get("pw")
+    if not isinstance(pw, str):
+        _get_failures().consume(client)
+        AUTH_FAILURES.inc(reason="missing")
         raise HTTPException(401, "Password required")
-    pw = form["pw"]
-    
-    if pw != settings.UPLOAD_PASSWORD:
+
+    key = hashlib.sha256(f"{get_settings().UPLOAD_PASSWORD_HASH}\0{pw}".encode()).digest()
+    if _get_verified().get(key):
+        return pw
+    loop = asyncio.get_running_loop()
+    if not await loop.run_in_executor(_get_hash_executor(), password_matches, pw):
+        _get_failures().consume(client)
+        AUTH_FAILURES.inc(reason="invalid")
         raise HTTPException(401, "Invalid password")
-    
+    _get_verified().set(key, True)
     return pw
+
+async def check_password(request: Request):
+    """Extract and validate password from request form."""
+    client = client_ip(request)
+    check_auth_rate(client)
+    form = await request.form()
+    return await verify_password(form, client)
+
+async def check_api_password(request: Request):
+    """Validate the password sent as ``Authorization: Bearer <password>`` by API clients."""
+    client = client_ip(request)
+    check_auth_rate(client)
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    form = {"pw": token} if scheme.lower() == "bearer" and token else {}
+    return await verify_password(form, client)
@@ -0,0 +1,552 @@
+"""Load benchmark for the upload, slug page and download endpoints.
+
+Runs the app against a throwaway upload directory and database, either in
+this process (``--in-process``, through httpx's ASGI transport) or as a local
+uvicorn server, and reports throughput, latency percentiles, peak RSS and
+peak temporary disk usage for each phase.
+
+    python -m bench run --uploads 200 --file-size 1MB --output before.json
+    python -m bench compare before.json after.json
+    python -m bench middleware
+    python -m bench startup
+"""
+import argparse
+import asyncio
+import base64
+import importlib
+import json
+import os
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = "bench-password"
+UNITS = {"KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+def parse_size(value):
+    value = value.strip().upper()
+    for suffix, factor in UNITS.items():
+        if value.endswith(suffix):
+            return int(float(value[:-len(suffix)]) * factor)
+    return int(value)
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(int(round(pct / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[index]
+
+def dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+def open_temp_bytes(pid, path):
+    """Bytes held by files under ``path`` that process ``pid`` has open.
+
+    Spooled upload files are created without a name (O_TMPFILE), so they only
+    show up among the process' open descriptors (Linux only).
+    """
+    fd_dir = f"/proc/{pid}/fd"
+    total = 0
+    try:
+        fds = os.listdir(fd_dir)
+    except OSError:
+        return 0
+    for fd in fds:
+        try:
+            if os.readlink(os.path.join(fd_dir, fd)).startswith(path + os.sep):
+                total += os.stat(os.path.join(fd_dir, fd)).st_size
+        except OSError:
+            pass
+    return total
+
+class DiskSampler(threading.Thread):
+    """Polls temporary disk usage and remembers the largest value seen."""
+
+    def __init__(self, path, interval=0.05):
+        super().__init__(daemon=True)
+        self.path = path
+        self.interval = interval
+        self.pids = []
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def sample(self):
+        # Named files are counted by the walk, unnamed ones through /proc
+        used = dir_size(self.path) + sum(open_temp_bytes(pid, self.path) for pid in self.pids)
+        self.peak = max(self.peak, used)
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.sample()
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.sample()
+
+def prepare_environment(workdir):
+    """Point the app's settings at a scratch directory."""
+    tmp_dir = os.path.join(workdir, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    env = {
+        "UPLOAD_DIR": os.path.join(workdir, "uploads"),
+        "DATABASE_URL": os.path.join(workdir, "files.db"),
+        "TEMPLATES_DIR": os.path.join(ROOT, "templates"),
+        "UPLOAD_PASSWORD": PASSWORD,
+        "TMPDIR": tmp_dir,
+    }
+    return env, tmp_dir
+
+def load_app(target, factory):
+    module_name, _, attr = target.partition(":")
+    app = getattr(importlib.import_module(module_name), attr)
+    return app() if factory else app
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def peak_rss_of(pid):
+    """Peak resident set size of a process in bytes (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def server_pids(pid):
+    """The server process and, with ``--workers``, its worker processes."""
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [pid] + [int(child) for child in f.read().split()]
+    except OSError:
+        return [pid]
+
+def start_server(args, env):
+    port = free_port()
+    cmd = [sys.executable, "-m", "uvicorn", args.app, "--host", "127.0.0.1", "--port", str(port),
+           "--log-level", "warning", "--workers", str(args.workers)]
+    if args.factory:
+        cmd.append("--factory")
+    proc = subprocess.Popen(cmd, cwd=ROOT, env={**os.environ, **env})
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with status {proc.returncode}")
+        try:
+            httpx.get(base_url + "/", timeout=1)
+            return proc, base_url
+        except httpx.TransportError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError("server did not start within 30s")
+
+class Phase:
+    """Latency and byte counts for one kind of request."""
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.elapsed = 0.0
+
+    def report(self):
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        elapsed = self.elapsed or 1e-9
+        return {
+            "requests": count,
+            "errors": self.errors,
+            "elapsed_s": round(self.elapsed, 3),
+            "req_per_s": round(count / elapsed, 2),
+            "mb_per_s": round((self.bytes_sent + self.bytes_received) / elapsed / UNITS["MB"], 2),
+            "p50_ms": percentile(latencies, 50) and round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": percentile(latencies, 95) and round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": percentile(latencies, 99) and round(percentile(latencies, 99) * 1000, 2),
+        }
+
+async def run_phase(phase, count, concurrency, make_request):
+    """Issue ``count`` requests, at most ``concurrency`` at a time."""
+    queue = iter(range(count))
+
+    async def worker():
+        for i in queue:
+            start = time.perf_counter()
+            try:
+                ok, sent, received = await make_request(i)
+            except httpx.HTTPError:
+                ok, sent, received = False, 0, 0
+            phase.latencies.append(time.perf_counter() - start)
+            phase.bytes_sent += sent
+            phase.bytes_received += received
+            if not ok:
+                phase.errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, count)))))
+    phase.elapsed = time.perf_counter() - start
+
+def payload(base, i):
+    """Distinct content per request so deduplication doesn't skip the write."""
+    tag = f"{i:016d}".encode()
+    return tag + base[len(tag):]
+
+async def run_workload(client, args):
+    run_id = datetime.utcnow().strftime("%H%M%S")
+    # Random printable text: .txt uploads must pass the content sniff (no NUL bytes)
+    base = base64.b64encode(os.urandom(args.file_size))[:args.file_size]
+    phases = {}
+    slugs = []
+
+    def upload_phase(name, count, folder):
+        phase = phases[name] = Phase(name)
+
+        async def request(i):
+            slug = f"bench-{run_id}-{name}-{i}"
+            content = base if args.duplicate else payload(base, i)
+            files = []
+            for n in range(args.files):
+                filename = f"docs/part{n}/file{n}.txt" if folder else f"file{n}.txt"
+                files.append(("files", (filename, content, "text/plain")))
+            response = await client.post("/", data={"pw": PASSWORD, "slug": slug, "days": "1"},
+                                         files=files, follow_redirects=False)
+            ok = response.status_code == 303
+            if ok and not folder:
+                slugs.append(slug)
+            return ok, len(content) * args.files, len(response.content)
+
+        return run_phase(phase, count, args.concurrency, request)
+
+    await upload_phase("upload", args.uploads, folder=False)
+    if args.folder_uploads:
+        await upload_phase("folder_upload", args.folder_uploads, folder=True)
+    if not slugs:
+        print("warning: no upload succeeded, skipping the page and download phases", file=sys.stderr)
+        return phases
+
+    page = phases["page"] = Phase("page")
+
+    async def page_request(i):
+        response = await client.get(f"/{random.choice(slugs)}")
+        return response.status_code == 200, 0, len(response.content)
+
+    await run_phase(page, args.page_hits, args.concurrency, page_request)
+
+    download = phases["range_download"] = Phase("range_download")
+    range_size = min(args.range_size, args.file_size) if args.range_size else args.file_size
+
+    async def download_request(i):
+        headers = {}
+        expected = 200
+        if args.range_size:
+            start = random.randrange(0, args.file_size - range_size + 1)
+            headers["Range"] = f"bytes={start}-{start + range_size - 1}"
+            expected = 206
+        received = 0
+        async with client.stream("GET", f"/download/{random.choice(slugs)}/file0.txt", headers=headers) as response:
+            async for chunk in response.aiter_bytes():
+                received += len(chunk)
+        return response.status_code == expected and received == range_size, 0, received
+
+    await run_phase(download, args.downloads, args.concurrency, download_request)
+    return phases
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="amardrop-bench-")
+    env, tmp_dir = prepare_environment(workdir)
+    server = None
+    try:
+        if args.in_process:
+            os.environ.update(env)
+            tempfile.tempdir = tmp_dir
+            sys.path.insert(0, ROOT)
+            transport = httpx.ASGITransport(app=load_app(args.app, args.factory))
+            base_url = "http://bench"
+        else:
+            server, base_url = start_server(args, env)
+            transport = None
+
+        async def main():
+            timeout = httpx.Timeout(args.timeout)
+            limits = httpx.Limits(max_connections=args.concurrency)
+            async with httpx.AsyncClient(transport=transport, base_url=base_url,
+                                         timeout=timeout, limits=limits) as client:
+                return await run_workload(client, args)
+
+        sampler = DiskSampler(tmp_dir)
+        sampler.pids = [os.getpid()] if server is None else server_pids(server.pid)
+        sampler.start()
+        try:
+            phases = asyncio.run(main())
+        finally:
+            sampler.stop()
+
+        if server is not None:
+            peak_rss = sum(filter(None, (peak_rss_of(pid) for pid in sampler.pids))) or None
+        else:
+            # ru_maxrss is in KB on Linux; this includes the client side
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return {
+            "revision": git_revision(),
+            "date": datetime.utcnow().isoformat(timespec="seconds"),
+            "mode": "in-process" if args.in_process else "server",
+            "config": {
+                "app": args.app,
+                "uploads": args.uploads,
+                "folder_uploads": args.folder_uploads,
+                "files": args.files,
+                "file_size": args.file_size,
+                "concurrency": args.concurrency,
+                "page_hits": args.page_hits,
+                "downloads": args.downloads,
+                "range_size": args.range_size,
+                "duplicate": args.duplicate,
+                "workers": args.workers,
+            },
+            "phases": {name: phase.report() for name, phase in phases.items()},
+            "peak_rss_mb": peak_rss and round(peak_rss / UNITS["MB"], 1),
+            "peak_temp_disk_mb": round(sampler.peak / UNITS["MB"], 1),
+            "upload_dir_mb": round(dir_size(env["UPLOAD_DIR"]) / UNITS["MB"], 1),
+        }
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+METRICS = ["req_per_s", "mb_per_s", "p50_ms", "p95_ms", "p99_ms", "errors"]
+
+def print_report(result):
+    print(f"revision {result['revision']}  mode {result['mode']}  {result['date']}")
+    print(f"{'phase':<16}{'requests':>10}" + "".join(f"{m:>12}" for m in METRICS))
+    for name, stats in result["phases"].items():
+        print(f"{name:<16}{stats['requests']:>10}" + "".join(f"{str(stats[m]):>12}" for m in METRICS))
+    print(f"peak RSS {result['peak_rss_mb']} MB, peak temp disk {result['peak_temp_disk_mb']} MB, "
+          f"upload dir {result['upload_dir_mb']} MB")
+
+def compare(old, new):
+    """Print the relative change of every metric between two saved runs."""
+    print(f"{old['revision']} -> {new['revision']}")
+    if old["config"] != new["config"]:
+        print("warning: the runs used different settings")
+    print(f"{'phase':<16}{'metric':<12}{'old':>12}{'new':>12}{'change':>10}")
+    for name, stats in new["phases"].items():
+        before = old["phases"].get(name)
+        if not before:
+            continue
+        for metric in METRICS:
+            a, b = before.get(metric), stats.get(metric)
+            change = f"{(b - a) / a * 100:+.1f}%" if a and b is not None else "-"
+            print(f"{name:<16}{metric:<12}{str(a):>12}{str(b):>12}{change:>10}")
+    for key in ("peak_rss_mb", "peak_temp_disk_mb", "upload_dir_mb"):
+        a, b = old.get(key), new.get(key)
+        change = f"{(b - a) / a * 100:+.1f}%" if a and b is not None else "-"
+        print(f"{'total':<16}{key:<12}{str(a):>12}{str(b):>12}{change:>10}")
+
+def _base_http_security_headers(app):
+    """The security headers as the @app.middleware("http") version added them."""
+    from starlette.middleware.base import BaseHTTPMiddleware
+    from app.middleware import SECURITY_HEADERS
+
+    async def dispatch(request, call_next):
+        response = await call_next(request)
+        for name, value in SECURITY_HEADERS:
+            response.headers[name.decode()] = value.decode()
+        return response
+
+    return BaseHTTPMiddleware(app, dispatch=dispatch)
+
+async def _drive(app, count):
+    """Call an ASGI app ``count`` times; returns seconds per request and body messages seen."""
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "scheme": "http", "path": "/", "raw_path": b"/", "query_string": b"", "root_path": "",
+             "headers": [], "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80)}
+    never = asyncio.Event()
+    body_messages = 0
+
+    async def send(message):
+        nonlocal body_messages
+        if message["type"] == "http.response.body":
+            body_messages += 1
+
+    start = time.perf_counter()
+    for _ in range(count):
+        received = False
+
+        async def receive():
+            nonlocal received
+            if not received:
+                received = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await never.wait()
+
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - start) / count, body_messages / count
+
+def middleware_benchmark(args):
+    """Per-request cost of the security headers: BaseHTTPMiddleware vs plain ASGI."""
+    from starlette.responses import PlainTextResponse, StreamingResponse
+    sys.path.insert(0, ROOT)
+    from app.middleware import SecurityHeadersMiddleware
+
+    chunk = b"x" * 64 * 1024
+
+    async def small(scope, receive, send):
+        await PlainTextResponse("ok")(scope, receive, send)
+
+    async def streaming(scope, receive, send):
+        async def body():
+            for _ in range(args.chunks):
+                yield chunk
+        await StreamingResponse(body(), media_type="application/octet-stream")(scope, receive, send)
+
+    variants = [
+        ("none", lambda app: app),
+        ("base_http", _base_http_security_headers),
+        ("pure_asgi", SecurityHeadersMiddleware),
+    ]
+    print(f"{'middleware':<12}{'response':<12}{'us/request':>12}{'overhead_us':>13}{'body_msgs':>11}")
+    for label, endpoint in (("small", small), (f"stream x{args.chunks}", streaming)):
+        baseline = None
+        for name, wrap in variants:
+            app = wrap(endpoint)
+            asyncio.run(_drive(app, min(args.requests, 100)))  # warm up
+            per_request, messages = asyncio.run(_drive(app, args.requests))
+            baseline = per_request if baseline is None else baseline
+            print(f"{name:<12}{label:<12}{per_request * 1e6:>12.1f}"
+                  f"{(per_request - baseline) * 1e6:>13.1f}{messages:>11.0f}")
+
+STARTUP_SCRIPT = """
+import asyncio, json, sys, time
+import httpx
+start = time.perf_counter()
+module_name, _, attr = sys.argv[1].partition(":")
+import importlib
+target = getattr(importlib.import_module(module_name), attr)
+imported = time.perf_counter()
+app = target() if sys.argv[2] == "1" else target
+created = time.perf_counter()
+async def first_request():
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        return (await client.get("/")).status_code
+status = asyncio.run(first_request())
+done = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000, "create_ms": (created - imported) * 1000,
+                  "first_request_ms": (done - created) * 1000, "status": status}))
+"""
+
+def startup_benchmark(args):
+    """Cold-start cost: import, app construction and the first request, each in a fresh interpreter."""
+    workdir = tempfile.mkdtemp(prefix="amardrop-bench-")
+    env, _ = prepare_environment(workdir)
+    samples = []
+    try:
+        for _ in range(args.runs):
+            proc = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT, args.app, "1" if args.factory else "0"],
+                                  cwd=ROOT, env={**os.environ, **env}, capture_output=True, text=True)
+            if proc.returncode != 0:
+                raise RuntimeError(proc.stderr)
+            samples.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(f"{args.app}: median of {args.runs} runs")
+    for key in ("import_ms", "create_ms", "first_request_ms"):
+        values = sorted(sample[key] for sample in samples)
+        print(f"  {key:<18}{percentile(values, 50):>10.1f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    r = commands.add_parser("run", help="run the benchmark")
+    r.add_argument("--app", default="app:create_app", help="ASGI app or factory as module:attr")
+    r.add_argument("--factory", action=argparse.BooleanOptionalAction, default=True,
+                   help="treat --app as a factory (default)")
+    r.add_argument("--in-process", action="store_true", help="call the app directly instead of over HTTP")
+    r.add_argument("--workers", type=int, default=1, help="uvicorn workers when running a server")
+    r.add_argument("--uploads", type=int, default=50, help="upload requests")
+    r.add_argument("--folder-uploads", type=int, default=10, help="folder upload requests (zipped server side)")
+    r.add_argument("--files", type=int, default=2, help="files per upload request")
+    r.add_argument("--file-size", type=parse_size, default=parse_size("1MB"), help="size of each file, e.g. 512KB")
+    r.add_argument("--duplicate", action="store_true", help="upload identical content every time")
+    r.add_argument("--page-hits", type=int, default=500, help="slug page requests")
+    r.add_argument("--downloads", type=int, default=200, help="download requests")
+    r.add_argument("--range-size", type=parse_size, default=parse_size("64KB"),
+                   help="bytes per ranged download; 0 downloads whole files")
+    r.add_argument("--concurrency", type=int, default=10, help="requests in flight")
+    r.add_argument("--timeout", type=float, default=120, help="per-request timeout in seconds")
+    r.add_argument("--seed", type=int, default=0, help="seed for slug and range selection")
+    r.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    r.add_argument("--output", help="write the results as JSON for later comparison")
+
+    c = commands.add_parser("compare", help="compare two saved runs")
+    c.add_argument("old")
+    c.add_argument("new")
+
+    m = commands.add_parser("middleware", help="per-request cost of the security-header middleware")
+    m.add_argument("--requests", type=int, default=5000, help="requests per variant")
+    m.add_argument("--chunks", type=int, default=16, help="64KB chunks in the streamed response")
+
+    st = commands.add_parser("startup", help="time importing and constructing the app in a fresh process")
+    st.add_argument("--app", default="app:create_app", help="ASGI app or factory as module:attr")
+    st.add_argument("--factory", action=argparse.BooleanOptionalAction, default=True,
+                    help="treat --app as a factory (default)")
+    st.add_argument("--runs", type=int, default=5, help="fresh interpreters to average over")
+
+    args = parser.parse_args(argv)
+    if args.command == "startup":
+        startup_benchmark(args)
+        return
+    if args.command == "middleware":
+        middleware_benchmark(args)
+        return
+    if args.command == "compare":
+        with open(args.old) as f_old, open(args.new) as f_new:
+            compare(json.load(f_old), json.load(f_new))
+        return
+
+    random.seed(args.seed)
+    result = run(args)
+    print_report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == "__main__":
+    main()
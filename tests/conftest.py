@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import uuid
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = "test-password"
+
+# Settings are read from the environment on first use, so this has to
+# happen before anything calls app.config.get_settings()
+_tmp = tempfile.mkdtemp(prefix="amardrop-tests-")
+os.environ.update(
+    UPLOAD_DIR=os.path.join(_tmp, "uploads"),
+    DATABASE_URL=os.path.join(_tmp, "files.db"),
+    TEMPLATES_DIR=os.path.join(ROOT, "templates"),
+    UPLOAD_PASSWORD=PASSWORD,
+    AUTH_FAILURE_BURST="1000",
+    DISK_MIN_FREE="0",
+)
+
+from fastapi.testclient import TestClient  # noqa: E402
+from app import create_app  # noqa: E402
+
+@pytest.fixture(scope="session", autouse=True)
+def _cleanup_tmp():
+    yield
+    shutil.rmtree(_tmp, ignore_errors=True)
+
+@pytest.fixture(scope="session")
+def app():
+    # Background threads only start with the client used as a context manager
+    return create_app()
+
+@pytest.fixture
+def client(app):
+    return TestClient(app)
+
+@pytest.fixture
+def slug():
+    return uuid.uuid4().hex[:12]
+
+def upload(client, slug, files, pw=PASSWORD, days=1):
+    """POST the upload form; ``files`` is a list of ``(name, content)``."""
+    return client.post(
+        "/",
+        data={"pw": pw, "slug": slug, "days": str(days)},
+        files=[("files", (name, content)) for name, content in files],
+        follow_redirects=False,
+    )
@@ -0,0 +1,75 @@
+import bcrypt
+from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+
+from app.config import get_settings
+from app.db import get_link
+from app.utils import security
+from tests.conftest import PASSWORD, upload
+from tests.test_upload_streaming import multipart_chunks, post_streamed
+
+def limit_failures(monkeypatch, burst):
+    monkeypatch.setattr(get_settings(), "AUTH_FAILURE_BURST", burst)
+    monkeypatch.setattr(get_settings(), "AUTH_FAILURES_PER_MINUTE", 0)
+    # Rebuilt from the settings above on first use
+    monkeypatch.setattr(security, "_failures", None)
+
+def count_bcrypt_checks(monkeypatch):
+    calls = []
+    password_matches = security.password_matches
+
+    def counted(pw):
+        calls.append(pw)
+        return password_matches(pw)
+
+    monkeypatch.setattr(security, "password_matches", counted)
+    monkeypatch.setattr(security, "_verified", None)
+    return calls
+
+def test_throttled_client_gets_429_before_its_body_is_read(app, slug, monkeypatch):
+    limit_failures(monkeypatch, 2)
+    for _ in range(2):
+        assert post_streamed(app, multipart_chunks("wrong", slug, 1))[0] == 401
+
+    status, read = post_streamed(app, multipart_chunks(PASSWORD, slug, 1))
+    assert status == 429
+    assert read == 0
+    assert get_link(slug) is None
+
+def test_matched_password_skips_bcrypt_while_cached(client, slug, monkeypatch):
+    hashed = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(4)).decode()
+    monkeypatch.setattr(get_settings(), "UPLOAD_PASSWORD_HASH", hashed)
+    calls = count_bcrypt_checks(monkeypatch)
+    assert upload(client, slug, [("a.txt", b"1")]).status_code == 303
+    assert upload(client, slug, [("b.txt", b"2")]).status_code == 303
+    assert len(calls) == 1
+
+    # Wrong passwords are never cached
+    assert upload(client, slug, [("c.txt", b"3")], pw="wrong").status_code == 401
+    assert upload(client, slug, [("c.txt", b"3")], pw="wrong").status_code == 401
+    assert len(calls) == 3
+
+def test_password_cache_can_be_disabled(client, slug, monkeypatch):
+    monkeypatch.setattr(get_settings(), "PASSWORD_CACHE_SECONDS", 0)
+    calls = count_bcrypt_checks(monkeypatch)
+    assert upload(client, slug, [("a.txt", b"1")]).status_code == 303
+    assert upload(client, slug, [("b.txt", b"2")]).status_code == 303
+    assert len(calls) == 2
+
+def post_from(app, slug, forwarded_for):
+    return post_streamed(app, multipart_chunks("wrong", slug, 1),
+                         headers=[(b"x-forwarded-for", forwarded_for.encode())])[0]
+
+def test_clients_behind_a_trusted_proxy_are_throttled_separately(app, slug, monkeypatch):
+    # What uvicorn runs with FORWARDED_ALLOW_IPS set to the proxy's address
+    limit_failures(monkeypatch, 1)
+    proxied = ProxyHeadersMiddleware(app, trusted_hosts="127.0.0.1")
+    assert post_from(proxied, slug, "203.0.113.1") == 401
+    assert post_from(proxied, slug, "203.0.113.1") == 429
+    assert post_from(proxied, slug, "203.0.113.2") == 401
+
+def test_forwarded_for_from_an_untrusted_peer_is_ignored(app, slug, monkeypatch):
+    limit_failures(monkeypatch, 1)
+    proxied = ProxyHeadersMiddleware(app, trusted_hosts="10.0.0.1")
+    assert post_from(proxied, slug, "203.0.113.1") == 401
+    # Still counted against the peer's own address
+    assert post_from(proxied, slug, "203.0.113.2") == 429
@@ -0,0 +1,53 @@
+import pytest
+
+from app.utils import compression
+from tests.conftest import upload
+
+def test_upload_form_is_served_gzipped_with_one_charset(client):
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "text/html; charset=utf-8"
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["cache-control"].startswith("public, max-age=")
+    assert b"<form" in response.content
+
+    plain = client.get("/", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert plain.content == response.content
+    assert plain.headers["etag"] != response.headers["etag"]
+
+def test_brotli_is_preferred_when_installed(client):
+    pytest.importorskip("brotli")
+    assert "br" in compression.ENCODINGS
+    response = client.get("/", headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["content-encoding"] == "br"
+    # q=0 turns an encoding down
+    response = client.get("/", headers={"Accept-Encoding": "gzip, br;q=0"})
+    assert response.headers["content-encoding"] == "gzip"
+
+def test_static_assets_revalidate_with_304(client):
+    for url in ("/", "/favicon.ico"):
+        response = client.get(url, headers={"Accept-Encoding": "gzip"})
+        etag = response.headers["etag"]
+        revalidated = client.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+        assert revalidated.status_code == 304
+        assert revalidated.content == b""
+        assert revalidated.headers["etag"] == etag
+
+def test_download_page_is_compressed(client, slug):
+    assert upload(client, slug, [("a.txt", b"a"), ("b.txt", b"b")]).status_code == 303
+    response = client.get(f"/{slug}", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert slug in response.text
+
+def test_file_downloads_are_sent_as_stored(client, slug):
+    data = b"compressible text " * 1000
+    assert upload(client, slug, [("a.txt", data), ("b.txt", b"other")]).status_code == 303
+    for url in (f"/download/{slug}/a.txt", f"/download/{slug}.zip"):
+        response = client.get(url, headers={"Accept-Encoding": "gzip, br"})
+        assert response.status_code == 200
+        assert "content-encoding" not in response.headers
+    response = client.get(f"/download/{slug}/a.txt", headers={"Accept-Encoding": "gzip"})
+    assert response.content == data
+    assert int(response.headers["content-length"]) == len(data)
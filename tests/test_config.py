@@ -0,0 +1,20 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_importing_the_app_does_not_read_settings():
+    code = (
+        "import app, app.__main__, app.background, app.routes.metrics\n"
+        "from app.config import get_settings\n"
+        "assert get_settings.cache_info().currsize == 0, get_settings.cache_info()\n"
+    )
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+
+def test_settings_are_loaded_once(monkeypatch):
+    from app.config import get_settings
+
+    monkeypatch.setattr(get_settings(), "MAX_SIZE", 123)
+    assert get_settings() is get_settings()
+    assert get_settings().MAX_SIZE == 123
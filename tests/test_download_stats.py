@@ -0,0 +1,92 @@
+import pytest
+
+import app.db
+from app import background
+from app.config import get_settings
+from app.db import get_link_stats
+from app.services.download_stats import count_view, flush_stats
+from tests.conftest import upload
+
+def make_link(client, slug):
+    assert upload(client, slug, [("a.txt", b"0123456789" * 10), ("b.txt", b"other")]).status_code == 303
+    flush_stats()  # Start from an empty buffer
+
+def test_counting_rules(client, slug):
+    make_link(client, slug)
+    url = f"/download/{slug}/a.txt"
+    client.get(f"/{slug}")
+    client.get(f"/{slug}")
+    etag = client.get(url).headers["etag"]  # counted
+    client.get(url, headers={"Range": "bytes=0-9"})  # counted: a download starting
+    client.get(url, headers={"Range": "bytes=10-19"})  # resuming
+    client.head(url)
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    client.get(f"/download/{slug}.zip")  # counted
+    client.get(f"/download/{slug}.zip", headers={"Range": "bytes=50-99"})
+    client.head(f"/download/{slug}.zip")
+    assert get_link_stats(slug) == (0, 0, {"a.txt": 0, "b.txt": 0})
+
+    flush_stats()
+    assert get_link_stats(slug) == (2, 1, {"a.txt": 2, "b.txt": 0})
+
+def test_flush_writes_every_slug_in_one_transaction(client, slug, monkeypatch):
+    make_link(client, slug)
+    make_link(client, slug + "-2")
+    for s in (slug, slug + "-2"):
+        client.get(f"/{s}")
+        client.get(f"/download/{s}/b.txt")
+    transactions = []
+    transaction = app.db.transaction
+
+    def counted():
+        transactions.append(1)
+        return transaction()
+
+    monkeypatch.setattr(app.db, "transaction", counted)
+    assert flush_stats() == 4
+    assert len(transactions) == 1
+    assert flush_stats() == 0
+    assert len(transactions) == 1
+    assert get_link_stats(slug + "-2") == (1, 0, {"a.txt": 0, "b.txt": 1})
+
+def test_counts_are_kept_when_a_flush_fails(client, slug, monkeypatch):
+    make_link(client, slug)
+    count_view(slug)
+
+    def fail(*args):
+        raise OSError("database is locked")
+
+    monkeypatch.setattr("app.services.download_stats.add_link_stats", fail)
+    with pytest.raises(OSError):
+        flush_stats()
+    monkeypatch.undo()
+    flush_stats()
+    assert get_link_stats(slug)[0] == 1
+
+class StopLoop(BaseException):
+    pass
+
+def test_flusher_runs_every_flush_interval(monkeypatch):
+    monkeypatch.setattr(get_settings(), "STATS_FLUSH_SECONDS", 7)
+    sleeps = []
+    flushes = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) > 3:
+            raise StopLoop
+
+    monkeypatch.setattr(background.time, "sleep", sleep)
+    monkeypatch.setattr(background, "flush_stats", lambda: flushes.append(1))
+    with pytest.raises(StopLoop):
+        background.flush_stats_periodically()
+    assert sleeps == [7] * 4
+    assert len(flushes) == 3
+
+def test_shutdown_flushes_buffered_counts(app, client, slug):
+    make_link(client, slug)
+    client.get(f"/{slug}")
+    client.get(f"/download/{slug}/a.txt")
+    handler, = [h for h in app.router.on_shutdown if h.__name__ == "flush_stats_on_shutdown"]
+    handler()
+    assert get_link_stats(slug) == (1, 0, {"a.txt": 1, "b.txt": 0})
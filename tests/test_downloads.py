@@ -0,0 +1,117 @@
+import hashlib
+import io
+import os
+import re
+import zipfile
+
+from app.config import get_settings
+from app.db import get_link
+from tests.conftest import upload
+
+DATA = bytes(range(32, 127)) * 108  # 10260 bytes of text
+
+def file_url(slug):
+    return f"/download/{slug}/data.txt"
+
+def make_link(client, slug):
+    assert upload(client, slug, [("data.txt", DATA), ("b.txt", b"second file")]).status_code == 303
+
+def test_full_download_has_validators(client, slug):
+    make_link(client, slug)
+    response = client.get(file_url(slug))
+    assert response.status_code == 200
+    assert response.content == DATA
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["etag"]
+    assert response.headers["last-modified"]
+
+def test_single_range(client, slug):
+    make_link(client, slug)
+    response = client.get(file_url(slug), headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 100-199/{len(DATA)}"
+    assert response.headers["content-length"] == "100"
+    assert response.content == DATA[100:200]
+
+    response = client.get(file_url(slug), headers={"Range": "bytes=-10"})
+    assert response.status_code == 206
+    assert response.content == DATA[-10:]
+
+def test_multi_range(client, slug):
+    make_link(client, slug)
+    response = client.get(file_url(slug), headers={"Range": "bytes=0-9,5000-5009"})
+    assert response.status_code == 206
+    content_type = response.headers["content-type"]
+    assert content_type.startswith("multipart/byteranges; boundary=")
+    boundary = content_type.split("boundary=")[1].encode()
+    assert int(response.headers["content-length"]) == len(response.content)
+
+    parts = response.content.split(b"--" + boundary)
+    assert parts[0] == b"" and parts[-1] == b"--\r\n"
+    bodies = []
+    for part in parts[1:-1]:
+        head, body = part.split(b"\r\n\r\n", 1)
+        bodies.append((re.search(rb"Content-Range: bytes (\d+)-(\d+)/", head).groups(), body[:-2]))
+    assert bodies == [((b"0", b"9"), DATA[0:10]), ((b"5000", b"5009"), DATA[5000:5010])]
+
+def test_unsatisfiable_range_gets_416(client, slug):
+    make_link(client, slug)
+    response = client.get(file_url(slug), headers={"Range": f"bytes={len(DATA)}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(DATA)}"
+
+def test_if_range_mismatch_sends_whole_file(client, slug):
+    make_link(client, slug)
+    response = client.get(file_url(slug), headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert response.content == DATA
+
+def test_matching_etag_gets_304(client, slug):
+    make_link(client, slug)
+    etag = client.get(file_url(slug)).headers["etag"]
+    response = client.get(file_url(slug), headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+    assert client.get(file_url(slug), headers={"If-None-Match": f'"other", W/{etag}'}).status_code == 304
+    assert client.get(file_url(slug), headers={"If-None-Match": '"other"'}).status_code == 200
+
+def test_zip_ranges_and_304(client, slug):
+    make_link(client, slug)
+    response = client.get(f"/download/{slug}.zip")
+    assert response.status_code == 200
+    archive = response.content
+    with zipfile.ZipFile(io.BytesIO(archive)) as zf:
+        assert zf.read("data.txt") == DATA
+
+    etag = response.headers["etag"]
+    assert client.get(f"/download/{slug}.zip", headers={"If-None-Match": etag}).status_code == 304
+    response = client.get(f"/download/{slug}.zip", headers={"Range": "bytes=10-99"})
+    assert response.status_code == 206
+    assert response.content == archive[10:100]
+    response = client.get(f"/download/{slug}.zip", headers={"Range": f"bytes={len(archive)}-"})
+    assert response.status_code == 416
+
+def test_upload_dir_is_not_served_directly(client, slug):
+    make_link(client, slug)
+    sha256 = hashlib.sha256(DATA).hexdigest()
+    path = get_link(slug)[1][0]["path"]
+    for url in (f"/uploads/.blobs/{sha256[:2]}/{sha256}",
+                "/uploads/" + os.path.relpath(path, get_settings().UPLOAD_DIR).replace(os.sep, "/")):
+        assert client.get(url).status_code == 404
+
+def test_zip_head_sends_headers_only(client, slug):
+    make_link(client, slug)
+    full = client.get(f"/download/{slug}.zip")
+    response = client.head(f"/download/{slug}.zip")
+    assert response.status_code == 200
+    assert response.content == b""
+    for name in ("content-length", "etag", "accept-ranges", "content-disposition", "content-type"):
+        assert response.headers[name] == full.headers[name]
+
+    response = client.head(f"/download/{slug}.zip", headers={"Range": "bytes=10-99"})
+    assert response.status_code == 206
+    assert response.headers["content-length"] == "90"
+    assert response.headers["content-range"] == f"bytes 10-99/{len(full.content)}"
+    assert response.content == b""
@@ -0,0 +1,99 @@
+import hashlib
+import io
+import zlib
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import background
+from app.config import get_settings
+from app.db import claim_job, finish_job, get_connection, get_link
+from app.services import postprocess
+from tests.conftest import upload
+
+FILES = [("a.txt", b"first file"), ("b.txt", b"second file")]
+
+def drain():
+    """Run every due job, so the next one claimed is the test's own."""
+    while background.run_job("tests"):
+        pass
+
+def job_row(slug):
+    return get_connection().execute(
+        "SELECT attempts, run_after, holder FROM jobs WHERE slug=? AND kind='checksums'", (slug,),
+    ).fetchone()
+
+def make_due(slug):
+    get_connection().execute("UPDATE jobs SET run_after=? WHERE slug=?",
+                             ((datetime.utcnow() - timedelta(seconds=1)).isoformat(), slug))
+
+def test_checksums_job_records_sha256_and_crc(client, slug):
+    drain()
+    assert upload(client, slug, FILES).status_code == 303
+    assert job_row(slug) is not None
+    assert all(f["crc32"] is None for f in get_link(slug)[1])
+
+    assert background.run_job("tests")
+    assert job_row(slug) is None
+    for f, (name, data) in zip(get_link(slug)[1], FILES):
+        assert f["name"] == name
+        assert f["sha256"] == hashlib.sha256(data).hexdigest()
+        assert f["crc32"] == zlib.crc32(data)
+
+def test_failed_job_is_retried_with_backoff_then_dropped(client, slug, monkeypatch):
+    drain()
+    assert upload(client, slug, FILES).status_code == 303
+
+    def fail(slug):
+        raise OSError("disk on fire")
+
+    monkeypatch.setitem(postprocess.JOB_HANDLERS, "checksums", fail)
+    monkeypatch.setattr(get_settings(), "JOB_MAX_ATTEMPTS", 3)
+    for attempts, delay in ((1, 10), (2, 20)):
+        before = datetime.utcnow()
+        assert background.run_job("tests")
+        row = job_row(slug)
+        assert row[0] == attempts and row[2] is None
+        wait = (datetime.fromisoformat(row[1]) - before).total_seconds()
+        assert delay <= wait < delay + 1
+        # Not handed out again before its backoff is over
+        assert not background.run_job("tests")
+        make_due(slug)
+
+    assert background.run_job("tests")
+    assert job_row(slug) is None
+    # The link works without its checksums
+    assert get_link(slug)[1][0]["crc32"] is None
+
+def test_job_of_a_dead_worker_is_claimed_again_after_its_lease(client, slug):
+    drain()
+    assert upload(client, slug, FILES).status_code == 303
+    job_id, kind, job_slug, attempts = claim_job("dead", get_settings().JOB_LEASE_SECONDS)
+    assert (kind, job_slug, attempts) == ("checksums", slug, 1)
+    assert claim_job("other", get_settings().JOB_LEASE_SECONDS) is None
+    run_after = datetime.fromisoformat(job_row(slug)[1])
+    assert abs((run_after - datetime.utcnow()).total_seconds() - get_settings().JOB_LEASE_SECONDS) < 5
+
+    make_due(slug)  # The lease ran out
+    assert claim_job("other", get_settings().JOB_LEASE_SECONDS) == (job_id, "checksums", slug, 2)
+    # The dead worker's late finish doesn't remove the retaken job
+    finish_job(job_id, "dead")
+    assert job_row(slug)[2] == "other"
+    finish_job(job_id, "other")
+    assert job_row(slug) is None
+
+def test_previews_job_serves_a_scaled_jpeg(client, slug):
+    Image = pytest.importorskip("PIL.Image")
+    png = io.BytesIO()
+    Image.new("RGBA", (2000, 1000), (255, 0, 0, 128)).save(png, "PNG")
+    drain()
+    assert upload(client, slug, [("photo.png", png.getvalue()), ("notes.txt", b"text")]).status_code == 303
+    drain()
+
+    files = {f["name"]: f for f in get_link(slug)[1]}
+    assert files["photo.png"]["preview"] and not files["notes.txt"]["preview"]
+    response = client.get(f"/preview/{slug}/photo.png")
+    assert response.status_code == 200
+    with Image.open(io.BytesIO(response.content)) as preview:
+        assert preview.format == "JPEG"
+        assert max(preview.size) == get_settings().PREVIEW_SIZE
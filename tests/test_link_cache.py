@@ -0,0 +1,33 @@
+"""Changes written by another worker skip this process's invalidate_link(), as they do in production."""
+from collections import Counter
+from datetime import datetime, timedelta
+
+from app.db import add_link_stats, delete_link, extend_links, get_link, get_link_version, save_link
+from app.services.link_cache import get_cached_link
+from tests.conftest import upload
+
+def test_hit_is_served_while_the_link_is_unchanged(client, slug):
+    assert upload(client, slug, [("a.txt", b"hello")]).status_code == 303
+    entry = get_cached_link(slug)
+    assert get_cached_link(slug) is entry
+    # Download counts are not part of the cached entry
+    add_link_stats(Counter({slug: 3}), Counter(), Counter({(slug, "a.txt"): 2}))
+    assert get_cached_link(slug) is entry
+
+def test_changes_by_another_worker_are_seen_at_once(client, slug):
+    assert upload(client, slug, [("a.txt", b"hello")]).status_code == 303
+    assert client.get(f"/{slug}").status_code == 200
+    version = get_link_version(slug)
+
+    extend_links([slug], datetime.utcnow() + timedelta(days=5))
+    assert get_link_version(slug) > version
+    assert get_cached_link(slug)["expiry"] == get_link(slug)[0]
+
+    files = get_link(slug)[1]
+    save_link(slug, files + [dict(files[0], name="b.txt")], 1)
+    assert [f["name"] for f in get_cached_link(slug)["files"]] == ["a.txt", "b.txt"]
+    assert "b.txt" in client.get(f"/{slug}").text
+
+    delete_link(slug)
+    assert get_cached_link(slug) is None
+    assert client.get(f"/{slug}").status_code == 404
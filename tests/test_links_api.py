@@ -0,0 +1,111 @@
+import base64
+import os
+import uuid
+from datetime import datetime
+
+import app.routes.links
+from app.config import get_settings
+from app.db import get_connection, get_link
+from app.services.link_cache import invalidate_link
+from tests.conftest import PASSWORD, upload
+
+AUTH = {"Authorization": f"Bearer {PASSWORD}"}
+
+def new_link(slug, days=1, files=(("a.txt", b"hello"),)):
+    return {"slug": slug, "days": days,
+            "files": [{"name": name, "content": base64.b64encode(data).decode()} for name, data in files]}
+
+def create(client, links, headers=AUTH):
+    return client.post("/api/links", json={"links": links}, headers=headers)
+
+def test_create_stores_every_link(client, slug):
+    response = create(client, [new_link(slug), new_link(slug + "-b", files=[("b.txt", b"x"), ("c.txt", b"y")])])
+    assert response.status_code == 201
+    assert [link["slug"] for link in response.json()["links"]] == [slug, slug + "-b"]
+    assert client.get(f"/download/{slug}-b/c.txt").content == b"y"
+
+def test_create_is_all_or_nothing_on_a_live_slug(client, slug):
+    assert upload(client, slug, [("a.txt", b"live")]).status_code == 303
+    response = create(client, [new_link(slug + "-new"), new_link(slug)])
+    assert response.status_code == 409
+    assert slug in response.json()["detail"]
+    assert get_link(slug + "-new") is None
+    assert client.get(f"/download/{slug}/a.txt").content == b"live"
+
+def expire(slug):
+    get_connection().execute("UPDATE links SET expiry='2000-01-01T00:00:00' WHERE slug=?", (slug,))
+    invalidate_link(slug)
+
+def test_create_replaces_an_expired_link(client, slug):
+    assert upload(client, slug, [("old.txt", b"old")]).status_code == 303
+    old_path = get_link(slug)[1][0]["path"]
+    expire(slug)
+    assert create(client, [new_link(slug)]).status_code == 201
+    assert [f["name"] for f in get_link(slug)[1]] == ["a.txt"]
+    assert not os.path.exists(old_path)
+
+def test_create_keeps_files_of_a_link_revived_meanwhile(client, slug, monkeypatch):
+    assert upload(client, slug, [("old.txt", b"old")]).status_code == 303
+    expire(slug)
+    get_link_expiries = app.routes.links.get_link_expiries
+
+    def revived(slugs):
+        # An upload merges into the slug after the batch found it expired
+        expiries = get_link_expiries(slugs)
+        assert upload(client, slug, [("new.txt", b"new")]).status_code == 303
+        return expiries
+
+    monkeypatch.setattr(app.routes.links, "get_link_expiries", revived)
+    assert create(client, [new_link(slug + "-b"), new_link(slug)]).status_code == 409
+    assert get_link(slug + "-b") is None
+    assert client.get(f"/download/{slug}/new.txt").content == b"new"
+    assert client.get(f"/download/{slug}/old.txt").status_code == 404
+
+def test_create_rejects_a_bad_link_before_storing_any(client, slug):
+    response = create(client, [new_link(slug), new_link(slug + "-b", files=[("run.exe", b"MZ")])])
+    assert response.status_code == 400
+    assert get_link(slug) is None
+
+def test_extend_never_shortens(client, slug):
+    assert create(client, [new_link(slug, days=5), new_link(slug + "-b", days=1)]).status_code == 201
+    before = {s: get_link(s)[0] for s in (slug, slug + "-b")}
+
+    response = client.patch("/api/links", json={"slugs": [slug, slug + "-b", slug + "-gone"], "days": 3},
+                            headers=AUTH)
+    assert response.status_code == 200
+    assert response.json() == {"extended": [slug, slug + "-b"], "missing": [slug + "-gone"]}
+    assert get_link(slug)[0] == before[slug]
+    assert get_link(slug + "-b")[0] > before[slug + "-b"]
+    assert (datetime.fromisoformat(get_link(slug + "-b")[0]) - datetime.utcnow()).days == 2
+
+def test_list_pages_with_after(client):
+    prefix = f"page{uuid.uuid4().hex[:8]}"
+    slugs = [f"{prefix}-{n}" for n in range(3)]
+    assert create(client, [new_link(s) for s in slugs]).status_code == 201
+
+    page = client.get("/api/links", params={"after": prefix, "limit": 2}, headers=AUTH).json()
+    assert [link["slug"] for link in page["links"]] == slugs[:2]
+    assert page["next"] == slugs[1]
+    assert page["links"][0]["files"] == 1 and page["links"][0]["size"] == 5
+
+    page = client.get("/api/links", params={"after": page["next"], "limit": 2}, headers=AUTH).json()
+    assert page["links"][0]["slug"] == slugs[2]
+
+def test_batch_limits(client, slug, monkeypatch):
+    monkeypatch.setattr(get_settings(), "BATCH_MAX_LINKS", 2)
+    assert create(client, [new_link(f"{slug}-{n}") for n in range(3)]).status_code == 400
+    assert client.patch("/api/links", json={"slugs": ["a", "b", "c"], "days": 1}, headers=AUTH).status_code == 400
+    assert client.get("/api/links", params={"limit": 3}, headers=AUTH).status_code == 400
+    assert get_link(f"{slug}-0") is None
+
+    monkeypatch.setattr(get_settings(), "BATCH_MAX_BYTES", 1000)
+    response = create(client, [new_link(slug, files=[("big.txt", b"x" * 1000)])])
+    assert response.status_code == 413
+    assert get_link(slug) is None
+
+def test_bearer_password_is_required(client, slug):
+    for headers in ({}, {"Authorization": "Bearer wrong"}, {"Authorization": f"Basic {PASSWORD}"}):
+        assert create(client, [new_link(slug)], headers=headers).status_code == 401
+        assert client.get("/api/links", headers=headers).status_code == 401
+        assert client.patch("/api/links", json={"slugs": [slug], "days": 1}, headers=headers).status_code == 401
+    assert get_link(slug) is None
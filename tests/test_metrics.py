@@ -0,0 +1,29 @@
+import re
+
+from tests.conftest import upload
+
+def sample(text, series):
+    match = re.search(rf"^{re.escape(series)} (\S+)$", text, re.M)
+    return float(match.group(1)) if match else 0.0
+
+def test_metrics_report_link_cache_lookups(client, slug):
+    before = client.get("/metrics").text
+    assert upload(client, slug, [("a.txt", b"hello")]).status_code == 303
+    assert client.get(f"/{slug}").status_code == 200
+    assert client.get(f"/{slug}").status_code == 200
+
+    after = client.get("/metrics").text
+    assert "# TYPE link_cache_entries gauge" in after
+    hits = 'link_cache_lookups_total{result="hit"}'
+    misses = 'link_cache_lookups_total{result="miss"}'
+    assert sample(after, hits) > sample(before, hits)
+    assert sample(after, misses) > sample(before, misses)
+    assert sample(after, "link_cache_entries") >= 1
+
+def test_metrics_report_stored_bytes_and_filesystem_usage(client, slug):
+    before = sample(client.get("/metrics").text, "stored_file_bytes")
+    assert upload(client, slug, [("a.txt", b"x" * 1000), ("b.txt", b"y" * 234)]).status_code == 303
+
+    after = client.get("/metrics").text
+    assert sample(after, "stored_file_bytes") == before + 1234
+    assert sample(after, 'upload_filesystem_bytes{state="free"}') > 0
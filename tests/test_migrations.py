@@ -0,0 +1,52 @@
+import hashlib
+import json
+import sqlite3
+
+import pytest
+
+from app import db
+from app.config import get_settings
+
+@pytest.fixture
+def legacy_db(tmp_path, monkeypatch):
+    """A database as written before the schema was versioned: file paths as JSON in ``links.files``."""
+    folder = tmp_path / "legacy-slug"
+    folder.mkdir()
+    (folder / "a.txt").write_bytes(b"first file")
+    (folder / "b.pdf").write_bytes(b"%PDF-1.4 second")
+    paths = [str(folder / "a.txt"), str(folder / "b.pdf"), str(folder / "gone.txt")]
+
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE links (slug TEXT PRIMARY KEY, expiry TIMESTAMP, files TEXT)")
+    conn.executemany("INSERT INTO links (slug, expiry, files) VALUES (?, ?, ?)", [
+        ("legacy-slug", "2099-01-01T00:00:00", json.dumps(paths)),
+        ("empty-slug", "2099-01-02T00:00:00", None),
+    ])
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(get_settings(), "DATABASE_URL", path)
+    return path, paths
+
+def test_legacy_json_files_become_rows(legacy_db):
+    path, paths = legacy_db
+    db.init_db()
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == db.SCHEMA_VERSION
+    assert conn.execute("SELECT slug, expiry FROM links ORDER BY slug").fetchall() == [
+        ("empty-slug", "2099-01-02T00:00:00"), ("legacy-slug", "2099-01-01T00:00:00"),
+    ]
+    rows = conn.execute("SELECT name, path, size, sha256, mime_type FROM files WHERE slug='legacy-slug' ORDER BY id")
+    # Files missing on disk are dropped
+    assert rows.fetchall() == [
+        ("a.txt", paths[0], 10, hashlib.sha256(b"first file").hexdigest(), "text/plain"),
+        ("b.pdf", paths[1], 15, hashlib.sha256(b"%PDF-1.4 second").hexdigest(), "application/pdf"),
+    ]
+    assert conn.execute("SELECT bytes FROM storage_usage").fetchone()[0] == 25
+    assert "files" not in [row[1] for row in conn.execute("PRAGMA table_info(links)")]
+    assert conn.execute("SELECT name FROM sqlite_master WHERE name='links_legacy'").fetchone() is None
+    # Already migrated: nothing changes
+    db.init_db()
+    assert conn.execute("SELECT COUNT(*) FROM files").fetchone()[0] == 2
+    conn.close()
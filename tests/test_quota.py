@@ -0,0 +1,48 @@
+import shutil
+
+from app.config import get_settings
+from app.db import get_connection, get_link, get_total_usage
+from app.services.link_cache import invalidate_link
+from tests.conftest import upload
+
+def test_slug_quota_counts_merged_files(client, slug, monkeypatch):
+    monkeypatch.setattr(get_settings(), "SLUG_QUOTA", 100)
+    assert upload(client, slug, [("a.txt", b"a" * 60)]).status_code == 303
+    response = upload(client, slug, [("b.txt", b"b" * 60)])
+    assert response.status_code == 413
+    assert [f["name"] for f in get_link(slug)[1]] == ["a.txt"]
+    # A file replacing one of the same name only counts once
+    assert upload(client, slug, [("a.txt", b"c" * 90)]).status_code == 303
+
+def test_disk_budget_refuses_with_507(client, slug, monkeypatch):
+    monkeypatch.setattr(get_settings(), "DISK_BUDGET", get_total_usage() + 100)
+    response = upload(client, slug, [("a.txt", b"a" * 1000)])
+    assert response.status_code == 507
+    # Refused by AdmissionMiddleware, which the security headers wrap
+    assert response.headers["x-frame-options"] == "DENY"
+    assert get_link(slug) is None
+
+def test_min_free_space_refuses_with_507(client, slug, monkeypatch):
+    settings = get_settings()
+    monkeypatch.setattr(settings, "DISK_MIN_FREE", shutil.disk_usage(settings.UPLOAD_DIR).free + 10 ** 9)
+    assert upload(client, slug, [("a.txt", b"a")]).status_code == 507
+    assert get_link(slug) is None
+
+def make_pressure(client, slug, monkeypatch):
+    """Store a large link that is first in line for eviction and leave no room for another upload."""
+    assert upload(client, slug + "-old", [("old.txt", b"o" * 10000)]).status_code == 303
+    get_connection().execute("UPDATE links SET expiry='2000-01-01T00:00:00' WHERE slug=?", (slug + "-old",))
+    invalidate_link(slug + "-old")
+    monkeypatch.setattr(get_settings(), "EVICT_ON_PRESSURE", True)
+    monkeypatch.setattr(get_settings(), "DISK_BUDGET", get_total_usage() + 100)
+
+def test_pressure_evicts_the_link_closest_to_expiry(client, slug, monkeypatch):
+    make_pressure(client, slug, monkeypatch)
+    assert upload(client, slug, [("new.txt", b"n" * 100)]).status_code == 303
+    assert get_link(slug + "-old") is None
+    assert client.get(f"/download/{slug}/new.txt").content == b"n" * 100
+
+def test_pressure_evicts_nothing_for_a_wrong_password(client, slug, monkeypatch):
+    make_pressure(client, slug, monkeypatch)
+    assert upload(client, slug, [("new.txt", b"n" * 100)], pw="wrong").status_code == 401
+    assert get_link(slug + "-old") is not None
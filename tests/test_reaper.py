@@ -0,0 +1,90 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from app import background
+from app.config import get_settings
+from app.db import count_file_references, get_connection, get_link
+from app.routes import upload as upload_routes
+from app.services.layout import scan_shard
+from app.services.link_cache import invalidate_link
+from app.utils.file_utils import shard_of, slug_dir
+from tests.conftest import upload
+
+def expire(slug):
+    get_connection().execute("UPDATE links SET expiry='2000-01-01T00:00:00' WHERE slug=?", (slug,))
+    invalidate_link(slug)
+
+def test_sweep_deletes_expired_links_and_files(client, slug):
+    assert upload(client, slug, [("a.txt", b"old")]).status_code == 303
+    path = get_link(slug)[1][0]["path"]
+    expire(slug)
+    with ThreadPoolExecutor(2) as executor:
+        assert background.sweep_expired(executor) >= 1
+    assert get_link(slug) is None
+    assert not os.path.exists(path)
+    assert client.get(f"/{slug}").status_code == 404
+
+def test_batch_in_flight_spares_a_reuploaded_slug(client, slug):
+    assert upload(client, slug, [("a.txt", b"old")]).status_code == 303
+    expire(slug)
+    now = datetime.utcnow()
+    # The reaper picked the slug, then it was uploaded again to the same paths
+    batch = background.get_expired_links(now)
+    assert slug in batch
+    assert upload(client, slug, [("a.txt", b"new")]).status_code == 303
+
+    background._delete_links(map, batch, now)
+    assert client.get(f"/download/{slug}/a.txt").content == b"new"
+
+def test_reference_counts_use_the_sha256_index(client, slug):
+    assert upload(client, slug, [("a.txt", b"counted"), ("b.txt", b"counted")]).status_code == 303
+    sha256 = get_link(slug)[1][0]["sha256"]
+    assert count_file_references([sha256, "0" * 64]) == {sha256: 2}
+    plan = get_connection().execute(
+        "EXPLAIN QUERY PLAN SELECT sha256, COUNT(*) FROM files WHERE sha256 IN (?, ?) GROUP BY sha256",
+        (sha256, "0" * 64),
+    ).fetchall()
+    assert "idx_files_sha256" in " ".join(row[-1] for row in plan)
+
+def test_orphan_scan_spares_a_freshly_linked_old_blob(client, slug):
+    # A blob stored two days ago is linked into a live slug by an upload
+    # whose row is not committed yet
+    assert upload(client, slug, [("a.txt", b"live")]).status_code == 303
+    two_days_ago = time.time() - 2 * 24 * 60 * 60
+    blob = os.path.join(get_settings().UPLOAD_DIR, ".blobs", "ff", "f" * 64)
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    with open(blob, "wb") as f:
+        f.write(b"old content")
+    os.utime(blob, (two_days_ago, two_days_ago))
+    linked = os.path.join(slug_dir(slug), "b.txt")
+    os.link(blob, linked)
+    assert os.stat(linked).st_mtime < two_days_ago + 1
+
+    shard = shard_of(slug)
+    index = int(shard[:2], 16) << 8 | int(shard[3:], 16)
+    cutoff = time.time() - get_settings().ORPHAN_GRACE_SECONDS
+    scan_shard(index, cutoff)
+    assert os.path.exists(linked)
+
+    # Once past the grace period, the untracked file is an orphan
+    scan_shard(index, time.time() + 1)
+    assert not os.path.exists(linked)
+    assert client.get(f"/download/{slug}/a.txt").content == b"live"
+    os.remove(blob)
+
+def test_reaper_between_upload_write_and_commit(client, slug, monkeypatch):
+    assert upload(client, slug, [("a.txt", b"old")]).status_code == 303
+    expire(slug)
+    merge_link = upload_routes.merge_link
+
+    def reap_then_merge(*args, **kwargs):
+        # The upload's files are written; the reaper deletes the expired
+        # link and its files before the upload commits
+        assert background._delete_links(map, [slug], datetime.utcnow()) == 1
+        return merge_link(*args, **kwargs)
+
+    monkeypatch.setattr(upload_routes, "merge_link", reap_then_merge)
+    assert upload(client, slug, [("a.txt", b"new")]).status_code == 303
+    assert client.get(f"/download/{slug}/a.txt").content == b"new"
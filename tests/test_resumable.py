@@ -0,0 +1,111 @@
+import pytest
+
+import app.routes.resumable
+from app.db import claim_upload_session, get_link, get_upload_session, release_upload_session
+from app.routes.resumable import WRITE_LEASE_SECONDS
+from app.storage import get_storage
+from tests.conftest import PASSWORD
+
+def create_session(client, slug, data, filename="a.txt"):
+    """Return the session URL and the headers carrying its token."""
+    response = client.post("/api/uploads", data={
+        "pw": PASSWORD, "slug": slug, "filename": filename, "length": str(len(data)),
+    })
+    assert response.status_code == 201
+    return response.json()["url"], {"Upload-Token": response.json()["token"]}
+
+def patch(client, session, offset, data):
+    url, token = session
+    return client.patch(url, content=data, headers={"Upload-Offset": str(offset), **token})
+
+def finalize(client, slug):
+    return client.post(f"/api/uploads/{slug}/finalize", data={"pw": PASSWORD, "days": "1"})
+
+def test_chunks_resume_and_finalize(client, slug):
+    session = create_session(client, slug, b"hello world")
+    url, token = session
+    assert patch(client, session, 0, b"hello ").headers["Upload-Offset"] == "6"
+    assert client.head(url, headers=token).headers["Upload-Offset"] == "6"
+    assert patch(client, session, 0, b"again").status_code == 409
+    assert patch(client, session, 6, b"world").status_code == 204
+
+    assert finalize(client, slug).status_code == 200
+    assert client.get(f"/download/{slug}/a.txt").content == b"hello world"
+
+def test_session_requests_need_its_token(client, slug):
+    url, token = create_session(client, slug, b"hello")
+    other = create_session(client, slug, b"other", filename="b.txt")[1]
+    for headers in ({}, {"Upload-Token": "guess"}, other):
+        assert client.head(url, headers=headers).status_code == 403
+        assert client.patch(url, content=b"hello", headers={"Upload-Offset": "0", **headers}).status_code == 403
+        assert client.delete(url, headers=headers).status_code == 403
+    assert get_upload_session(url.rsplit("/", 1)[1])[3] == 0
+
+    assert client.delete(url, headers=token).status_code == 204
+    assert client.head(url, headers=token).status_code == 404
+
+def test_patch_while_another_is_writing_gets_409(client, slug):
+    session = create_session(client, slug, b"hello world")
+    session_id = session[0].rsplit("/", 1)[1]
+    # Another PATCH at offset 0 holds the session
+    assert claim_upload_session(session_id, 0, "other", WRITE_LEASE_SECONDS)
+
+    response = patch(client, session, 0, b"hello world")
+    assert response.status_code == 409
+    assert response.headers["Upload-Offset"] == "0"
+    assert get_upload_session(session_id)[3] == 0
+
+    release_upload_session(session_id, "other", 6)
+    assert patch(client, session, 0, b"hello world").status_code == 409
+    assert patch(client, session, 6, b"world").status_code == 204
+
+def test_lapsed_claim_is_taken_over(client, slug):
+    session = create_session(client, slug, b"hello")
+    session_id = session[0].rsplit("/", 1)[1]
+    assert claim_upload_session(session_id, 0, "crashed", -1)
+
+    assert patch(client, session, 0, b"hello").status_code == 204
+    # The dead writer can no longer move the offset back
+    release_upload_session(session_id, "crashed", 0)
+    assert get_upload_session(session_id)[3] == 5
+
+def test_concurrent_finalize_gets_409(client, slug, monkeypatch):
+    session = create_session(client, slug, b"hello")
+    assert patch(client, session, 0, b"hello").status_code == 204
+    describe_file = app.routes.resumable.describe_file
+    racing = []
+
+    def finalize_meanwhile(*args):
+        # A second finalize arrives once the first has moved the part file
+        racing.append(finalize(client, slug))
+        # Neither can the session be abandoned or appended to now
+        assert client.delete(session[0], headers=session[1]).status_code == 409
+        assert patch(client, session, 5, b"").status_code == 409
+        return describe_file(*args)
+
+    monkeypatch.setattr(app.routes.resumable, "describe_file", finalize_meanwhile)
+    assert finalize(client, slug).status_code == 200
+    assert racing[0].status_code == 409
+    assert client.get(f"/download/{slug}/a.txt").content == b"hello"
+
+def test_failed_finalize_hands_back_intact_sessions(client, slug, monkeypatch):
+    first = create_session(client, slug, b"hello")
+    second = create_session(client, slug, b"world", filename="b.txt")
+    assert patch(client, first, 0, b"hello").status_code == 204
+    assert patch(client, second, 0, b"world").status_code == 204
+    file_sha256 = app.routes.resumable.file_sha256
+
+    def fail_second(path):
+        if path.endswith(second[0].rsplit("/", 1)[1] + ".part"):
+            raise OSError("disk on fire")
+        return file_sha256(path)
+
+    monkeypatch.setattr(get_storage(), "needs_hash", True)
+    monkeypatch.setattr(app.routes.resumable, "file_sha256", fail_second)
+    with pytest.raises(OSError):
+        finalize(client, slug)
+    assert get_link(slug) is None
+    # The first part was consumed by publishing it; the second is still there
+    assert get_upload_session(first[0].rsplit("/", 1)[1]) is None
+    assert get_upload_session(second[0].rsplit("/", 1)[1])[5] == "open"
+    assert client.delete(second[0], headers=second[1]).status_code == 204
@@ -0,0 +1,99 @@
+import hashlib
+import io
+import os
+import threading
+import time
+import zipfile
+from datetime import datetime
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+import app.storage
+from app.config import get_settings
+from app.db import delete_link, forget_blobs, get_link, mark_blobs_deleting
+from app.storage.s3 import S3Storage
+from tests.conftest import upload
+
+BUCKET = "test-bucket"
+
+@pytest.fixture
+def s3(monkeypatch):
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN"):
+        monkeypatch.setenv(name, "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with moto.mock_aws():
+        monkeypatch.setattr(get_settings(), "S3_BUCKET", BUCKET)
+        storage = S3Storage()
+        storage.client.create_bucket(Bucket=BUCKET)
+        monkeypatch.setattr(app.storage, "_storage", storage)
+        yield storage
+
+def object_keys(storage):
+    return [o["Key"] for o in storage.client.list_objects_v2(Bucket=BUCKET).get("Contents", [])]
+
+def publish_bytes(storage, data):
+    sha256 = hashlib.sha256(data).hexdigest()
+    tmp = os.path.join(get_settings().UPLOAD_DIR, f".{sha256}.part")
+    os.makedirs(get_settings().UPLOAD_DIR, exist_ok=True)
+    with open(tmp, "wb") as f:
+        f.write(data)
+    storage.publish(tmp, "unused", sha256)
+    return sha256
+
+def test_identical_uploads_share_one_object(client, s3):
+    data = b"shared content " * 100
+    assert upload(client, "s3a", [("a.txt", data), ("b.txt", b"other")]).status_code == 303
+    assert upload(client, "s3b", [("a.txt", data)]).status_code == 303
+    assert len(object_keys(s3)) == 2
+
+    response = client.get("/download/s3a/a.txt", follow_redirects=False)
+    assert response.status_code == 302
+    assert s3.key(hashlib.sha256(data).hexdigest()) in response.headers["location"]
+
+    # The zip is built from ranged reads of the objects
+    archive = zipfile.ZipFile(io.BytesIO(client.get("/download/s3a.zip").content))
+    assert archive.read("a.txt") == data
+    assert archive.read("b.txt") == b"other"
+
+def test_prune_deletes_objects_once_unreferenced(client, s3, monkeypatch):
+    monkeypatch.setattr(get_settings(), "S3_CLAIM_SECONDS", 0)
+    data = b"pruned content"
+    sha256 = hashlib.sha256(data).hexdigest()
+    assert upload(client, "s3c", [("a.txt", data)]).status_code == 303
+    assert upload(client, "s3d", [("a.txt", data)]).status_code == 303
+
+    delete_link("s3c")
+    s3.prune([sha256])
+    assert s3.key(sha256) in object_keys(s3)
+
+    delete_link("s3d")
+    s3.prune([sha256])
+    assert s3.key(sha256) not in object_keys(s3)
+    assert get_link("s3d") is None
+
+def test_prune_spares_content_claimed_by_an_upload(s3):
+    # Published but the upload's rows are not committed yet
+    sha256 = publish_bytes(s3, b"claimed content")
+    s3.prune([sha256])
+    assert s3.key(sha256) in object_keys(s3)
+
+def test_publish_waits_for_a_delete_in_flight(s3):
+    data = b"deleted then uploaded again"
+    sha256 = publish_bytes(s3, data)
+    marked = mark_blobs_deleting([sha256], datetime.utcnow())
+    assert marked == [sha256]
+
+    publisher = threading.Thread(target=publish_bytes, args=(s3, data))
+    publisher.start()
+    time.sleep(0.5)
+    assert publisher.is_alive()
+
+    # The prune finishes its delete; the upload must store the content again
+    s3.client.delete_object(Bucket=BUCKET, Key=s3.key(sha256))
+    forget_blobs(marked)
+    publisher.join(5)
+    assert not publisher.is_alive()
+    assert s3.key(sha256) in object_keys(s3)
@@ -0,0 +1,17 @@
+import pytest
+
+from app.storage.base import StorageBackend
+from app.storage.local import LocalStorage
+
+def test_incomplete_backend_fails_when_constructed():
+    class NoOpen(StorageBackend):
+        def publish(self, tmp_path, path, sha256): pass
+        def release(self, path, sha256): pass
+        def prune(self, sha256s): pass
+        def adopt(self, path, sha256, f): pass
+        def stat(self, path, sha256): return 0, 0
+
+    with pytest.raises(TypeError, match="open"):
+        NoOpen()
+    # The shipped backend is complete
+    LocalStorage()
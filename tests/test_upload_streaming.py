@@ -0,0 +1,132 @@
+"""Upload bodies are fed to the app chunk by chunk to see how much of them is read."""
+import asyncio
+
+from app.config import get_settings
+from app.db import get_link
+from tests.conftest import PASSWORD, upload
+
+BOUNDARY = "testboundary"
+CHUNK = 64 * 1024
+CHUNKS = 100
+
+def multipart_chunks(pw, slug, size_chunks=CHUNKS, filename="big.txt", fill=b"x"):
+    """Fields first, then one file part sent in ``size_chunks`` pieces of ``fill`` bytes."""
+    head = "".join(
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+        for name, value in (("pw", pw), ("slug", slug), ("days", "1"))
+    )
+    head += (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="files"; filename="{filename}"\r\n'
+             "Content-Type: application/octet-stream\r\n\r\n")
+    yield head.encode()
+    for _ in range(size_chunks):
+        yield fill * CHUNK
+    yield f"\r\n--{BOUNDARY}--\r\n".encode()
+
+def post_streamed(app, chunks, content_length=None, headers=()):
+    """POST ``chunks`` to / through ASGI; returns (status, number of body chunks the app read)."""
+    chunks = list(chunks)
+    read = 0
+    status = None
+    headers = [(b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode()), *headers]
+    if content_length is not None:
+        headers.append((b"content-length", str(content_length).encode()))
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/", "raw_path": b"/", "root_path": "", "query_string": b"",
+        "headers": headers, "client": ("127.0.0.1", 12345), "server": ("testserver", 80),
+    }
+
+    async def receive():
+        nonlocal read
+        if read < len(chunks):
+            read += 1
+            return {"type": "http.request", "body": chunks[read - 1], "more_body": read < len(chunks)}
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    asyncio.run(app(scope, receive, send))
+    return status, read
+
+def test_bad_password_is_rejected_before_file_data(app, slug):
+    status, read = post_streamed(app, multipart_chunks("wrong", slug))
+    assert status == 401
+    # Only the chunk carrying the fields and the start of the file was read
+    assert read == 1
+    assert get_link(slug) is None
+
+def test_bad_slug_is_rejected_before_file_data(app):
+    status, read = post_streamed(app, multipart_chunks(PASSWORD, "../etc"))
+    assert status == 400
+    assert read == 1
+
+def test_streamed_upload_is_stored(app, client, slug):
+    status, read = post_streamed(app, multipart_chunks(PASSWORD, slug, 3))
+    assert status == 303
+    assert read == 5
+    assert client.get(f"/download/{slug}/big.txt").content == b"x" * CHUNK * 3
+
+def test_body_past_max_size_is_aborted(app, slug, monkeypatch):
+    monkeypatch.setattr(get_settings(), "MAX_SIZE", 10 * CHUNK)
+    # No Content-Length: the limit is enforced while the file data arrives
+    status, read = post_streamed(app, multipart_chunks(PASSWORD, slug))
+    assert status == 400
+    assert read < 15
+    assert get_link(slug) is None
+
+def test_declared_length_past_max_size_is_refused_unread(app, client, slug, monkeypatch):
+    monkeypatch.setattr(get_settings(), "MAX_SIZE", 10 * CHUNK)
+    status, read = post_streamed(app, multipart_chunks(PASSWORD, slug), content_length=CHUNKS * CHUNK)
+    assert status == 413
+    assert read == 0
+
+    assert upload(client, slug, [("small.txt", b"fits")]).status_code == 303
+
+def test_mismatched_content_is_refused_at_its_first_chunk(app, slug):
+    status, read = post_streamed(app, multipart_chunks(PASSWORD, slug, filename="report.pdf"))
+    assert status == 415
+    # The fields chunk plus the first chunk of file data
+    assert read == 2
+    assert get_link(slug) is None
+
+def test_renamed_executable_is_refused(client, slug):
+    exe = b"MZ\x90\x00\x03\x00\x00\x00" + bytes(600)
+    for name in ("photo.jpg", "notes.txt", "slides.pptx"):
+        response = upload(client, slug, [(name, exe)])
+        assert response.status_code == 415
+        assert name in response.json()["detail"]
+    assert get_link(slug) is None
+
+def test_matching_content_is_accepted(client, slug):
+    files = [("a.pdf", b"%PDF-1.7\n" + bytes(1000)), ("b.png", b"\x89PNG\r\n\x1a\n" + bytes(100)),
+             ("c.txt", "héllo".encode()), ("d.md", b"\xff\xfeh\x00i\x00"), ("e.docx", b"PK\x03\x04rest")]
+    assert upload(client, slug, files).status_code == 303
+    assert len(get_link(slug)[1]) == len(files)
+
+def test_short_files_are_checked_at_their_end(client, slug):
+    # Shorter than SNIFF_BYTES and than the PDF signature itself
+    assert upload(client, slug, [("short.pdf", b"%PD")]).status_code == 415
+    assert upload(client, slug, [("nul.txt", b"a\x00b")]).status_code == 415
+    assert upload(client, slug, [("empty.pdf", b""), ("tiny.txt", b"ok")]).status_code == 303
+
+def test_parts_split_at_any_byte_are_stored(app, client, slug):
+    body = b"".join(
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"{extra}\r\n\r\n'.encode() + value + b"\r\n"
+        for name, extra, value in (
+            ("pw", "", PASSWORD.encode()), ("slug", "", slug.encode()), ("days", "", b"1"),
+            ("files", '; filename="a.txt"', b"first file"), ("files", '; filename="b.txt"', b"second\r\nfile"),
+        )
+    ) + f"--{BOUNDARY}--\r\n".encode()
+    status, _ = post_streamed(app, [body[i:i + 7] for i in range(0, len(body), 7)])
+    assert status == 303
+    assert client.get(f"/download/{slug}/a.txt").content == b"first file"
+    assert client.get(f"/download/{slug}/b.txt").content == b"second\r\nfile"
+
+def test_too_many_files_are_refused(client, slug, monkeypatch):
+    monkeypatch.setattr(get_settings(), "MAX_FILES", 2)
+    response = upload(client, slug, [(f"{n}.txt", b"x") for n in range(3)])
+    assert response.status_code == 400
+    assert get_link(slug) is None
@@ -0,0 +1,83 @@
+import io
+import zipfile
+
+from app.db import get_link
+from app.services import zip_stream
+from app.storage import get_storage
+from tests.conftest import upload
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 4
+FOLDER = [("docs/a.txt", b"notes " * 500), ("docs/img/b.png", PNG), ("docs/img/c.md", b"# title\n")]
+
+def test_folder_upload_is_zipped_with_its_paths(client, slug):
+    assert upload(client, slug, FOLDER).status_code == 303
+    files = get_link(slug)[1]
+    assert [f["name"] for f in files] == [f"{slug}_folders_3.zip"]
+
+    response = client.get(f"/download/{slug}/{slug}_folders_3.zip")
+    with zipfile.ZipFile(io.BytesIO(response.content)) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == [name for name, _ in FOLDER]
+        for name, data in FOLDER:
+            assert zf.read(name) == data
+        # Already compressed formats are stored as they are
+        methods = {info.filename: info.compress_type for info in zf.infolist()}
+    assert methods == {"docs/a.txt": zipfile.ZIP_DEFLATED, "docs/img/b.png": zipfile.ZIP_STORED,
+                       "docs/img/c.md": zipfile.ZIP_DEFLATED}
+
+def test_download_all_is_a_deterministic_stored_zip(client, slug):
+    files = [("a.txt", b"first " * 100), ("b.png", PNG), ("c.txt", b"")]
+    assert upload(client, slug, files).status_code == 303
+
+    first = client.get(f"/download/{slug}.zip")
+    second = client.get(f"/download/{slug}.zip")
+    assert first.content == second.content
+    assert first.headers["etag"] == second.headers["etag"]
+    assert int(first.headers["content-length"]) == len(first.content)
+
+    with zipfile.ZipFile(io.BytesIO(first.content)) as zf:
+        assert zf.testzip() is None
+        assert [(i.filename, i.compress_type, i.file_size) for i in zf.infolist()] == [
+            (name, zipfile.ZIP_STORED, len(data)) for name, data in files
+        ]
+        for name, data in files:
+            assert zf.read(name) == data
+    # Each member's data follows its local header uncompressed, in upload order
+    offset = 0
+    for name, data in files:
+        header_end = offset + 30 + len(name)
+        assert first.content[offset + 30:header_end] == name.encode()
+        assert first.content[header_end:header_end + len(data)] == data
+        offset = header_end + len(data) + 16
+
+def test_download_all_is_laid_out_without_touching_storage(client, slug, monkeypatch):
+    assert upload(client, slug, [("a.txt", b"a" * 100), ("b.txt", b"b" * 50)]).status_code == 303
+    storage = get_storage()
+
+    def fail(*args):
+        raise AssertionError("storage read before the body")
+
+    for name in ("stat", "open"):
+        monkeypatch.setattr(storage, name, fail)
+    response = client.head(f"/download/{slug}.zip")
+    assert response.status_code == 200
+    assert int(response.headers["content-length"]) > 150
+
+def test_large_archive_is_written_as_zip64(client, slug, monkeypatch):
+    files = [("a.txt", b"first " * 100), ("b.txt", b"second " * 50)]
+    assert upload(client, slug, files).status_code == 303
+    # As if the archive were past 4 GiB
+    monkeypatch.setattr(zip_stream, "_ZIP32_LIMIT", 500)
+
+    response = client.get(f"/download/{slug}.zip")
+    assert int(response.headers["content-length"]) == len(response.content)
+    with zipfile.ZipFile(io.BytesIO(response.content)) as zf:
+        assert zf.testzip() is None
+        assert [(i.filename, i.file_size) for i in zf.infolist()] == [(name, len(data)) for name, data in files]
+        for name, data in files:
+            assert zf.read(name) == data
+    # The ZIP64 end record and locator come before the classic end record
+    assert response.content[-98:-94] == b"PK\x06\x06"
+    tail = client.get(f"/download/{slug}.zip", headers={"Range": "bytes=-200"})
+    assert tail.status_code == 206
+    assert tail.content == response.content[-200:]